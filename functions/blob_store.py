@@ -0,0 +1,317 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: as partes sao serializadas apenas dentro do processo
+    fcntl = None
+
+
+# Diretorio das imagens enviadas antecipadamente (compartilhado entre os workers)
+DIRETORIO_BLOBS = os.environ.get(
+    'DOCUMENTO_BLOBS_DIR',
+    os.path.join(tempfile.gettempdir(), 'documentacao_blobs')
+)
+# Tempo (s) que uma imagem sem uso continua disponivel
+TTL_BLOBS = int(os.environ.get('DOCUMENTO_BLOBS_TTL', str(6 * 60 * 60)))
+# Espaco maximo ocupado pelas imagens (MB); as menos usadas saem primeiro
+LIMITE_BLOBS_MB = int(os.environ.get('DOCUMENTO_BLOBS_MB', '512'))
+# Tempo (s) apos o ultimo uso em que a imagem nao sai pelo limite de espaco: requisicoes em
+# andamento leem o arquivo sob demanda (veja localizar_blob) e nao podem perde-lo no meio
+CARENCIA_BLOBS = int(os.environ.get('DOCUMENTO_BLOBS_CARENCIA', str(15 * 60)))
+# Intervalo minimo (s) entre duas limpezas
+INTERVALO_LIMPEZA = 60
+# Envios em partes: tamanho maximo de cada parte (MB) e pasta dos arquivos em montagem
+TAMANHO_PARTE_MB = int(os.environ.get('DOCUMENTO_UPLOAD_PARTE_MB', '8'))
+DIRETORIO_UPLOADS = os.path.join(DIRETORIO_BLOBS, 'uploads')
+
+_RE_HASH = re.compile(r'^[0-9a-f]{64}$')
+_RE_UPLOAD = re.compile(r'^[0-9a-f]{32}$')
+_lock = threading.Lock()
+_lock_partes = threading.Lock()
+_ultima_limpeza = 0.0
+
+
+class BlobNaoEncontrado(Exception):
+    """Referencia a uma imagem que nao esta (ou nao esta mais) no armazenamento."""
+
+    def __init__(self, hash_blob):
+        super().__init__(f'Imagem {hash_blob} nao encontrada. Envie o arquivo novamente.')
+        self.hash = hash_blob
+
+
+class UploadNaoEncontrado(Exception):
+    """Envio em partes desconhecido, ja concluido ou expirado."""
+
+    def __init__(self, upload_id):
+        super().__init__(f'Envio {upload_id} nao encontrado. Inicie o envio novamente.')
+        self.upload_id = upload_id
+
+
+class ParteInvalida(ValueError):
+    """Parte recusada (posicao ou checksum); offset e quanto o servidor ja recebeu."""
+
+    def __init__(self, mensagem, offset):
+        super().__init__(mensagem)
+        self.offset = offset
+
+
+def guardar_blob(dados):
+    """Guarda os bytes pelo hash SHA-256 do conteudo e retorna o hash (hex)."""
+    hash_blob = hashlib.sha256(dados).hexdigest()
+    _publicar(hash_blob, lambda arquivo: arquivo.write(dados))
+    return hash_blob
+
+
+def guardar_blob_arquivo(caminho_origem, hash_blob):
+    """Como guardar_blob, copiando de um arquivo em disco cujo hash (hex) ja e conhecido."""
+    def copiar(arquivo):
+        with open(caminho_origem, 'rb') as origem:
+            shutil.copyfileobj(origem, arquivo)
+
+    _publicar(hash_blob, copiar)
+    return hash_blob
+
+
+def iniciar_upload(tamanho, hash_esperado=None):
+    """
+    Abre um envio em partes de `tamanho` bytes e retorna seu id. As partes sao
+    gravadas direto em disco; hash_esperado (opcional) e conferido ao concluir.
+    """
+    if tamanho <= 0:
+        raise ValueError('Tamanho do envio deve ser maior que zero')
+    if hash_esperado is not None:
+        hash_esperado = hash_esperado.strip().lower()
+        if not _RE_HASH.match(hash_esperado):
+            raise ValueError('Hash esperado invalido (SHA-256 em hexadecimal)')
+
+    upload_id = uuid.uuid4().hex
+    os.makedirs(DIRETORIO_UPLOADS, exist_ok=True)
+    with open(_caminho_upload(upload_id, '.json'), 'w', encoding='utf-8') as arquivo:
+        json.dump({'tamanho': tamanho, 'hash': hash_esperado}, arquivo)
+    open(_caminho_upload(upload_id, '.parcial'), 'wb').close()
+    return upload_id
+
+
+def estado_upload(upload_id):
+    """Retorna {'offset', 'tamanho'}: quanto ja foi recebido, para retomar o envio."""
+    meta = _ler_meta_upload(upload_id)
+    try:
+        offset = os.path.getsize(_caminho_upload(upload_id, '.parcial'))
+    except FileNotFoundError:
+        raise UploadNaoEncontrado(upload_id)
+    return {'offset': offset, 'tamanho': meta['tamanho']}
+
+
+def gravar_parte(upload_id, offset, dados, checksum=None):
+    """
+    Grava uma parte a partir de offset, que deve ser exatamente o que ja foi
+    recebido. checksum (SHA-256 hex da parte), quando informado, e conferido
+    antes de gravar. Retorna o novo offset.
+
+    A conferencia do offset e a gravacao acontecem sob uma trava exclusiva do
+    envio, entao duas partes enviadas ao mesmo tempo (inclusive por workers
+    diferentes) nunca se intercalam: a segunda e recusada como fora de ordem.
+    """
+    meta = _ler_meta_upload(upload_id)
+    try:
+        arquivo = open(_caminho_upload(upload_id, '.parcial'), 'r+b')
+    except FileNotFoundError:
+        raise UploadNaoEncontrado(upload_id)
+
+    with arquivo, _travar_upload(arquivo):
+        atual = os.fstat(arquivo.fileno()).st_size
+
+        if offset != atual:
+            raise ParteInvalida(f'Parte fora de ordem: esperado offset {atual}, recebido {offset}', atual)
+        if len(dados) > TAMANHO_PARTE_MB * 1024 * 1024:
+            raise ParteInvalida(f'Parte maior que {TAMANHO_PARTE_MB} MB', atual)
+        if atual + len(dados) > meta['tamanho']:
+            raise ParteInvalida('Parte ultrapassa o tamanho declarado do envio', atual)
+        if checksum and hashlib.sha256(dados).hexdigest() != checksum.strip().lower():
+            raise ParteInvalida('Checksum da parte nao confere', atual)
+
+        arquivo.seek(offset)
+        arquivo.write(dados)
+        arquivo.truncate()
+    _tocar(_caminho_upload(upload_id, '.json'))
+    return offset + len(dados)
+
+
+def concluir_upload(upload_id):
+    """Move o arquivo montado para o armazenamento por hash e retorna o hash."""
+    meta = _ler_meta_upload(upload_id)
+    parcial = _caminho_upload(upload_id, '.parcial')
+    estado = estado_upload(upload_id)
+    if estado['offset'] != meta['tamanho']:
+        raise ParteInvalida(
+            f'Envio incompleto: {estado["offset"]} de {meta["tamanho"]} bytes recebidos', estado['offset']
+        )
+
+    resumo = hashlib.sha256()
+    with open(parcial, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+            resumo.update(bloco)
+    hash_blob = resumo.hexdigest()
+
+    if meta['hash'] and meta['hash'] != hash_blob:
+        _descartar_upload(upload_id)
+        raise ValueError('Hash do arquivo montado nao confere com o informado; envie novamente')
+
+    caminho = _caminho_blob(hash_blob)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    if os.path.exists(caminho):
+        _remover(parcial)
+        _tocar(caminho)
+    else:
+        os.replace(parcial, caminho)
+    _remover(_caminho_upload(upload_id, '.json'))
+
+    limpar_blobs()
+    return hash_blob
+
+
+def obter_blob(hash_blob):
+    """Retorna os bytes da imagem guardada; lanca BlobNaoEncontrado se nao existir."""
+    caminho = localizar_blob(hash_blob)
+    try:
+        with open(caminho, 'rb') as arquivo:
+            return arquivo.read()
+    except FileNotFoundError:
+        raise BlobNaoEncontrado(hash_blob)
+
+
+def localizar_blob(hash_blob):
+    """
+    Caminho da imagem guardada, para leitura sob demanda (sem carregar os bytes);
+    renova o prazo. Lanca BlobNaoEncontrado se nao existir.
+    """
+    hash_blob = (hash_blob or '').strip().lower()
+    if not _RE_HASH.match(hash_blob):
+        raise BlobNaoEncontrado(hash_blob)
+
+    caminho = _caminho_blob(hash_blob)
+    if not os.path.exists(caminho):
+        raise BlobNaoEncontrado(hash_blob)
+    _tocar(caminho)
+    return caminho
+
+
+def limpar_blobs(forcar=False):
+    """
+    Remove as imagens vencidas (TTL) e, se o total passar do limite, as usadas
+    ha mais tempo, exceto as usadas nos ultimos CARENCIA_BLOBS segundos (o
+    total pode ficar acima do limite enquanto elas estiverem em uso).
+    Roda no maximo uma vez por INTERVALO_LIMPEZA, salvo forcar=True.
+    """
+    global _ultima_limpeza
+
+    agora = time.time()
+    with _lock:
+        if not forcar and agora - _ultima_limpeza < INTERVALO_LIMPEZA:
+            return
+        _ultima_limpeza = agora
+
+    blobs = []
+    for raiz, _, arquivos in os.walk(DIRETORIO_BLOBS):
+        em_montagem = raiz == DIRETORIO_UPLOADS
+        for nome in arquivos:
+            caminho = os.path.join(raiz, nome)
+            try:
+                info = os.stat(caminho)
+            except FileNotFoundError:
+                continue
+            if agora - info.st_mtime > TTL_BLOBS:
+                _remover(caminho)
+            elif not em_montagem:
+                # Envios em andamento so expiram pelo prazo, nunca pelo limite de espaco
+                blobs.append((info.st_mtime, info.st_size, caminho))
+
+    total = sum(tamanho for _, tamanho, _ in blobs)
+    limite = LIMITE_BLOBS_MB * 1024 * 1024
+    for mtime, tamanho, caminho in sorted(blobs):
+        if total <= limite or agora - mtime < CARENCIA_BLOBS:
+            break
+        _remover(caminho)
+        total -= tamanho
+
+
+def _publicar(hash_blob, escrever):
+    """Grava o blob com escrever(arquivo) em um temporario e move para o lugar (atomico)."""
+    caminho = _caminho_blob(hash_blob)
+
+    if os.path.exists(caminho):
+        # Ja enviado antes: apenas renova o prazo
+        _tocar(caminho)
+    else:
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(caminho), suffix='.parcial')
+        try:
+            with os.fdopen(fd, 'wb') as arquivo:
+                escrever(arquivo)
+            os.replace(tmp_path, caminho)
+        except BaseException:
+            _remover(tmp_path)
+            raise
+
+    limpar_blobs()
+
+
+def _caminho_blob(hash_blob):
+    return os.path.join(DIRETORIO_BLOBS, hash_blob[:2], hash_blob)
+
+
+def _caminho_upload(upload_id, extensao):
+    return os.path.join(DIRETORIO_UPLOADS, upload_id + extensao)
+
+
+def _ler_meta_upload(upload_id):
+    if not _RE_UPLOAD.match(upload_id or ''):
+        raise UploadNaoEncontrado(upload_id)
+    try:
+        with open(_caminho_upload(upload_id, '.json'), encoding='utf-8') as arquivo:
+            return json.load(arquivo)
+    except FileNotFoundError:
+        raise UploadNaoEncontrado(upload_id)
+
+
+@contextmanager
+def _travar_upload(arquivo):
+    """Trava exclusiva do arquivo em montagem (entre processos com fcntl; entre threads sem ele)."""
+    if fcntl is None:
+        with _lock_partes:
+            yield
+        return
+
+    fcntl.flock(arquivo.fileno(), fcntl.LOCK_EX)
+    try:
+        yield
+    finally:
+        fcntl.flock(arquivo.fileno(), fcntl.LOCK_UN)
+
+
+def _descartar_upload(upload_id):
+    _remover(_caminho_upload(upload_id, '.parcial'))
+    _remover(_caminho_upload(upload_id, '.json'))
+
+
+def _tocar(caminho):
+    try:
+        os.utime(caminho)
+    except FileNotFoundError:
+        pass
+
+
+def _remover(caminho):
+    try:
+        os.unlink(caminho)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,222 @@
+import argparse
+import csv
+import hashlib
+import json
+import multiprocessing
+import os
+import sys
+import time
+from collections.abc import Mapping
+from functions.document_batch import ler_documento_lote, ler_manifesto, nomes_arquivos
+from functions.image_processing import RegistroImagem, criar_registro_imagem_arquivo
+from functions.job_queue import GERADORES
+
+
+# Arquivo, dentro da pasta de saida, com os documentos ja gerados (uma linha JSON por documento)
+ARQUIVO_CHECKPOINT = '.checkpoint.jsonl'
+# Colunas do CSV com campos do documento (e nao do formulario)
+COLUNAS_DOCUMENTO = ('documento', 'modelo', 'empresa', 'data_inicio', 'data_fim')
+# Separador de varias imagens em uma coluna do CSV
+SEPARADOR_IMAGENS = ';'
+
+
+class DiretorioImagens:
+    """Fotos de uma pasta, referenciadas pelo nome relativo a ela; cada uma e lida uma unica vez."""
+
+    def __init__(self, diretorio):
+        self.diretorio = os.path.abspath(diretorio)
+        self._registros = {}
+
+    def registro(self, nome):
+        """RegistroImagem da foto, ou None se ela nao existir na pasta."""
+        if nome not in self._registros:
+            caminho = os.path.abspath(os.path.join(self.diretorio, nome))
+            if not caminho.startswith(self.diretorio + os.sep) or not os.path.isfile(caminho):
+                return None
+            self._registros[nome] = criar_registro_imagem_arquivo(caminho)
+        return self._registros[nome]
+
+
+def ler_manifesto_arquivo(caminho):
+    """
+    Documentos do manifesto, no formato do lote.
+
+    O .json tem o mesmo formato do manifesto de POST /lotes. No .csv cada
+    linha e um formulario: as colunas 'documento' (nome do arquivo) e 'modelo'
+    agrupam as linhas de um mesmo documento, os campos do documento (empresa,
+    data_inicio, data_fim) vem da primeira linha do grupo e as demais colunas
+    sao os campos do formulario. Imagens sao nomes de arquivo dentro da pasta
+    de fotos (varias separadas por ';' na coluna 'imagens' do modelo 1).
+    """
+    with open(caminho, encoding='utf-8-sig', newline='') as arquivo:
+        if caminho.lower().endswith('.csv'):
+            return _documentos_csv(csv.DictReader(arquivo))
+        return ler_manifesto(arquivo.read(), limite=None)
+
+
+def gerar_em_massa(caminho_manifesto, diretorio_fotos, diretorio_saida, processos=None, retomar=False, saida=sys.stdout):
+    """
+    Gera os documentos do manifesto em diretorio_saida usando um pool de
+    processos (um documento por vez em cada processo). Com retomar=True,
+    documentos ja registrados no checkpoint (e com o arquivo presente) nao
+    sao gerados de novo; um documento alterado no manifesto, ou com alguma
+    foto alterada na pasta, e gerado outra vez.
+    Retorna a quantidade de documentos com erro.
+    """
+    documentos = ler_manifesto_arquivo(caminho_manifesto)
+    nomes = nomes_arquivos(documentos)
+    imagens = DiretorioImagens(diretorio_fotos)
+    os.makedirs(diretorio_saida, exist_ok=True)
+    caminho_checkpoint = os.path.join(diretorio_saida, ARQUIVO_CHECKPOINT)
+    concluidos = _ler_checkpoint(caminho_checkpoint) if retomar else {}
+
+    tarefas = []
+    erros = 0
+    for numero, (documento, nome) in enumerate(zip(documentos, nomes), 1):
+        try:
+            tipo, parametros = ler_documento_lote(documento, imagens)
+        except Exception as e:
+            print(f'Documento {numero} ({nome}): ERRO {e}', file=saida, flush=True)
+            erros += 1
+            continue
+        assinatura = _assinatura(documento, parametros)
+        caminho = os.path.join(diretorio_saida, nome)
+        if concluidos.get(nome) == assinatura and os.path.exists(caminho):
+            continue
+        tarefas.append((nome, tipo, _simples(parametros), caminho, assinatura))
+
+    pulados = len(documentos) - len(tarefas) - erros
+    print(
+        f'{len(tarefas)} documento(s) para gerar'
+        + (f', {pulados} ja gerado(s) no checkpoint' if pulados else ''),
+        file=saida, flush=True
+    )
+    if not tarefas:
+        return erros
+
+    processos = processos or os.cpu_count() or 1
+    contexto = multiprocessing.get_context('spawn')
+    inicio = time.time()
+    with contexto.Pool(min(processos, len(tarefas))) as pool, open(caminho_checkpoint, 'a', encoding='utf-8') as checkpoint:
+        for feitos, (nome, assinatura, erro, segundos) in enumerate(pool.imap_unordered(_gerar_documento, tarefas), 1):
+            if erro is None:
+                checkpoint.write(json.dumps({'nome': nome, 'assinatura': assinatura}) + '\n')
+                checkpoint.flush()
+                print(f'[{feitos}/{len(tarefas)}] {nome} ({segundos:.1f}s)', file=saida, flush=True)
+            else:
+                erros += 1
+                print(f'[{feitos}/{len(tarefas)}] {nome}: ERRO {erro}', file=saida, flush=True)
+
+    print(f'Concluido em {time.time() - inicio:.1f}s, {erros} erro(s)', file=saida, flush=True)
+    return erros
+
+
+def _gerar_documento(tarefa):
+    """Executado no pool: gera um documento (como um job da fila) e retorna (nome, assinatura, erro, segundos)."""
+    nome, tipo, parametros, caminho, assinatura = tarefa
+    inicio = time.time()
+    parcial = f'{caminho}.{os.getpid()}.parcial'
+    try:
+        with open(parcial, 'wb') as destino:
+            GERADORES[tipo](parametros, destino, None)
+        os.replace(parcial, caminho)
+    except Exception as e:
+        try:
+            os.unlink(parcial)
+        except FileNotFoundError:
+            pass
+        return nome, assinatura, str(e) or e.__class__.__name__, time.time() - inicio
+    return nome, assinatura, None, time.time() - inicio
+
+
+def _documentos_csv(linhas):
+    """Agrupa as linhas do CSV (uma por formulario) nos documentos do manifesto."""
+    documentos = {}
+    for numero, linha in enumerate(linhas, 2):
+        linha = {chave.strip(): (valor or '').strip() for chave, valor in linha.items() if chave}
+        nome = linha.get('documento') or f'documento-{numero}'
+        documento = documentos.get(nome)
+        if documento is None:
+            documento = documentos[nome] = {
+                chave: linha[chave] for chave in COLUNAS_DOCUMENTO if linha.get(chave)
+            }
+            documento['nome'] = nome
+            documento['formularios'] = []
+
+        modelo = str(documento.get('modelo'))
+        formulario = {}
+        for campo, valor in linha.items():
+            if campo in COLUNAS_DOCUMENTO or not valor:
+                continue
+            if modelo == '1' and campo == 'imagens':
+                formulario[campo] = [nome_imagem.strip() for nome_imagem in valor.split(SEPARADOR_IMAGENS) if nome_imagem.strip()]
+            else:
+                formulario[campo] = valor
+        documento['formularios'].append(formulario)
+
+    return ler_manifesto(json.dumps({'documentos': list(documentos.values())}), limite=None)
+
+
+def _assinatura(documento, parametros):
+    """
+    Resumo do documento: muda se qualquer campo do manifesto mudar ou se o
+    conteudo de alguma foto (hash do RegistroImagem, nos parametros) mudar.
+    """
+    resumo = hashlib.sha256(json.dumps(documento, sort_keys=True, ensure_ascii=False).encode('utf-8'))
+    for hash_imagem in _hashes_imagens(parametros):
+        resumo.update(hash_imagem)
+    return resumo.hexdigest()
+
+
+def _hashes_imagens(valor):
+    """Hashes das imagens dos parametros do documento, na ordem em que aparecem."""
+    if isinstance(valor, RegistroImagem):
+        yield valor.hash
+    elif isinstance(valor, Mapping):
+        for item in valor.values():
+            yield from _hashes_imagens(item)
+    elif isinstance(valor, (list, tuple)):
+        for item in valor:
+            yield from _hashes_imagens(item)
+
+
+def _ler_checkpoint(caminho):
+    """{nome: assinatura} dos documentos ja gerados; linhas incompletas (interrupcao) sao ignoradas."""
+    concluidos = {}
+    try:
+        with open(caminho, encoding='utf-8') as arquivo:
+            for linha in arquivo:
+                try:
+                    registro = json.loads(linha)
+                except ValueError:
+                    continue
+                concluidos[registro['nome']] = registro['assinatura']
+    except FileNotFoundError:
+        pass
+    return concluidos
+
+
+def _simples(valor):
+    """Formularios (RegistroFormulario) como dicts, para enviar aos processos do pool."""
+    if isinstance(valor, Mapping):
+        return {chave: _simples(item) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_simples(item) for item in valor]
+    return valor
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Gera documentos em massa a partir de um manifesto (.json ou .csv)')
+    parser.add_argument('manifesto', help='manifesto .json (formato do lote) ou .csv (uma linha por formulario)')
+    parser.add_argument('--fotos', required=True, help='pasta com as fotos referenciadas no manifesto')
+    parser.add_argument('--saida', required=True, help='pasta onde os .docx sao gravados')
+    parser.add_argument('--processos', type=int, default=None, help='processos em paralelo (padrao: CPUs)')
+    parser.add_argument('--retomar', action='store_true', help='pula documentos ja gerados (checkpoint da pasta de saida)')
+    args = parser.parse_args()
+
+    try:
+        total_erros = gerar_em_massa(args.manifesto, args.fotos, args.saida, args.processos, args.retomar)
+    except (OSError, ValueError) as e:
+        print(f'Erro: {e}', file=sys.stderr)
+        sys.exit(2)
+    sys.exit(1 if total_erros else 0)
@@ -0,0 +1,189 @@
+import json
+import os
+import re
+import shutil
+import zipfile
+from werkzeug.datastructures import MultiDict
+from functions.blob_store import localizar_blob
+from functions.form_readers import ler_pedido_modelo1, ler_pedido_modelo2, ler_pedido_modelo3
+from functions.image_processing import criar_registro_imagem_arquivo
+
+
+# Documentos aceitos em um lote
+LIMITE_DOCUMENTOS_LOTE = int(os.environ.get('DOCUMENTO_LOTE_MAX_DOCUMENTOS', '100'))
+# Tamanho maximo (MB) de cada imagem do .zip do lote, ja descompactada
+LIMITE_IMAGEM_LOTE_MB = int(os.environ.get('DOCUMENTO_LOTE_IMAGEM_MB', '25'))
+
+# "modelo" do manifesto -> tipo do job
+TIPOS_MODELO = {'1': 'modelo1', '2': 'modelo2', '3': 'modelo3'}
+
+RE_HASH_IMAGEM = re.compile(r'^[0-9a-f]{64}$')
+_RE_CARACTERES_NOME = re.compile(r'[^\w.\- ]+')
+
+
+def ler_manifesto(texto, limite=LIMITE_DOCUMENTOS_LOTE):
+    """
+    Le o manifesto JSON do lote: {"documentos": [{"modelo", "nome", ..., "formularios": [...]}]}.
+    Valida apenas a estrutura (ValueError); os campos de cada documento sao
+    validados pela leitura do modelo, como nas rotas de geracao.
+    limite e a quantidade maxima de documentos (None = sem limite).
+    """
+    try:
+        manifesto = json.loads(texto)
+    except ValueError:
+        raise ValueError('Manifesto do lote não é um JSON válido')
+
+    documentos = manifesto.get('documentos') if isinstance(manifesto, dict) else None
+    if not isinstance(documentos, list) or not documentos:
+        raise ValueError('O manifesto deve ter a lista "documentos" com ao menos um documento')
+    if limite is not None and len(documentos) > limite:
+        raise ValueError(f'Máximo de {limite} documentos por lote')
+
+    for numero, documento in enumerate(documentos, 1):
+        if not isinstance(documento, dict) or str(documento.get('modelo')) not in TIPOS_MODELO:
+            raise ValueError(f'Documento {numero} do lote: "modelo" deve ser 1, 2 ou 3')
+        formularios = documento.get('formularios')
+        if not isinstance(formularios, list) or not all(isinstance(f, dict) for f in formularios):
+            raise ValueError(f'Documento {numero} do lote: "formularios" deve ser uma lista de objetos')
+    return documentos
+
+
+def campos_documento(documento):
+    """
+    Converte um documento do manifesto nos campos do formulario web do modelo
+    (MultiDict '<campo>-<indice>'), para reaproveitar a leitura e a validacao
+    das rotas. Campos 'imagem...' (ou listas, como 'imagens' do modelo 1) viram
+    referencias '<campo>-<indice>_hash': nome da imagem no .zip ou hash ja enviado.
+    """
+    campos = MultiDict()
+    for chave, valor in documento.items():
+        if chave not in ('modelo', 'nome', 'formularios') and isinstance(valor, (str, int, float)):
+            campos.add(chave, str(valor))
+
+    for indice, formulario in enumerate(documento['formularios']):
+        # Modelos 2 e 3 contam os formularios pelo campo de data (pode ficar vazio)
+        if str(documento['modelo']) != '1':
+            campos.add(f'data_formulario-{indice}', str(formulario.get('data_formulario') or ''))
+        for campo, valor in formulario.items():
+            if valor is None or campo == 'data_formulario':
+                continue
+            if isinstance(valor, list):
+                for imagem in valor:
+                    campos.add(f'{campo}-{indice}_hash', str(imagem))
+            elif campo.startswith('imagem'):
+                campos.add(f'{campo}-{indice}_hash', str(valor))
+            else:
+                campos.add(f'{campo}-{indice}', str(valor))
+    return campos
+
+
+def ler_documento_lote(documento, imagens):
+    """
+    Tipo do job e parametros de um documento do manifesto, validados como nas
+    rotas de geracao. imagens e o ArquivoImagens do lote (ou qualquer objeto com
+    registro(nome)); referencias que nao estao nele devem ser hashes ja enviados.
+    """
+    tipo = TIPOS_MODELO[str(documento['modelo'])]
+    form, files = campos_documento(documento), MultiDict()
+
+    def carregar(arquivo, referencia):
+        registro = imagens.registro(referencia)
+        if registro is None:
+            if not RE_HASH_IMAGEM.match(referencia):
+                raise ValueError(f'Imagem "{referencia}" não encontrada no arquivo do lote')
+            registro = registro_blob(referencia)
+        return registro
+
+    if tipo == 'modelo1':
+        return tipo, {'formularios': ler_pedido_modelo1(form, files, carregar)}
+    if tipo == 'modelo2':
+        empresa, data_inicio, data_fim, datas_formulario, imagens_formularios = ler_pedido_modelo2(form, files, carregar)
+        return tipo, {
+            'empresa': empresa,
+            'data_inicio': data_inicio,
+            'data_fim': data_fim,
+            'datas_formulario': datas_formulario,
+            'imagens_formularios': imagens_formularios,
+        }
+    datas_formulario, unidades_formulario, imagens_formularios = ler_pedido_modelo3(form, files, carregar)
+    return tipo, {
+        'datas_formulario': datas_formulario,
+        'unidades_formulario': unidades_formulario,
+        'imagens_formularios': imagens_formularios,
+    }
+
+
+def registro_blob(hash_imagem):
+    """RegistroImagem de uma imagem do armazenamento por hash, lida do disco so quando usada"""
+    caminho = localizar_blob(hash_imagem)
+    return criar_registro_imagem_arquivo(caminho, bytes.fromhex(os.path.basename(caminho)))
+
+
+def nomes_arquivos(documentos):
+    """Nome do .docx de cada documento dentro do .zip (campo "nome" do manifesto), sem repeticoes."""
+    usados = set()
+    nomes = []
+    for numero, documento in enumerate(documentos, 1):
+        base = _RE_CARACTERES_NOME.sub('_', str(documento.get('nome') or '')).strip(' ._')
+        base = base or f'documento-{numero}'
+        nome = f'{base}.docx'
+        sufixo = 2
+        while nome.lower() in usados:
+            nome = f'{base}-{sufixo}.docx'
+            sufixo += 1
+        usados.add(nome.lower())
+        nomes.append(nome)
+    return nomes
+
+
+class ArquivoImagens:
+    """
+    Imagens do .zip enviado com o lote, referenciadas pelo nome no manifesto.
+    Cada imagem e extraida uma unica vez para a area temporaria da requisicao,
+    na primeira referencia, e o mesmo RegistroImagem serve a todos os documentos.
+    """
+
+    def __init__(self, arquivo, area):
+        self._area = area
+        self._registros = {}
+        self._zip = None
+        self._membros = {}
+        if arquivo is not None:
+            try:
+                self._zip = zipfile.ZipFile(arquivo)
+            except zipfile.BadZipFile:
+                raise ValueError('O arquivo de imagens do lote deve ser um .zip válido')
+            self._membros = {info.filename: info for info in self._zip.infolist() if not info.is_dir()}
+
+    def registro(self, nome):
+        """RegistroImagem da imagem com este nome no .zip, ou None se ela nao estiver no arquivo."""
+        info = self._membros.get(nome) or self._membros.get(nome.removeprefix('./'))
+        if info is None:
+            return None
+        # Pelo nome do membro: 'a.jpg' e './a.jpg' sao a mesma imagem
+        if info.filename in self._registros:
+            return self._registros[info.filename]
+        if info.file_size > LIMITE_IMAGEM_LOTE_MB * 1024 * 1024:
+            raise ValueError(f'Imagem "{nome}" do lote excede {LIMITE_IMAGEM_LOTE_MB} MB')
+
+        caminho = self._area.novo_caminho()
+        with self._zip.open(info) as origem, open(caminho, 'wb') as destino:
+            shutil.copyfileobj(origem, destino, 1024 * 1024)
+        registro = criar_registro_imagem_arquivo(caminho)
+        self._registros[info.filename] = registro
+        return registro
+
+    def fechar(self):
+        if self._zip is not None:
+            self._zip.close()
+
+
+def gravar_zip_lote(arquivos, destino):
+    """
+    Grava em destino (stream, pode ser nao-seekable) o .zip do lote com os
+    arquivos [(nome no zip, caminho)]. Os .docx ja sao compactados, entao
+    entram sem nova compressao.
+    """
+    with zipfile.ZipFile(destino, 'w', zipfile.ZIP_STORED) as pacote:
+        for nome, caminho in arquivos:
+            pacote.write(caminho, nome)
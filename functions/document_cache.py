@@ -0,0 +1,122 @@
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from collections.abc import Mapping
+from functions.image_processing import RegistroImagem
+from functions.template_store import obter_template
+
+
+# Orcamento de memoria do cache de documentos gerados (MB)
+LIMITE_CACHE_MB = int(os.environ.get('DOCUMENTO_CACHE_MB', '64'))
+# Maior documento transmitido em blocos que ainda e copiado para o cache (MB)
+LIMITE_COPIA_STREAM_MB = int(os.environ.get('DOCUMENTO_CACHE_STREAM_MB', '16'))
+
+
+class CacheDocumentos:
+    """
+    Cache LRU de documentos gerados, limitado pelo total de bytes guardados.
+
+    As chaves sao calculadas a partir do conteudo (modelo + campos + hash das
+    imagens), entao a mesma entrada sempre devolve os mesmos bytes.
+    """
+
+    def __init__(self, limite_bytes):
+        self.limite_bytes = limite_bytes
+        self._itens = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.acertos = 0
+        self.falhas = 0
+        self.descartes = 0
+
+    def obter(self, chave):
+        with self._lock:
+            valor = self._itens.get(chave)
+            if valor is None:
+                self.falhas += 1
+                return None
+            self._itens.move_to_end(chave)
+            self.acertos += 1
+            return valor
+
+    def guardar(self, chave, valor):
+        tamanho = len(valor)
+        if tamanho > self.limite_bytes:
+            return
+
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._total_bytes -= len(anterior)
+
+            self._itens[chave] = valor
+            self._total_bytes += tamanho
+
+            while self._total_bytes > self.limite_bytes:
+                _, descartado = self._itens.popitem(last=False)
+                self._total_bytes -= len(descartado)
+                self.descartes += 1
+
+    def obter_ou_gerar(self, chave, gerar):
+        """Retorna o documento do cache ou gera com gerar() e guarda o resultado."""
+        valor = self.obter(chave)
+        if valor is None:
+            valor = gerar()
+            self.guardar(chave, valor)
+        return valor
+
+    def estatisticas(self):
+        with self._lock:
+            consultas = self.acertos + self.falhas
+            return {
+                'acertos': self.acertos,
+                'falhas': self.falhas,
+                'taxa_acerto': round(self.acertos / consultas, 4) if consultas else 0.0,
+                'descartes': self.descartes,
+                'itens': len(self._itens),
+                'bytes': self._total_bytes,
+                'limite_bytes': self.limite_bytes,
+            }
+
+
+def chave_documento(modelo_arquivo, *valores):
+    """
+    Chave de cache de um documento: nome e versao (mtime) do modelo mais os
+    valores dos campos. Imagens entram pelo hash do conteudo.
+    """
+    resumo = hashlib.sha256()
+    resumo.update(modelo_arquivo.encode('utf-8'))
+    resumo.update(str(obter_template(modelo_arquivo).mtime).encode('ascii'))
+    for valor in valores:
+        _atualizar_resumo(resumo, valor)
+    return resumo.hexdigest()
+
+
+def _atualizar_resumo(resumo, valor):
+    if isinstance(valor, RegistroImagem):
+        resumo.update(b'I')
+        resumo.update(valor.hash)
+    elif isinstance(valor, (bytes, bytearray)):
+        resumo.update(b'B')
+        resumo.update(hashlib.sha256(valor).digest())
+    elif isinstance(valor, Mapping):
+        resumo.update(b'{')
+        for chave in sorted(valor):
+            _atualizar_resumo(resumo, chave)
+            _atualizar_resumo(resumo, valor[chave])
+        resumo.update(b'}')
+    elif isinstance(valor, (list, tuple)):
+        resumo.update(b'[')
+        for item in valor:
+            _atualizar_resumo(resumo, item)
+        resumo.update(b']')
+    else:
+        texto = '' if valor is None else str(valor)
+        resumo.update(b'S')
+        resumo.update(str(len(texto)).encode('ascii'))
+        resumo.update(b':')
+        resumo.update(texto.encode('utf-8'))
+
+
+cache_documentos = CacheDocumentos(LIMITE_CACHE_MB * 1024 * 1024)
@@ -1,15 +1,38 @@
-from docx import Document
-from docx.shared import Inches, Pt
+from docx.shared import Emu, Inches, Pt
 from docx.enum.text import WD_ALIGN_PARAGRAPH
 from docx.oxml.ns import qn
 from docx.oxml import OxmlElement
+from docx.table import _Cell
+import hashlib
 import io
 import os
-import tempfile
-import shutil
+import posixpath
+import re
+import zipfile
+from copy import deepcopy
+from lxml import etree
+from functions.image_processing import como_registro
+from functions.placeholder_engine import (
+    CampoRegra,
+    CampoTexto,
+    EspecificacaoModelo,
+    executar_plano,
+    obter_plano,
+)
+from functions.pdf_renderer import BlocoImagens, renderizar_pdf
+from functions.process_pool import dividir_em_partes, obter_pool, quantidade_partes
+from functions.template_store import obter_template
 
 
-def gerar_documento(unidade, data, legenda, imagens=None, modelo_arquivo='modelo.docx'):
+_RE_NOME_MEDIA = re.compile(r'^word/media/image(\d+)\.\w+$')
+
+# Abaixo desta quantidade de formulários o documento é montado em série (o custo de dividir e mesclar não compensa)
+MINIMO_PAGINAS_PARALELO = int(os.environ.get('DOCUMENTO_MINIMO_PAGINAS_PARALELO', '8'))
+# Menor quantidade de formulários por parte
+PAGINAS_POR_PARTE = 4
+
+
+def gerar_documento(unidade, data, legenda, imagens=None, modelo_arquivo='modelo.docx', destino=None, perfil='final'):
     """
     Carrega o modelo.docx, substitui os placeholders e insere as imagens
     e retorna o documento modificado com ajuste de altura.
@@ -19,98 +42,160 @@ def gerar_documento(unidade, data, legenda, imagens=None, modelo_arquivo='modelo
         data (str): Data formatada (DD.MM.YYYY) para substituir [DATA]
         legenda (str): Texto para substituir [LEGENDA]
         imagens (list): Lista com até 4 imagens em bytes
+        destino (file-like, opcional): Stream onde o .docx é gravado
+        perfil (str): 'final' ou 'preview' (miniaturas das imagens, mesmo layout)
     
     Returns:
-        bytes: Documento Word em bytes
+        bytes: Documento Word em bytes (ou o próprio destino, se informado)
     """
     try:
-        # Caminho do modelo
-        modelo_path = os.path.join(os.path.dirname(__file__), '..', 'documento', modelo_arquivo)
-        
-        # Verifica se o arquivo modelo existe
-        if not os.path.exists(modelo_path):
-            raise FileNotFoundError(f"Arquivo modelo não encontrado em {modelo_path}")
-        
-        if imagens is None:
-            imagens = []
-        
-        # Abre o documento modelo
-        doc = Document(modelo_path)
-        
-        # Substitui placeholders em parágrafos top-level
-        for paragrafo in doc.paragraphs:
-            texto_completo = paragrafo.text
-            
-            if '[UNIDADE]' in texto_completo or '[DATA]' in texto_completo or '[LEGENDA]' in texto_completo:
-                texto_completo = texto_completo.replace('[UNIDADE]', unidade)
-                texto_completo = texto_completo.replace('[DATA]', data)
-                texto_completo = texto_completo.replace('[LEGENDA]', legenda)
-                
-                for run in paragrafo.runs:
-                    run.text = ''
-                
-                if paragrafo.runs:
-                    paragrafo.runs[0].text = texto_completo
-                else:
-                    paragrafo.add_run(texto_completo)
-        
-        # Procura e substitui em tabelas
-        for tabela in doc.tables:
-            for linha in tabela.rows:
-                for celula in linha.cells:
-                    for paragrafo in celula.paragraphs:
-                        texto_completo = paragrafo.text
-                        
-                        # Se encontrar [IMAGENS], insere as imagens nessa célula
-                        if '[IMAGENS]' in texto_completo:
-                            # Limpa o parágrafo
-                            for run in paragrafo.runs:
-                                run.text = ''
-                            
-                            # Insere as imagens com altura de 7.5 cm
-                            if imagens:
-                                inserir_imagens_na_celula(celula, imagens, 7.5)
-                        
-                        # Substitui outros placeholders
-                        elif '[UNIDADE]' in texto_completo or '[DATA]' in texto_completo or '[LEGENDA]' in texto_completo:
-                            texto_completo = texto_completo.replace('[UNIDADE]', unidade)
-                            texto_completo = texto_completo.replace('[DATA]', data)
-                            texto_completo = texto_completo.replace('[LEGENDA]', legenda)
-                            
-                            for run in paragrafo.runs:
-                                run.text = ''
-                            
-                            if paragrafo.runs:
-                                paragrafo.runs[0].text = texto_completo
-                            else:
-                                paragrafo.add_run(texto_completo)
-        
-        # Salva o documento em um arquivo temporário e depois lê em bytes
-        fd, tmp_doc_path = tempfile.mkstemp(suffix='.docx')
-        os.close(fd)
-        
-        try:
-            doc.save(tmp_doc_path)
-            with open(tmp_doc_path, 'rb') as f:
-                doc_bytes_content = f.read()
-            return doc_bytes_content
-        finally:
-            try:
-                os.unlink(tmp_doc_path)
-            except:
-                pass
+        return _gerar_paginas([{
+            'unidade': unidade,
+            'data': data,
+            'legenda': legenda,
+            'imagens': imagens or []
+        }], modelo_arquivo, destino, perfil)
     
     except Exception as e:
         raise Exception(f"Erro ao gerar documento: {str(e)}")
 
 
-def inserir_imagens_na_celula(celula, imagens, altura_imagem_cm=7.5):
+def _gerar_paginas(formularios, modelo_arquivo, destino=None, perfil='final'):
+    """
+    Monta um único documento clonando a página do modelo uma vez por formulário
+    e preenchendo cada cópia em uma só passada, sem gerar e mesclar N pacotes.
+    
+    A estrutura do body é a mesma produzida pela mesclagem de páginas
+    (mesclar_documentos): conteúdo da página + sectPr, e uma quebra de página
+    antes de cada página seguinte. O pacote é idêntico ao de gerar cada página
+    e mesclar com mesclar_documentos; em relação à mesclagem original (antes
+    da montagem em uma passada) só mudam os identificadores: relações de
+    imagem numeradas como o python-docx (rIdN livre, não rId1000+N), ids de
+    desenho (wp:docPr) únicos no documento e imagens de conteúdo igual
+    gravadas uma única vez (o python-docx reaproveita a mídia pelo SHA-1).
+    Texto, layout e tamanho das imagens de cada página não mudam.
+    """
+    # Modelo carregado uma vez por processo (lança FileNotFoundError se não existir)
+    template = obter_template(modelo_arquivo)
+    plano = obter_plano(template, ESPEC_MODELO1)
+    _, pagina_modelo = ESPEC_MODELO1.trechos(template)
+    
+    # Cópia do documento modelo com o body vazio (apenas o sectPr final)
+    doc = template.novo_documento()
+    body = doc.element.body
+    sect_pr = body[-1] if len(body) and body[-1].tag.endswith('}sectPr') else None
+    
+    paginas = []
+    for i in range(len(formularios)):
+        if i > 0:
+            _inserir_no_body(body, sect_pr, _criar_paragrafo_quebra_pagina())
+        
+        elementos = [deepcopy(elem) for elem in pagina_modelo]
+        for elem in elementos:
+            _inserir_no_body(body, sect_pr, elem)
+        paginas.append(elementos)
+        
+        # Cada página mantém seu próprio sectPr, como no documento mesclado
+        if sect_pr is not None and i < len(formularios) - 1:
+            _inserir_no_body(body, sect_pr, deepcopy(sect_pr))
+    
+    executar_plano(plano, doc.part, [], paginas, formularios, perfil=perfil)
+    
+    # Salva direto no stream (sem arquivo temporário)
+    if destino is not None:
+        doc.save(destino)
+        return destino
+    saida = io.BytesIO()
+    doc.save(saida)
+    return saida.getvalue()
+
+
+def _regra_grade_imagens(contexto, paragrafo, texto, imagens):
+    """[IMAGENS]: limpa o parágrafo e monta a grade de imagens da célula (altura de 7.5 cm)"""
+    tc = paragrafo._element.getparent()
+    if tc.tag != qn('w:tc'):
+        return texto
+    
+    for run in paragrafo.runs:
+        run.text = ''
+    
+    if imagens:
+        inserir_imagens_na_celula(_Cell(tc, paragrafo._parent), imagens, 7.5, contexto)
+    return None
+
+
+def _caixa_grade_imagens(tamanho_px, quantidade):
+    """Caixa (cm) de cada imagem na grade: mesma largura usada em inserir_imagens_na_celula"""
+    return (9.6 if quantidade <= 2 else 6.8), 7.5
+
+
+ESPEC_MODELO1 = EspecificacaoModelo(
+    'modelo.docx',
+    [
+        CampoRegra('[IMAGENS]', 'imagens', _regra_grade_imagens, caixa=_caixa_grade_imagens),
+        CampoTexto('[UNIDADE]', 'unidade'),
+        CampoTexto('[DATA]', 'data'),
+        CampoTexto('[LEGENDA]', 'legenda'),
+    ],
+    secao='pagina'
+)
+
+
+def gerar_pdf_modelo1(formularios, destino=None, perfil='final'):
+    """
+    Renderiza os formulários direto em PDF, sem montar o DOCX: uma página por
+    formulário, com o layout do modelo.docx e a mesma grade de imagens.
+    Com destino (stream), o PDF é gravado nele e o próprio destino é retornado.
+    """
+    return renderizar_pdf(ESPEC_MODELO1, formularios, regras=REGRAS_PDF_MODELO1, destino=destino, perfil=perfil)
+
+
+def _grade_imagens_pdf(imagens):
+    """[IMAGENS] no PDF: a grade de inserir_imagens_na_celula, centralizada na célula"""
+    if not imagens:
+        return None
+    return BlocoImagens(
+        _linhas_grade_imagens(imagens),
+        espaco_linhas=Pt(6),
+        # Os dois espaços entre as imagens da mesma linha (Calibri 11)
+        espaco_imagens=Pt(5),
+        espaco_antes=0,
+        espaco_depois=0,
+        alinhamento='center',
+        centralizar_celula=True
+    )
+
+
+REGRAS_PDF_MODELO1 = {'[IMAGENS]': _grade_imagens_pdf}
+
+
+def _inserir_no_body(body, sect_pr, elemento):
+    if sect_pr is not None:
+        sect_pr.addprevious(elemento)
+    else:
+        body.append(elemento)
+
+
+def _criar_paragrafo_quebra_pagina():
+    """Mesma quebra de página usada por mesclar_documentos"""
+    page_break = etree.Element('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p')
+    pPr = etree.SubElement(page_break, '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}pPr')
+    br = etree.SubElement(pPr, '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}br')
+    br.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}type', 'page')
+    return page_break
+
+
+def inserir_imagens_na_celula(celula, imagens, altura_imagem_cm=7.5, contexto=None):
     """
     Insere as imagens em uma célula de tabela de forma apropriada:
     - 1 imagem: centralizada
     - 2 imagens: uma em cima da outra
     - 3 imagens: 2 em cima, 1 embaixo
     - 4 imagens: 2 em cima, 2 embaixo
+    
+    Cada imagem é ajustada dentro da caixa mantendo a proporção, a partir do
+    tamanho já lido no RegistroImagem. Com o contexto do documento, imagens
+    repetidas reaproveitam a mesma mídia.
     """
     num_imagens = len(imagens)
     if num_imagens == 0:
@@ -126,66 +211,54 @@ def inserir_imagens_na_celula(celula, imagens, altura_imagem_cm=7.5):
     remover_espacamento_paragrafo(primeiro_paragrafo)
     centralizar_celula_verticalmente(celula)
     
-    # Define dimensões baseado na quantidade de imagens
-    if num_imagens <= 2:
-        largura_cm = 9.6
-    else:
-        largura_cm = 6.8
+    inserir = contexto.inserir_imagem if contexto is not None else _adicionar_imagem
     
-    largura = Inches(largura_cm / 2.54)
-    altura = Inches(altura_imagem_cm / 2.54)
-    
-    if num_imagens == 1:
-        _adicionar_imagem_temp(primeiro_paragrafo, imagens[0], largura, altura)
-    
-    elif num_imagens == 2:
-        _adicionar_imagem_temp(primeiro_paragrafo, imagens[0], largura, altura)
-        primeiro_paragrafo.paragraph_format.space_after = Pt(6)
-        
-        novo_p = celula.add_paragraph()
-        novo_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        remover_espacamento_paragrafo(novo_p)
-        _adicionar_imagem_temp(novo_p, imagens[1], largura, altura)
-    
-    elif num_imagens == 3:
-        _adicionar_imagem_temp(primeiro_paragrafo, imagens[0], largura, altura)
-        primeiro_paragrafo.add_run('  ')
-        _adicionar_imagem_temp(primeiro_paragrafo, imagens[1], largura, altura)
-        primeiro_paragrafo.paragraph_format.space_after = Pt(6)
+    linhas = _linhas_grade_imagens(imagens, altura_imagem_cm)
+    paragrafo = primeiro_paragrafo
+    for i, linha in enumerate(linhas):
+        if i > 0:
+            paragrafo = celula.add_paragraph()
+            paragrafo.alignment = WD_ALIGN_PARAGRAPH.CENTER
+            remover_espacamento_paragrafo(paragrafo)
         
-        novo_p = celula.add_paragraph()
-        novo_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        remover_espacamento_paragrafo(novo_p)
-        _adicionar_imagem_temp(novo_p, imagens[2], largura, altura)
-    
-    elif num_imagens >= 4:
-        _adicionar_imagem_temp(primeiro_paragrafo, imagens[0], largura, altura)
-        primeiro_paragrafo.add_run('  ')
-        _adicionar_imagem_temp(primeiro_paragrafo, imagens[1], largura, altura)
-        primeiro_paragrafo.paragraph_format.space_after = Pt(6)
+        for j, (imagem, largura, altura) in enumerate(linha):
+            if j > 0:
+                paragrafo.add_run('  ')
+            inserir(paragrafo, imagem, largura, altura)
         
-        novo_p = celula.add_paragraph()
-        novo_p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-        remover_espacamento_paragrafo(novo_p)
-        _adicionar_imagem_temp(novo_p, imagens[2], largura, altura)
-        novo_p.add_run('  ')
-        _adicionar_imagem_temp(novo_p, imagens[3], largura, altura)
+        if i < len(linhas) - 1:
+            paragrafo.paragraph_format.space_after = Pt(6)
 
 
-def _adicionar_imagem_temp(paragrafo, imagem_bytes, largura, altura):
-    """Helper: Adiciona imagem usando arquivo temporário"""
-    fd, tmp_path = tempfile.mkstemp(suffix='.png')
-    os.close(fd)
+def _linhas_grade_imagens(imagens, altura_imagem_cm=7.5):
+    """
+    Linhas da grade de imagens da célula, [[(imagem, largura, altura)]]:
+    1 ou 2 imagens uma por linha (9.6 cm de largura), 3 ou 4 imagens duas por
+    linha (6.8 cm). Cada imagem já ajustada na caixa mantendo a proporção.
+    """
+    imagens = imagens[:4]
+    largura_caixa = Inches((9.6 if len(imagens) <= 2 else 6.8) / 2.54)
+    altura_caixa = Inches(altura_imagem_cm / 2.54)
     
-    try:
-        with open(tmp_path, 'wb') as f:
-            f.write(imagem_bytes)
-        paragrafo.add_run().add_picture(tmp_path, width=largura, height=altura)
-    finally:
-        try:
-            os.unlink(tmp_path)
-        except:
-            pass
+    ajustadas = [(imagem, *_ajustar_na_caixa(imagem, largura_caixa, altura_caixa)) for imagem in imagens]
+    if len(ajustadas) <= 2:
+        return [[ajustada] for ajustada in ajustadas]
+    return [ajustadas[:2], ajustadas[2:]]
+
+
+def _adicionar_imagem(paragrafo, imagem, largura, altura):
+    """Helper: Adiciona imagem (bytes ou RegistroImagem) a partir da memória"""
+    paragrafo.add_run().add_picture(io.BytesIO(como_registro(imagem).dados), width=largura, height=altura)
+
+
+def _ajustar_na_caixa(imagem, largura, altura):
+    """Maior tamanho que cabe na caixa largura x altura mantendo a proporção da imagem"""
+    largura_px, altura_px = como_registro(imagem).tamanho_original
+    if not largura_px or not altura_px:
+        return largura, altura
+    
+    escala = min(largura / largura_px, altura / altura_px)
+    return Emu(round(largura_px * escala)), Emu(round(altura_px * escala))
 
 
 def obter_largura_celula(celula):
@@ -252,183 +325,221 @@ def adicionar_imagem_ao_paragrafo(paragrafo, imagem_bytes, largura_inches):
     paragrafo.add_run().add_picture(imagem_stream, width=Inches(largura_inches))
 
 
-def gerar_documento_multiplo(formularios, modelo_arquivo='modelo.docx'):
+def gerar_documento_multiplo(formularios, modelo_arquivo='modelo.docx', destino=None, perfil='final'):
     """
     Gera um único documento com múltiplas páginas, uma para cada formulário.
     Mantém a mesma estrutura e formatação do documento original.
     
     Args:
         formularios (list): Lista de dicts com chaves unidade, data, legenda, imagens
+        destino (file-like, opcional): Stream onde o .docx é gravado
+        perfil (str): 'final' ou 'preview' (miniaturas das imagens, mesmo layout)
     
     Returns:
-        bytes: Documento Word em bytes com múltiplas páginas
+        bytes: Documento Word em bytes com múltiplas páginas (ou o próprio destino, se informado)
     """
     try:
-        import zipfile
-        from lxml import etree
-        
-        modelo_path = os.path.join(os.path.dirname(__file__), '..', 'documento', modelo_arquivo)
-        
-        if not os.path.exists(modelo_path):
-            raise FileNotFoundError(f"Arquivo modelo não encontrado em {modelo_path}")
-        
-        # Cria documentos temporários para cada formulário
-        temp_docs = []
-        
-        for form_data in formularios:
-            # Gera documento individual usando gerar_documento
-            doc_bytes = gerar_documento(
-                form_data['unidade'],
-                form_data['data'],
-                form_data['legenda'],
-                form_data['imagens'],
-                modelo_arquivo=modelo_arquivo
-            )
-            
-            # Salva em arquivo temporário
-            fd, tmp_path = tempfile.mkstemp(suffix='.docx')
-            os.close(fd)
-            
-            with open(tmp_path, 'wb') as f:
-                f.write(doc_bytes)
-            
-            temp_docs.append(tmp_path)
+        partes = quantidade_partes(len(formularios), MINIMO_PAGINAS_PARALELO, PAGINAS_POR_PARTE)
+        if partes <= 1:
+            return _gerar_paginas(formularios, modelo_arquivo, destino, perfil)
         
-        # Agora merges todos os documentos usando o primeiro como base
-        # e adicionando conteúdo dos demais
-        final_temp_dir = tempfile.mkdtemp()
-        final_zip_path = os.path.join(final_temp_dir, 'merged.docx')
-        
-        try:
-            # Extrai o primeiro documento como base
-            base_doc_path = temp_docs[0]
-            
-            with zipfile.ZipFile(base_doc_path, 'r') as zip_ref:
-                zip_ref.extractall(final_temp_dir)
-            
-            # Lê o document.xml e o document.xml.rels do documento base
-            doc_xml_path = os.path.join(final_temp_dir, 'word', 'document.xml')
-            rels_path = os.path.join(final_temp_dir, 'word', '_rels', 'document.xml.rels')
-            
-            doc_tree = etree.parse(doc_xml_path)
-            doc_root = doc_tree.getroot()
-            
-            rels_tree = etree.parse(rels_path)
-            rels_root = rels_tree.getroot()
-            
-            # Namespace do documento
-            ns_doc = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
-            
-            # Encontra o body do documento
-            body = doc_root.find('.//w:body', ns_doc)
+        documento = _gerar_paginas_em_paralelo(formularios, modelo_arquivo, perfil, partes)
+        if destino is not None:
+            destino.write(documento)
+            return destino
+        return documento
+    
+    except Exception as e:
+        raise Exception(f"Erro ao gerar documento múltiplo: {str(e)}")
+
+
+def _gerar_paginas_em_paralelo(formularios, modelo_arquivo, perfil, partes):
+    """
+    Divide os formulários em partes contíguas, monta cada parte (imagens e
+    páginas) em um processo do pool e mescla os pacotes na ordem original.
+    """
+    pool = obter_pool()
+    futuros = [
+        pool.submit(_gerar_paginas, fatia, modelo_arquivo, None, perfil)
+        for fatia in dividir_em_partes(formularios, partes)
+    ]
+    return mesclar_documentos([futuro.result() for futuro in futuros])
+
+
+def mesclar_documentos(documentos):
+    """
+    Mescla em memória vários .docx gerados a partir do mesmo modelo, usando o
+    primeiro como base e acrescentando o body dos demais (com quebra de página).
+    Trabalha apenas com os membros do zip em BytesIO, sem tocar no disco.
+    Imagens com o mesmo conteúdo (hash) são gravadas uma única vez e todas as
+    páginas apontam para o mesmo relacionamento.
+    
+    Args:
+        documentos (list): Lista de documentos Word em bytes
+    
+    Returns:
+        bytes: Documento Word mesclado em bytes
+    
+    Raises:
+        ValueError: se um documento referencia uma imagem que não está no seu pacote
+    """
+    ns_doc = {'w': 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'}
+    ns_rels = {'r': 'http://schemas.openxmlformats.org/package/2006/relationships'}
+    ns_ct = 'http://schemas.openxmlformats.org/package/2006/content-types'
+    tipo_imagem = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+    
+    # Lê todos os membros do documento base, preservando a ordem do zip
+    with zipfile.ZipFile(io.BytesIO(documentos[0]), 'r') as zip_ref:
+        ordem_membros = [info.filename for info in zip_ref.infolist()]
+        membros = {nome: zip_ref.read(nome) for nome in ordem_membros}
+    
+    doc_root = etree.fromstring(membros['word/document.xml'])
+    rels_root = etree.fromstring(membros['word/_rels/document.xml.rels'])
+    content_types_root = etree.fromstring(membros['[Content_Types].xml'])
+    
+    # Encontra o body do documento
+    body = doc_root.find('.//w:body', ns_doc)
+    
+    # Extensões que já possuem content type padrão no pacote
+    extensoes_registradas = {
+        default.get('Extension').lower()
+        for default in content_types_root.findall(f'{{{ns_ct}}}Default')
+    }
+    
+    # Conta quantas imagens já existem
+    media_counter = 1
+    numeros_media = [
+        int(match.group(1))
+        for match in (_RE_NOME_MEDIA.match(nome) for nome in ordem_membros)
+        if match
+    ]
+    if numeros_media:
+        media_counter = max(numeros_media) + 1
+    
+    # Ids de desenho (wp:docPr) devem ser únicos no documento: os das partes
+    # acrescentadas continuam a numeração da base
+    tag_doc_pr = qn('wp:docPr')
+    proximo_id_forma = max((int(doc_pr.get('id', 0)) for doc_pr in body.iter(tag_doc_pr)), default=0) + 1
+    
+    # Ids de relação já usados no pacote final (os novos nunca colidem com eles)
+    ids_relacoes = {rel.get('Id') for rel in rels_root}
+    
+    # Hash do conteúdo -> relação de imagem já presente no pacote final
+    relacoes_por_hash = {}
+    for rel in rels_root.findall(f'.//r:Relationship[@Type="{tipo_imagem}"]', ns_rels):
+        membro = posixpath.normpath(posixpath.join('word', rel.get('Target')))
+        if membro in membros:
+            relacoes_por_hash.setdefault(hashlib.sha256(membros[membro]).digest(), rel.get('Id'))
+    
+    for numero_documento, extra_doc_bytes in enumerate(documentos[1:], start=2):
+        with zipfile.ZipFile(io.BytesIO(extra_doc_bytes), 'r') as zip_ref:
+            extra_doc_root = etree.fromstring(zip_ref.read('word/document.xml'))
+            extra_rels_root = etree.fromstring(zip_ref.read('word/_rels/document.xml.rels'))
+            extra_content_types_root = etree.fromstring(zip_ref.read('[Content_Types].xml'))
             
-            # Processa os documentos adicionais (índice 1 em diante)
-            media_counter = 1
+            extra_body = extra_doc_root.find('.//w:body', ns_doc)
             
-            # Conta quantas imagens já existem
-            media_files = os.listdir(os.path.join(final_temp_dir, 'word', 'media'))
-            if media_files:
-                media_counter = max([int(f.replace('image', '').replace('.png', '')) for f in media_files if f.startswith('image')]) + 1
+            # Mapeamento de IDs antigos para novos (para relações)
+            rel_id_mapping = {}
             
-            for extra_doc_path in temp_docs[1:]:
-                # Extrai o documento adicional em diretório temporário
-                extra_temp_dir = tempfile.mkdtemp()
+            # Copia as relações de imagem do documento adicional
+            for extra_rel in extra_rels_root.findall(f'.//r:Relationship[@Type="{tipo_imagem}"]', ns_rels):
+                old_rel_id = extra_rel.get('Id')
+                old_target = extra_rel.get('Target')
+                old_image_member = posixpath.normpath(posixpath.join('word', old_target))
                 
-                with zipfile.ZipFile(extra_doc_path, 'r') as zip_ref:
-                    zip_ref.extractall(extra_temp_dir)
+                # Imagem vinculada (fora do pacote): copia a relação como está
+                if extra_rel.get('TargetMode') == 'External':
+                    new_rel_id = _proximo_id_relacao(ids_relacoes)
+                    ids_relacoes.add(new_rel_id)
+                    rel_id_mapping[old_rel_id] = new_rel_id
+                    rels_root.append(deepcopy(extra_rel))
+                    rels_root[-1].set('Id', new_rel_id)
+                    continue
                 
-                # Lê o document.xml do documento adicional
-                extra_doc_xml_path = os.path.join(extra_temp_dir, 'word', 'document.xml')
-                extra_doc_tree = etree.parse(extra_doc_xml_path)
-                extra_doc_root = extra_doc_tree.getroot()
-                extra_body = extra_doc_root.find('.//w:body', ns_doc)
+                # Sem a mídia, a relação apontaria para uma parte inexistente (DOCX corrompido)
+                if old_image_member not in zip_ref.NameToInfo:
+                    raise ValueError(
+                        f'Documento {numero_documento} da mesclagem referencia a imagem {old_target}, que não está no pacote'
+                    )
+                conteudo_imagem = zip_ref.read(old_image_member)
+                hash_imagem = hashlib.sha256(conteudo_imagem).digest()
                 
-                # Lê as relações do documento adicional
-                extra_rels_path = os.path.join(extra_temp_dir, 'word', '_rels', 'document.xml.rels')
-                extra_rels_tree = etree.parse(extra_rels_path)
-                extra_rels_root = extra_rels_tree.getroot()
+                # Mesma imagem já está no pacote: reaproveita a relação existente
+                if hash_imagem in relacoes_por_hash:
+                    rel_id_mapping[old_rel_id] = relacoes_por_hash[hash_imagem]
+                    continue
                 
-                # Mapeamento de IDs antigos para novos (para relações)
-                rel_id_mapping = {}
-                ns_rels = {'r': 'http://schemas.openxmlformats.org/package/2006/relationships'}
+                # Cria novo ID de relação
+                new_rel_id = _proximo_id_relacao(ids_relacoes)
+                ids_relacoes.add(new_rel_id)
+                rel_id_mapping[old_rel_id] = new_rel_id
                 
-                # Copia as relações de imagem do documento adicional
-                for extra_rel in extra_rels_root.findall('.//r:Relationship[@Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/image"]', ns_rels):
-                    old_rel_id = extra_rel.get('Id')
-                    old_target = extra_rel.get('Target')
-                    
-                    # Cria novo ID de relação
-                    new_rel_id = f'rId{999 + media_counter}'
-                    rel_id_mapping[old_rel_id] = new_rel_id
-                    
-                    # Copia o arquivo de imagem
-                    old_image_path = os.path.join(extra_temp_dir, 'word', old_target)
-                    new_image_name = f'image{media_counter}.png'
-                    new_image_path = os.path.join(final_temp_dir, 'word', 'media', new_image_name)
-                    
-                    if os.path.exists(old_image_path):
-                        shutil.copy(old_image_path, new_image_path)
-                    
-                    # Adiciona a relação ao documento final
-                    new_rel = etree.Element('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship')
-                    new_rel.set('Id', new_rel_id)
-                    new_rel.set('Type', 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image')
-                    new_rel.set('Target', f'media/{new_image_name}')
-                    rels_root.append(new_rel)
-                    
-                    media_counter += 1
+                # Copia o membro da imagem mantendo a extensão original
+                extensao = old_target.rsplit('.', 1)[-1].lower()
+                new_image_name = f'image{media_counter}.{extensao}'
                 
-                # Adiciona quebra de página antes de copiar conteúdo adicional
-                page_break = etree.Element('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}p')
-                pPr = etree.SubElement(page_break, '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}pPr')
-                br = etree.SubElement(pPr, '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}br')
-                br.set('{http://schemas.openxmlformats.org/wordprocessingml/2006/main}type', 'page')
-                body.append(page_break)
+                membros[f'word/media/{new_image_name}'] = conteudo_imagem
+                ordem_membros.append(f'word/media/{new_image_name}')
+                relacoes_por_hash[hash_imagem] = new_rel_id
                 
-                # Copia os elementos do body do documento adicional
-                for elemento in extra_body:
-                    # Atualiza as referências de relação nos elementos copiados
-                    _atualizar_refs_nos_elementos(elemento, rel_id_mapping)
-                    body.append(elemento)
+                if extensao not in extensoes_registradas:
+                    _registrar_extensao(content_types_root, extra_content_types_root, extensao)
+                    extensoes_registradas.add(extensao)
                 
-                # Limpa o diretório temporário
-                shutil.rmtree(extra_temp_dir)
-            
-            # Salva o XML atualizado
-            doc_tree.write(doc_xml_path, xml_declaration=True, encoding='UTF-8', standalone=True)
-            rels_tree.write(rels_path, xml_declaration=True, encoding='UTF-8', standalone=True)
-            
-            # Recria o arquivo DOCX
-            with zipfile.ZipFile(final_zip_path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
-                for root, dirs, files in os.walk(final_temp_dir):
-                    for file in files:
-                        if file == 'merged.docx':
-                            continue
-                        file_path = os.path.join(root, file)
-                        arcname = os.path.relpath(file_path, final_temp_dir)
-                        zip_ref.write(file_path, arcname)
-            
-            # Lê o arquivo final
-            with open(final_zip_path, 'rb') as f:
-                result_bytes = f.read()
-            
-            return result_bytes
+                # Adiciona a relação ao documento final
+                new_rel = etree.Element('{http://schemas.openxmlformats.org/package/2006/relationships}Relationship')
+                new_rel.set('Id', new_rel_id)
+                new_rel.set('Type', tipo_imagem)
+                new_rel.set('Target', f'media/{new_image_name}')
+                rels_root.append(new_rel)
+                
+                media_counter += 1
         
-        finally:
-            # Limpa os arquivos temporários
-            for doc_path in temp_docs:
-                try:
-                    os.unlink(doc_path)
-                except:
-                    pass
-            
-            try:
-                shutil.rmtree(final_temp_dir)
-            except:
-                pass
+        # Adiciona quebra de página antes de copiar conteúdo adicional
+        body.append(_criar_paragrafo_quebra_pagina())
+        
+        # Copia os elementos do body do documento adicional
+        for elemento in list(extra_body):
+            # Atualiza as referências de relação nos elementos copiados
+            _atualizar_refs_nos_elementos(elemento, rel_id_mapping)
+            for doc_pr in elemento.iter(tag_doc_pr):
+                # O nome padrão das imagens inseridas acompanha o id ("Picture N")
+                if doc_pr.get('name') == f"Picture {doc_pr.get('id')}":
+                    doc_pr.set('name', f'Picture {proximo_id_forma}')
+                doc_pr.set('id', str(proximo_id_forma))
+                proximo_id_forma += 1
+            body.append(elemento)
     
-    except Exception as e:
-        raise Exception(f"Erro ao gerar documento múltiplo: {str(e)}")
+    # Serializa o XML atualizado
+    membros['word/document.xml'] = etree.tostring(doc_root, xml_declaration=True, encoding='UTF-8', standalone=True)
+    membros['word/_rels/document.xml.rels'] = etree.tostring(rels_root, xml_declaration=True, encoding='UTF-8', standalone=True)
+    membros['[Content_Types].xml'] = etree.tostring(content_types_root, xml_declaration=True, encoding='UTF-8', standalone=True)
+    
+    # Recria o arquivo DOCX em memória
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        for nome in ordem_membros:
+            zip_ref.writestr(nome, membros[nome])
+    
+    return saida.getvalue()
+
+
+def _proximo_id_relacao(ids_relacoes):
+    """Primeiro rIdN livre, como o python-docx numera as relações (montagem em série e mesclada ficam iguais)"""
+    numero = 1
+    while f'rId{numero}' in ids_relacoes:
+        numero += 1
+    return f'rId{numero}'
+
+
+def _registrar_extensao(content_types_root, origem_root, extensao):
+    """Copia o content type padrão de uma extensão de imagem para o pacote final"""
+    ns_ct = 'http://schemas.openxmlformats.org/package/2006/content-types'
+    for default in origem_root.findall(f'{{{ns_ct}}}Default'):
+        if default.get('Extension').lower() == extensao:
+            content_types_root.insert(0, deepcopy(default))
+            return
 
 
 def _atualizar_refs_nos_elementos(elemento, rel_id_mapping):
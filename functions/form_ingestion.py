@@ -0,0 +1,152 @@
+import re
+from collections.abc import Mapping
+from datetime import datetime
+
+
+# '<campo>-<indice>' ou '<campo>-<indice>_hash' (imagem ja enviada para /imagens)
+_RE_CAMPO = re.compile(r'^(?P<campo>[A-Za-z0-9_]+?)-(?P<indice>\d+)(?P<hash>_hash)?$')
+
+
+class RegistroFormulario(Mapping):
+    """
+    Campos de um formulario repetido, em __slots__ (sem um dict por formulario).
+    Funciona como Mapping somente leitura (get, dict(registro)) sobre as chaves
+    do esquema; data e o datetime ja validado do campo de data (ou None).
+    """
+
+    __slots__ = ('indice', 'data', 'data_invalida')
+    _chaves = ()
+    _conjunto = frozenset()
+
+    def __getitem__(self, chave):
+        if chave not in self._conjunto:
+            raise KeyError(chave)
+        return getattr(self, chave)
+
+    def __iter__(self):
+        return iter(self._chaves)
+
+    def __len__(self):
+        return len(self._chaves)
+
+
+class EsquemaFormulario:
+    """
+    Esquema dos campos repetidos de um modelo ('<campo>-<indice>' no multipart).
+
+    textos e imagens sao os nomes dos campos (tambem as chaves do registro);
+    campo_data define quantos formularios existem (maior indice + 1) e e
+    convertido para datetime uma unica vez.
+    """
+
+    def __init__(self, nome, textos, imagens, campo_data='data_formulario'):
+        self.textos = tuple(textos)
+        self.imagens = tuple(imagens)
+        self.campo_data = campo_data
+        chaves = self.textos + self.imagens
+        self.registro = type(nome, (RegistroFormulario,), {
+            '__slots__': chaves,
+            '_chaves': chaves,
+            '_conjunto': frozenset(chaves),
+        })
+        self._textos = frozenset(self.textos)
+        self._imagens = frozenset(self.imagens)
+
+    def ler(self, form, files, carregar_imagem, selecionar=None, minimo=0):
+        """
+        Le os formularios em uma passada sobre os campos do form e uma sobre os arquivos.
+
+        carregar_imagem(arquivo, hash_imagem) cria o RegistroImagem (ou None);
+        e chamado uma vez por campo de imagem, assim que ele e encontrado.
+        selecionar(total), opcional, retorna os indices a carregar (ex.: intervalo
+        da pre-visualizacao); imagens dos demais formularios nem sao lidas.
+        minimo e a quantidade minima de formularios (ex.: 1 na pre-visualizacao).
+
+        Retorna (total, registros dos indices selecionados, na ordem).
+        """
+        textos = {}
+        hashes = {}
+        total = 0
+        for chave, valor in form.items(multi=True):
+            encontrado = _RE_CAMPO.match(chave)
+            if encontrado is None:
+                continue
+            campo, indice = encontrado.group('campo'), int(encontrado.group('indice'))
+            if encontrado.group('hash'):
+                if campo in self._imagens and valor.strip():
+                    hashes.setdefault((indice, campo), valor.strip())
+            elif campo in self._textos:
+                if campo == self.campo_data:
+                    total = max(total, indice + 1)
+                textos.setdefault((indice, campo), valor.strip())
+
+        total = max(total, minimo)
+        indices = list(selecionar(total)) if selecionar is not None else list(range(total))
+        registros = {indice: self._novo_registro(indice, textos) for indice in indices}
+
+        # Arquivo enviado tem prioridade sobre a referencia por hash do mesmo campo
+        for chave, arquivo in files.items(multi=True):
+            encontrado = _RE_CAMPO.match(chave)
+            if encontrado is None or encontrado.group('hash'):
+                continue
+            campo, indice = encontrado.group('campo'), int(encontrado.group('indice'))
+            registro = registros.get(indice)
+            if registro is None or campo not in self._imagens or getattr(registro, campo) is not None:
+                continue
+            setattr(registro, campo, carregar_imagem(arquivo, None))
+
+        for (indice, campo), hash_imagem in hashes.items():
+            registro = registros.get(indice)
+            if registro is not None and getattr(registro, campo) is None:
+                setattr(registro, campo, carregar_imagem(None, hash_imagem))
+
+        return total, [registros[indice] for indice in indices]
+
+    def _novo_registro(self, indice, textos):
+        registro = self.registro()
+        registro.indice = indice
+        for campo in self.textos:
+            setattr(registro, campo, textos.get((indice, campo), ''))
+        for campo in self.imagens:
+            setattr(registro, campo, None)
+
+        data_texto = textos.get((indice, self.campo_data), '')
+        registro.data = None
+        registro.data_invalida = False
+        if data_texto:
+            try:
+                registro.data = datetime.strptime(data_texto, '%Y-%m-%d')
+            except ValueError:
+                registro.data_invalida = True
+        return registro
+
+
+def data_formatada(registro):
+    """Data do formulario em dd/mm/aaaa ('' sem data valida)."""
+    return registro.data.strftime('%d/%m/%Y') if registro.data else ''
+
+
+_REFEICOES_MODELO2 = [
+    campo
+    for n in range(1, 5)
+    for campo in (
+        f'proteina_almoco_{n}', f'peso_almoco_{n}', f'proteina_jantar_{n}', f'peso_jantar_{n}'
+    )
+] + [f'acompanhamento_{refeicao}_{n}' for refeicao in ('almoco', 'jantar') for n in (1, 2)]
+
+ESQUEMA_MODELO2 = EsquemaFormulario(
+    'FormularioModelo2',
+    ['data_formulario', 'legenda_lanche', 'legenda_ceia'] + _REFEICOES_MODELO2,
+    ['imagem_lanche', 'imagem_ceia']
+    + [f'imagem_{refeicao}_{n}' for refeicao in ('almoco', 'jantar') for n in range(1, 5)]
+)
+
+ESQUEMA_MODELO3 = EsquemaFormulario(
+    'FormularioModelo3',
+    [
+        'data_formulario', 'unidade_formulario', 'legenda_cafe', 'legenda_lanche',
+        'proteina_almoco', 'peso_almoco', 'acompanhamento_almoco',
+        'proteina_jantar', 'peso_jantar', 'acompanhamento_jantar',
+    ],
+    ['imagem_cafe', 'imagem_lanche', 'imagem_almoco', 'imagem_jantar']
+)
@@ -0,0 +1,161 @@
+from datetime import datetime
+from functions.form_ingestion import ESQUEMA_MODELO2, ESQUEMA_MODELO3, data_formatada
+
+
+def ler_pedido_modelo1(form, files, carregar_imagem):
+    """
+    Le os formularios do modelo 1 ('unidade-N', 'data-N', 'legenda-N' e as imagens
+    'imagens-N') e retorna a lista de formularios (ValueError se invalido).
+    form e files sao os campos do multipart (a rota passa os da requisicao, o
+    lote os do manifesto); carregar_imagem(arquivo, hash_imagem) cria o RegistroImagem.
+    """
+    # Coleta todos os formulários no formato unidade-0, unidade-1, etc
+    formularios = []
+    form_index = 0
+    while True:
+        unidade = form.get(f'unidade-{form_index}', '').strip()
+        data_input = form.get(f'data-{form_index}', '').strip()
+        legenda = form.get(f'legenda-{form_index}', '').strip()
+
+        if not unidade and not data_input and not legenda:
+            break
+
+        # Valida campos obrigatórios do formulário
+        if not unidade or not data_input or not legenda:
+            raise ValueError(f'Todos os campos do formulário {form_index + 1} devem ser preenchidos')
+
+        # Formata a data
+        data = convertar_data(data_input)
+
+        # Processa as imagens deste formulário (arquivos enviados ou referências por hash)
+        imagens_key = f'imagens-{form_index}'
+        total_imagens = len(files.getlist(imagens_key)) + len(form.getlist(f'{imagens_key}_hash'))
+
+        if total_imagens == 0:
+            raise ValueError(f'Pelo menos uma imagem deve ser enviada no formulário {form_index + 1}')
+
+        # Limita a 4 imagens
+        if total_imagens > 4:
+            raise ValueError(f'Máximo de 4 imagens permitidas no formulário {form_index + 1}')
+
+        imagens = ler_imagens(imagens_key, form, files, carregar_imagem)
+
+        if not imagens:
+            raise ValueError(f'Pelo menos uma imagem válida deve ser enviada no formulário {form_index + 1}')
+
+        formularios.append({
+            'unidade': unidade,
+            'data': data,
+            'legenda': legenda,
+            'imagens': imagens
+        })
+
+        form_index += 1
+
+    if not formularios:
+        raise ValueError('Pelo menos um formulário deve ser preenchido')
+    return formularios
+
+
+def ler_pedido_modelo2(form, files, carregar_imagem, preview=False, selecionar=None):
+    """
+    Le o formulario do modelo 2 (ESQUEMA_MODELO2) e retorna os argumentos de
+    gerar_documento_modelo2. Na geracao valida tudo (ValueError se invalido);
+    na pre-visualizacao usa marcadores no lugar do que falta e le apenas os
+    formularios de selecionar(total) (ver EsquemaFormulario.ler).
+    """
+    empresa = form.get('empresa', '').strip()
+    data_inicio_iso = form.get('data_inicio', '').strip()
+    data_fim_iso = form.get('data_fim', '').strip()
+
+    if preview:
+        try:
+            data_inicio_obj = datetime.strptime(data_inicio_iso, '%Y-%m-%d')
+            data_fim_obj = datetime.strptime(data_fim_iso, '%Y-%m-%d')
+            data_inicio = data_inicio_obj.strftime('%d/%m/%Y')
+            data_fim = data_fim_obj.strftime('%d/%m/%Y')
+        except Exception:
+            data_inicio = '[DATA_INICIO]'
+            data_fim = '[DATA_FIM]'
+
+        _, formularios = ESQUEMA_MODELO2.ler(form, files, carregar_imagem, selecionar, minimo=1)
+        return empresa or '[EMPRESA]', data_inicio, data_fim, [data_formatada(f) for f in formularios], formularios
+
+    if not empresa:
+        empresa = form.get('unidade-0', '').strip()
+
+    if not empresa:
+        raise ValueError('O campo Empresa deve ser preenchido')
+
+    if not data_inicio_iso or not data_fim_iso:
+        raise ValueError('Os campos de Período (Data Início e Data Fim) devem ser preenchidos')
+
+    try:
+        data_inicio_obj = datetime.strptime(data_inicio_iso, '%Y-%m-%d')
+        data_fim_obj = datetime.strptime(data_fim_iso, '%Y-%m-%d')
+    except Exception:
+        raise ValueError('Formato de data inválido. Use o formato AAAA-MM-DD.')
+
+    if data_inicio_obj > data_fim_obj:
+        raise ValueError('A Data Início não pode ser maior que a Data Fim.')
+
+    total, formularios = ESQUEMA_MODELO2.ler(form, files, carregar_imagem)
+    if not total:
+        raise ValueError('Pelo menos um formulário deve existir.')
+
+    for formulario in formularios:
+        if formulario.data_invalida:
+            raise ValueError(f'Formato da Data do Formulário {formulario.indice + 1} inválido. Use AAAA-MM-DD.')
+        if formulario.data and (formulario.data < data_inicio_obj or formulario.data > data_fim_obj):
+            raise ValueError(f'A data do Formulário {formulario.indice + 1} deve estar entre Data Início e Data Fim.')
+
+    return (
+        empresa,
+        data_inicio_obj.strftime('%d/%m/%Y'),
+        data_fim_obj.strftime('%d/%m/%Y'),
+        [data_formatada(f) for f in formularios],
+        formularios
+    )
+
+
+def ler_pedido_modelo3(form, files, carregar_imagem, preview=False, selecionar=None):
+    """
+    Le o formulario do modelo 3 (ESQUEMA_MODELO3) e retorna os argumentos de
+    gerar_documento_modelo3. Na pre-visualizacao datas invalidas ficam vazias
+    e apenas os formularios de selecionar(total) sao lidos.
+    """
+    if preview:
+        _, formularios = ESQUEMA_MODELO3.ler(form, files, carregar_imagem, selecionar, minimo=1)
+    else:
+        total, formularios = ESQUEMA_MODELO3.ler(form, files, carregar_imagem)
+        if not total:
+            raise ValueError('Pelo menos um formulário deve existir.')
+        for formulario in formularios:
+            if formulario.data_invalida:
+                raise ValueError(f'Formato da Data do Formulário {formulario.indice + 1} inválido. Use AAAA-MM-DD.')
+
+    return (
+        [data_formatada(f) for f in formularios],
+        [f.unidade_formulario for f in formularios],
+        formularios
+    )
+
+
+def ler_imagens(campo, form, files, carregar_imagem):
+    """Imagens de um campo com varios arquivos: arquivos enviados e depois as referencias '<campo>_hash'"""
+    imagens = [carregar_imagem(arquivo, None) for arquivo in files.getlist(campo)]
+    imagens.extend(
+        carregar_imagem(None, hash_imagem.strip())
+        for hash_imagem in form.getlist(f'{campo}_hash')
+        if hash_imagem.strip()
+    )
+    return [imagem for imagem in imagens if imagem is not None]
+
+
+def convertar_data(data_iso):
+    """Converte data de formato ISO (YYYY-MM-DD) para DD.MM.YYYY"""
+    try:
+        data_obj = datetime.strptime(data_iso, '%Y-%m-%d')
+        return data_obj.strftime('%d.%m.%Y')
+    except Exception as e:
+        raise Exception(f"Erro ao formatar data: {str(e)}")
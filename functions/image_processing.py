@@ -0,0 +1,358 @@
+import hashlib
+import io
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from PIL import Image, ImageOps
+
+
+# Resolucao (pontos por polegada) das imagens na caixa em que sao exibidas no documento
+DPI_IMAGENS = int(os.environ.get('DOCUMENTO_IMAGEM_DPI', '150'))
+# Qualidade do JPEG gerado quando a imagem e reduzida
+QUALIDADE_JPEG = int(os.environ.get('DOCUMENTO_IMAGEM_QUALIDADE', '85'))
+# Perfil 'preview': miniaturas rapidas, suficientes para a tela
+DPI_PREVIEW = int(os.environ.get('DOCUMENTO_PREVIEW_DPI', '72'))
+QUALIDADE_PREVIEW = int(os.environ.get('DOCUMENTO_PREVIEW_QUALIDADE', '60'))
+# Threads que preparam imagens em paralelo (o Pillow libera o GIL ao decodificar/reduzir/codificar)
+THREADS_IMAGENS = int(os.environ.get('DOCUMENTO_IMAGEM_THREADS', str(min(4, os.cpu_count() or 1))))
+# Imagens ja reduzidas mantidas em memoria (MB) para os proximos documentos (ex.: lotes); 0 desativa
+LIMITE_CACHE_IMAGENS_MB = int(os.environ.get('DOCUMENTO_IMAGEM_CACHE_MB', '32'))
+
+# Perfil -> (dpi, qualidade JPEG, filtro de reamostragem)
+PERFIS_IMAGEM = {
+    'final': (DPI_IMAGENS, QUALIDADE_JPEG, Image.LANCZOS),
+    'preview': (DPI_PREVIEW, QUALIDADE_PREVIEW, Image.BILINEAR),
+}
+
+_executor = None
+_lock = threading.Lock()
+
+# (hash, caixa, quantidade, perfil) -> RegistroImagem reduzido ou _ORIGINAL (a imagem segue como veio)
+_preparadas = OrderedDict()
+_bytes_preparadas = 0
+_lock_preparadas = threading.Lock()
+_ORIGINAL = object()
+# Custo (bytes) contado por entrada do cache alem da imagem, para limitar tambem os marcadores
+_CUSTO_ENTRADA = 256
+
+# Valores da tag EXIF Orientation que giram a imagem em 90 graus (largura e altura trocam)
+_ORIENTACOES_GIRADAS = (5, 6, 7, 8)
+_TAG_ORIENTACAO = 0x0112
+
+
+class RegistroImagem:
+    """
+    Imagem enviada com seus metadados, lidos uma unica vez na chegada do upload.
+
+    largura_px/altura_px ja consideram a orientacao EXIF (tamanho exibido);
+    formato e None quando o Pillow nao reconhece o arquivo. tamanho_original
+    e o tamanho da imagem enviada, mantido nas versoes reduzidas para que o
+    layout (proporcao) seja o mesmo em qualquer perfil.
+
+    Os bytes ficam em memoria (dados) ou em um arquivo em disco (caminho);
+    no segundo caso sao lidos apenas quando a imagem e usada, sem copia mantida.
+    """
+
+    __slots__ = (
+        'hash', 'formato', 'largura_px', 'altura_px', 'dpi', 'orientacao', 'tamanho_original',
+        'caminho', 'tamanho_bytes', '_dados'
+    )
+
+    def __init__(self, hash, formato, largura_px, altura_px, dpi, orientacao, dados, tamanho_original=None, caminho=None):
+        self.hash = hash
+        self.formato = formato
+        self.largura_px = largura_px
+        self.altura_px = altura_px
+        self.dpi = dpi
+        self.orientacao = orientacao
+        self.tamanho_original = tamanho_original or (largura_px, altura_px)
+        self.caminho = caminho
+        self.tamanho_bytes = len(dados) if dados is not None else os.path.getsize(caminho)
+        self._dados = dados
+
+    @property
+    def dados(self):
+        if self._dados is not None:
+            return self._dados
+        with open(self.caminho, 'rb') as arquivo:
+            return arquivo.read()
+
+    def abrir(self):
+        """Origem para Image.open: o caminho (leitura sob demanda) ou um stream dos bytes."""
+        if self._dados is None:
+            return self.caminho
+        return io.BytesIO(self._dados)
+
+    @property
+    def tamanho(self):
+        return self.largura_px, self.altura_px
+
+    def __len__(self):
+        return self.tamanho_bytes
+
+
+def criar_registro_imagem(imagem_bytes):
+    """Cria o RegistroImagem dos bytes enviados lendo apenas o cabecalho da imagem."""
+    imagem_bytes = bytes(imagem_bytes)
+    hash_imagem = hashlib.sha256(imagem_bytes).digest()
+    return _criar_registro(hash_imagem, io.BytesIO(imagem_bytes), imagem_bytes, None)
+
+
+def criar_registro_imagem_arquivo(caminho, hash_imagem=None):
+    """
+    Cria o RegistroImagem de uma imagem gravada em disco (upload grande ou
+    imagem do armazenamento por hash). Le o cabecalho e calcula o hash (se nao
+    informado) em blocos; os bytes continuam no arquivo.
+    """
+    if hash_imagem is None:
+        resumo = hashlib.sha256()
+        with open(caminho, 'rb') as arquivo:
+            for bloco in iter(lambda: arquivo.read(1024 * 1024), b''):
+                resumo.update(bloco)
+        hash_imagem = resumo.digest()
+    return _criar_registro(hash_imagem, caminho, None, caminho)
+
+
+def _criar_registro(hash_imagem, origem, dados, caminho):
+    try:
+        with Image.open(origem) as img:
+            largura_px, altura_px = img.size
+            try:
+                orientacao = img.getexif().get(_TAG_ORIENTACAO, 1)
+            except Exception:
+                # EXIF ilegivel: a imagem e tratada como armazenada, sem trocar largura e altura
+                orientacao = 1
+            formato = img.format
+            dpi = img.info.get('dpi')
+        if orientacao in _ORIENTACOES_GIRADAS:
+            largura_px, altura_px = altura_px, largura_px
+        return RegistroImagem(hash_imagem, formato, largura_px, altura_px, dpi, orientacao, dados, caminho=caminho)
+    except Exception:
+        return RegistroImagem(hash_imagem, None, 0, 0, None, 1, dados, caminho=caminho)
+
+
+def como_registro(imagem):
+    """Aceita bytes ou RegistroImagem e retorna sempre um RegistroImagem."""
+    if isinstance(imagem, RegistroImagem):
+        return imagem
+    return criar_registro_imagem(imagem)
+
+
+def preparar_imagem(registro, caixa, quantidade=1, perfil='final'):
+    """
+    Reduz a imagem (RegistroImagem) para a caixa em que ela e exibida no documento.
+
+    caixa e (largura_cm, altura_cm) ou uma funcao (tamanho_px, quantidade) que
+    retorna essa tupla a partir do tamanho ja com a orientacao EXIF aplicada.
+    A imagem e reamostrada para cobrir a caixa na resolucao do perfil
+    ('final' ou 'preview', veja PERFIS_IMAGEM), aplicando a orientacao EXIF,
+    e recodificada em JPEG.
+
+    Retorna o proprio registro quando os bytes originais ja sao menores (e nao
+    ha rotacao a aplicar) ou quando a imagem nao pode ser lida. Se a imagem
+    precisava de rotacao e nao pode ser decodificada, os bytes seguem sem
+    rotacao e o registro retornado tem o tamanho deles, para que o layout
+    mantenha a proporcao da imagem como ela sera exibida.
+    """
+    dpi, qualidade, reamostragem = PERFIS_IMAGEM[perfil]
+
+    largura_px, altura_px = registro.tamanho
+    if registro.formato is None or not largura_px or not altura_px:
+        return registro
+
+    largura_cm, altura_cm = caixa(registro.tamanho_original, quantidade) if callable(caixa) else caixa
+    escala = max(
+        largura_cm / 2.54 * dpi / largura_px,
+        altura_cm / 2.54 * dpi / altura_px
+    )
+
+    rotacionar = registro.orientacao != 1
+    if escala >= 1 and not rotacionar:
+        return registro
+
+    destino = (
+        max(1, round(largura_px * min(escala, 1))),
+        max(1, round(altura_px * min(escala, 1)))
+    )
+
+    try:
+        with Image.open(registro.abrir()) as original:
+            img = original
+            # JPEG: decodifica ja reduzido (DCT scaling), bem mais rapido que decodificar inteiro
+            if img.format == 'JPEG':
+                girada = registro.orientacao in _ORIENTACOES_GIRADAS
+                img.draft('RGB', (destino[1], destino[0]) if girada else destino)
+
+            img = ImageOps.exif_transpose(img)
+            if img.size != destino:
+                img = img.resize(destino, reamostragem)
+
+            img = _para_rgb(img)
+            saida = io.BytesIO()
+            img.save(saida, format='JPEG', quality=qualidade)
+            reduzida = saida.getvalue()
+    except Exception:
+        # Imagem que o Pillow nao consegue decodificar segue como veio (sem a rotacao EXIF)
+        return _sem_rotacao(registro)
+
+    if not rotacionar and len(reduzida) >= len(registro):
+        return registro
+    return RegistroImagem(
+        hashlib.sha256(reduzida).digest(), 'JPEG', destino[0], destino[1], (dpi, dpi), 1, reduzida,
+        registro.tamanho_original
+    )
+
+
+def _sem_rotacao(registro):
+    """Registro com os mesmos bytes, mas com o tamanho armazenado (sem a orientacao EXIF aplicada)."""
+    if registro.orientacao not in _ORIENTACOES_GIRADAS:
+        return registro
+    altura_px, largura_px = registro.tamanho_original
+    return RegistroImagem(
+        registro.hash, registro.formato, largura_px, altura_px, registro.dpi, 1, registro._dados,
+        caminho=registro.caminho
+    )
+
+
+def dados_jpeg(registro, qualidade=QUALIDADE_JPEG):
+    """
+    Imagem (RegistroImagem) em JPEG, para destinos que so aceitam JPEG (ex.: PDF).
+    Retorna (bytes, largura_px, altura_px, modo 'RGB' ou 'L'). JPEGs em RGB ou
+    tons de cinza e sem rotacao EXIF seguem como vieram; os demais sao
+    convertidos (orientacao aplicada, transparencia sobre fundo branco).
+    """
+    with Image.open(registro.abrir()) as original:
+        if original.format == 'JPEG' and original.mode in ('RGB', 'L') and registro.orientacao == 1:
+            return registro.dados, original.width, original.height, original.mode
+
+        img = _para_rgb(ImageOps.exif_transpose(original))
+        saida = io.BytesIO()
+        img.save(saida, format='JPEG', quality=qualidade)
+        return saida.getvalue(), img.width, img.height, 'RGB'
+
+
+def dados_transparentes(registro):
+    """
+    Pixels de uma imagem (RegistroImagem) com transparencia, para destinos que
+    a preservam (ex.: PDF com mascara suave). Retorna (rgb, alfa, largura_px,
+    altura_px) em bytes crus, orientacao aplicada, ou None se a imagem e
+    opaca (use dados_jpeg).
+    """
+    with Image.open(registro.abrir()) as original:
+        if original.mode not in ('RGBA', 'LA', 'PA') and 'transparency' not in original.info:
+            return None
+        img = ImageOps.exif_transpose(original).convert('RGBA')
+        alfa = img.getchannel('A')
+        if alfa.getextrema()[0] == 255:
+            return None
+        return img.convert('RGB').tobytes(), alfa.tobytes(), img.width, img.height
+
+
+def preparar_imagens(tarefas, perfil='final', progresso=None):
+    """
+    Prepara varias imagens em paralelo no pool de threads compartilhado.
+
+    tarefas: lista de (registro, caixa, quantidade), como em preparar_imagem,
+    todas preparadas no mesmo perfil.
+    Tarefas repetidas (mesmo conteudo, caixa e quantidade) sao processadas uma
+    unica vez, e imagens ja preparadas por documentos anteriores vem do cache
+    (LIMITE_CACHE_IMAGENS_MB). Retorna os registros prontos na mesma ordem das tarefas.
+    progresso('imagens', feitas, total), opcional, e chamado a cada imagem pronta.
+    """
+    unicas = {}
+    chaves = []
+    for registro, caixa, quantidade in tarefas:
+        chave = (registro.hash, caixa, quantidade)
+        unicas.setdefault(chave, (registro, caixa, quantidade))
+        chaves.append(chave)
+
+    prontas = {}
+    pendentes = {}
+    for chave, tarefa in unicas.items():
+        guardada = _obter_preparada(chave + (perfil,))
+        if guardada is None:
+            pendentes[chave] = tarefa
+        else:
+            prontas[chave] = tarefa[0] if guardada is _ORIGINAL else guardada
+    if progresso is not None and prontas:
+        progresso('imagens', len(prontas), len(unicas))
+
+    if len(pendentes) <= 1 or THREADS_IMAGENS <= 1:
+        for chave, tarefa in pendentes.items():
+            prontas[chave] = _guardar_preparada(chave + (perfil,), tarefa[0], preparar_imagem(*tarefa, perfil=perfil))
+            if progresso is not None:
+                progresso('imagens', len(prontas), len(unicas))
+    else:
+        futuros = {
+            _obter_executor().submit(preparar_imagem, *tarefa, perfil=perfil): chave
+            for chave, tarefa in pendentes.items()
+        }
+        for futuro in as_completed(futuros):
+            chave = futuros[futuro]
+            prontas[chave] = _guardar_preparada(chave + (perfil,), pendentes[chave][0], futuro.result())
+            if progresso is not None:
+                progresso('imagens', len(prontas), len(unicas))
+
+    return [prontas[chave] for chave in chaves]
+
+
+def _obter_preparada(chave):
+    with _lock_preparadas:
+        valor = _preparadas.get(chave)
+        if valor is not None:
+            _preparadas.move_to_end(chave)
+        return valor
+
+
+def _guardar_preparada(chave, original, preparada):
+    """Guarda o resultado de preparar_imagem no cache e o retorna."""
+    global _bytes_preparadas
+    if LIMITE_CACHE_IMAGENS_MB <= 0:
+        return preparada
+
+    # O original pode estar em um arquivo temporario da requisicao: guarda apenas o marcador
+    valor = _ORIGINAL if preparada is original else preparada
+    if valor is not _ORIGINAL and preparada.caminho is not None:
+        return preparada
+    limite = LIMITE_CACHE_IMAGENS_MB * 1024 * 1024
+    if _tamanho_em_cache(valor) > limite:
+        return preparada
+
+    with _lock_preparadas:
+        anterior = _preparadas.pop(chave, None)
+        if anterior is not None:
+            _bytes_preparadas -= _tamanho_em_cache(anterior)
+        _preparadas[chave] = valor
+        _bytes_preparadas += _tamanho_em_cache(valor)
+        while _bytes_preparadas > limite:
+            _, removido = _preparadas.popitem(last=False)
+            _bytes_preparadas -= _tamanho_em_cache(removido)
+    return preparada
+
+
+def _tamanho_em_cache(valor):
+    return _CUSTO_ENTRADA + (0 if valor is _ORIGINAL else len(valor))
+
+
+def _obter_executor():
+    global _executor
+    if _executor is None:
+        with _lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=THREADS_IMAGENS, thread_name_prefix='imagens')
+    return _executor
+
+
+def _para_rgb(img):
+    """Converte para RGB, achatando transparencia sobre fundo branco."""
+    if img.mode == 'RGB':
+        return img
+    if img.mode == 'P' and 'transparency' in img.info:
+        img = img.convert('RGBA')
+    if img.mode in ('RGBA', 'LA', 'PA'):
+        img = img.convert('RGBA')
+        fundo = Image.new('RGB', img.size, (255, 255, 255))
+        fundo.paste(img, mask=img.getchannel('A'))
+        return fundo
+    return img.convert('RGB')
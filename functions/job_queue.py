@@ -0,0 +1,533 @@
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sqlite3
+import tempfile
+import threading
+import time
+import uuid
+from collections.abc import Mapping
+from functions.document_generator import gerar_documento, gerar_documento_multiplo
+from functions.document_generator2 import gerar_documento_modelo2_empresa
+from functions.document_generator3 import gerar_documento_modelo3_alipen
+from functions.image_processing import RegistroImagem, criar_registro_imagem_arquivo
+
+
+# Pasta da fila (SQLite) e dos documentos gerados, compartilhada pelos processos
+DIRETORIO_JOBS = os.environ.get(
+    'DOCUMENTO_JOBS_DIR',
+    os.path.join(tempfile.gettempdir(), 'documentacao_jobs')
+)
+# Processos worker iniciados pelo servidor web (0 = apenas workers externos: python -m functions.job_queue)
+WORKERS_JOBS = int(os.environ.get('DOCUMENTO_JOBS_WORKERS', '2'))
+# Tempo (s) que jobs finalizados e seus documentos ficam disponiveis
+TTL_JOBS = int(os.environ.get('DOCUMENTO_JOBS_TTL', str(24 * 60 * 60)))
+# Job em execucao sem sinal do worker por este tempo (s) volta para a fila (worker morreu)
+TEMPO_ABANDONO = 10 * 60
+# Intervalo (s) entre dois sinais de vida do worker enquanto gera um job (bem menor que TEMPO_ABANDONO)
+INTERVALO_SINAL = 60
+# Espera (s) do worker quando a fila esta vazia
+INTERVALO_FILA = 1.0
+# Intervalo (s) entre duas limpezas de jobs vencidos feitas por um worker
+INTERVALO_LIMPEZA = 5 * 60
+# Intervalo minimo (s) entre duas gravacoes de progresso do mesmo job
+INTERVALO_PROGRESSO = 0.5
+# Tentativas de um job antes de ser marcado como erro
+MAX_TENTATIVAS = 3
+
+ESTADO_PENDENTE = 'pendente'
+ESTADO_EXECUTANDO = 'executando'
+ESTADO_CONCLUIDO = 'concluido'
+ESTADO_ERRO = 'erro'
+
+_SQL_INSERIR_JOB = (
+    'INSERT INTO jobs (id, tipo, estado, parametros, progresso, criado, atualizado, tentativas) '
+    'VALUES (?, ?, ?, ?, ?, ?, ?, 0)'
+)
+
+_workers = []
+_workers_pid = None
+_lock = threading.Lock()
+
+
+def _gerar_modelo1(parametros, destino, progresso):
+    formularios = parametros['formularios']
+    if len(formularios) == 1:
+        formulario = formularios[0]
+        gerar_documento(
+            formulario['unidade'], formulario['data'], formulario['legenda'], formulario['imagens'], destino=destino
+        )
+    else:
+        gerar_documento_multiplo(formularios, destino=destino)
+
+
+def _gerar_modelo2(parametros, destino, progresso):
+    gerar_documento_modelo2_empresa(
+        parametros['empresa'],
+        parametros['data_inicio'],
+        parametros['data_fim'],
+        parametros['datas_formulario'],
+        parametros['imagens_formularios'],
+        destino=destino,
+        progresso=progresso
+    )
+
+
+def _gerar_modelo3(parametros, destino, progresso):
+    gerar_documento_modelo3_alipen(
+        parametros['datas_formulario'],
+        parametros['unidades_formulario'],
+        parametros['imagens_formularios'],
+        destino=destino,
+        progresso=progresso
+    )
+
+
+# Tipo do job -> funcao (parametros, destino, progresso) que grava o .docx em destino
+GERADORES = {
+    'modelo1': _gerar_modelo1,
+    'modelo2': _gerar_modelo2,
+    'modelo3': _gerar_modelo3,
+}
+
+
+def enviar_job(tipo, parametros):
+    """
+    Coloca a geracao de um documento na fila e retorna o id do job.
+    Imagens (RegistroImagem ou bytes) nos parametros vao para a pasta do job
+    (ver _serializar); a fila guarda apenas as referencias.
+    """
+    job_id, linha = _novo_job(tipo, parametros, time.time())
+    try:
+        with _conectar() as conexao:
+            conexao.execute(_SQL_INSERIR_JOB, linha)
+    except BaseException:
+        _remover_imagens_job(job_id)
+        raise
+    iniciar_workers()
+    return job_id
+
+
+def enviar_lote(documentos):
+    """
+    Coloca na fila um job por documento do lote e retorna o id do lote.
+    documentos: lista de (nome do arquivo, tipo, parametros), como em enviar_job.
+    Os documentos sao gerados em paralelo pelos workers, cada um com seu progresso.
+    """
+    lote_id = uuid.uuid4().hex
+    agora = time.time()
+    linhas = []
+    itens = []
+    try:
+        for nome, tipo, parametros in documentos:
+            job_id, linha = _novo_job(tipo, parametros, agora)
+            linhas.append(linha)
+            itens.append({'nome': nome, 'job_id': job_id})
+
+        with _conectar() as conexao:
+            conexao.execute('BEGIN')
+            conexao.executemany(_SQL_INSERIR_JOB, linhas)
+            conexao.execute(
+                'INSERT INTO lotes (id, documentos, criado) VALUES (?, ?, ?)', (lote_id, json.dumps(itens), agora)
+            )
+            conexao.execute('COMMIT')
+    except BaseException:
+        for item in itens:
+            _remover_imagens_job(item['job_id'])
+        raise
+    iniciar_workers()
+    return lote_id
+
+
+def obter_job(job_id):
+    """Estado do job ({id, tipo, estado, progresso, erro, criado, atualizado}) ou None."""
+    with _conectar() as conexao:
+        linha = conexao.execute(
+            'SELECT id, tipo, estado, progresso, erro, criado, atualizado FROM jobs WHERE id = ?', (job_id,)
+        ).fetchone()
+    if linha is None:
+        return None
+    return {
+        'id': linha[0],
+        'tipo': linha[1],
+        'estado': linha[2],
+        'progresso': json.loads(linha[3] or '{}'),
+        'erro': linha[4],
+        'criado': linha[5],
+        'atualizado': linha[6],
+    }
+
+
+def obter_lote(lote_id):
+    """
+    Estado do lote ou None: {id, estado, criado, concluidos, total, documentos},
+    com nome, job_id, estado, progresso e erro de cada documento.
+    O lote esta concluido quando todos os documentos estao; erro quando todos
+    terminaram e algum falhou.
+    """
+    with _conectar() as conexao:
+        linha = conexao.execute('SELECT documentos, criado FROM lotes WHERE id = ?', (lote_id,)).fetchone()
+        if linha is None:
+            return None
+        itens = json.loads(linha[0])
+        marcadores = ', '.join('?' for _ in itens)
+        jobs = {
+            job[0]: job
+            for job in conexao.execute(
+                f'SELECT id, estado, progresso, erro FROM jobs WHERE id IN ({marcadores})',
+                [item['job_id'] for item in itens]
+            )
+        }
+
+    documentos = []
+    for item in itens:
+        job = jobs.get(item['job_id'])
+        documentos.append({
+            'nome': item['nome'],
+            'job_id': item['job_id'],
+            'estado': job[1] if job else ESTADO_ERRO,
+            'progresso': json.loads(job[2] or '{}') if job else {},
+            'erro': job[3] if job else 'Job expirado',
+        })
+
+    estados = [documento['estado'] for documento in documentos]
+    if all(estado == ESTADO_CONCLUIDO for estado in estados):
+        estado = ESTADO_CONCLUIDO
+    elif any(estado in (ESTADO_PENDENTE, ESTADO_EXECUTANDO) for estado in estados):
+        estado = ESTADO_PENDENTE if all(e == ESTADO_PENDENTE for e in estados) else ESTADO_EXECUTANDO
+    else:
+        estado = ESTADO_ERRO
+
+    return {
+        'id': lote_id,
+        'estado': estado,
+        'criado': linha[1],
+        'concluidos': estados.count(ESTADO_CONCLUIDO),
+        'total': len(documentos),
+        'documentos': documentos,
+    }
+
+
+def caminho_resultado(job_id):
+    """Caminho do .docx gerado pelo job."""
+    return os.path.join(DIRETORIO_JOBS, 'resultados', f'{job_id}.docx')
+
+
+def diretorio_imagens_job(job_id):
+    """Pasta com as imagens do job, mantida ate o job terminar."""
+    return os.path.join(DIRETORIO_JOBS, 'imagens', job_id)
+
+
+def iniciar_workers(quantidade=None):
+    """
+    Inicia (uma vez por processo) os processos worker que consomem a fila.
+    Os workers usam 'spawn' para nao herdar threads e conexoes do servidor.
+    """
+    global _workers_pid
+
+    quantidade = WORKERS_JOBS if quantidade is None else quantidade
+    if quantidade <= 0:
+        return
+
+    with _lock:
+        if _workers_pid == os.getpid() and all(worker.is_alive() for worker in _workers):
+            return
+        _workers[:] = [worker for worker in _workers if _workers_pid == os.getpid() and worker.is_alive()]
+        contexto = multiprocessing.get_context('spawn')
+        while len(_workers) < quantidade:
+            worker = contexto.Process(target=executar_worker, name='documentacao-job-worker', daemon=True)
+            worker.start()
+            _workers.append(worker)
+        _workers_pid = os.getpid()
+
+
+def executar_worker(parar=None):
+    """Laco do worker: reserva o job pendente mais antigo, gera o documento e repete."""
+    nome = f'worker-{os.getpid()}'
+    ultima_limpeza = 0.0
+
+    while parar is None or not parar.is_set():
+        if time.time() - ultima_limpeza > INTERVALO_LIMPEZA:
+            limpar_jobs()
+            ultima_limpeza = time.time()
+
+        job = _reservar_job(nome)
+        if job is None:
+            time.sleep(INTERVALO_FILA)
+            continue
+        _executar_job(*job, nome)
+
+
+def limpar_jobs():
+    """Remove jobs finalizados ha mais de TTL_JOBS e seus documentos."""
+    limite = time.time() - TTL_JOBS
+    with _conectar() as conexao:
+        vencidos = [
+            linha[0] for linha in conexao.execute(
+                'SELECT id FROM jobs WHERE estado IN (?, ?) AND atualizado < ?',
+                (ESTADO_CONCLUIDO, ESTADO_ERRO, limite)
+            )
+        ]
+        conexao.executemany('DELETE FROM jobs WHERE id = ?', [(job_id,) for job_id in vencidos])
+        conexao.execute('DELETE FROM lotes WHERE criado < ?', (limite,))
+    for job_id in vencidos:
+        _remover_imagens_job(job_id)
+        try:
+            os.unlink(caminho_resultado(job_id))
+        except FileNotFoundError:
+            pass
+
+
+def _reservar_job(nome_worker):
+    """
+    Marca como 'executando' o job pendente mais antigo (ou um abandonado por um
+    worker que morreu) e retorna (id, tipo, parametros). A transacao IMMEDIATE
+    garante que dois workers nunca reservem o mesmo job.
+    """
+    agora = time.time()
+    conexao = _conectar()
+    try:
+        conexao.execute('BEGIN IMMEDIATE')
+        linha = conexao.execute(
+            'SELECT id, tipo, parametros, tentativas FROM jobs '
+            'WHERE estado = ? OR (estado = ? AND atualizado < ?) '
+            'ORDER BY criado LIMIT 1',
+            (ESTADO_PENDENTE, ESTADO_EXECUTANDO, agora - TEMPO_ABANDONO)
+        ).fetchone()
+        if linha is None:
+            conexao.execute('COMMIT')
+            return None
+
+        job_id, tipo, parametros, tentativas = linha
+        if tentativas >= MAX_TENTATIVAS:
+            conexao.execute(
+                'UPDATE jobs SET estado = ?, erro = ?, atualizado = ? WHERE id = ?',
+                (ESTADO_ERRO, 'O job foi interrompido repetidas vezes', agora, job_id)
+            )
+            conexao.execute('COMMIT')
+            _remover_imagens_job(job_id)
+            return None
+
+        conexao.execute(
+            'UPDATE jobs SET estado = ?, worker = ?, atualizado = ?, tentativas = tentativas + 1 WHERE id = ?',
+            (ESTADO_EXECUTANDO, nome_worker, agora, job_id)
+        )
+        conexao.execute('COMMIT')
+        return job_id, tipo, parametros
+    except BaseException:
+        if conexao.in_transaction:
+            conexao.execute('ROLLBACK')
+        raise
+    finally:
+        conexao.close()
+
+
+def _executar_job(job_id, tipo, parametros, nome_worker):
+    progresso = _ProgressoJob(job_id)
+    caminho = caminho_resultado(job_id)
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    parcial = f'{caminho}.{os.getpid()}.parcial'
+
+    # Sinal de vida independente do progresso (nem todo gerador informa progresso)
+    parar_sinal = threading.Event()
+    sinal = threading.Thread(
+        target=_manter_sinal_de_vida, args=(job_id, nome_worker, parar_sinal), name=f'sinal-{job_id}', daemon=True
+    )
+    sinal.start()
+    try:
+        with open(parcial, 'wb') as destino:
+            GERADORES[tipo](_desserializar(json.loads(parametros), diretorio_imagens_job(job_id)), destino, progresso)
+        os.replace(parcial, caminho)
+    except Exception as e:
+        try:
+            os.unlink(parcial)
+        except FileNotFoundError:
+            pass
+        _finalizar_job(job_id, ESTADO_ERRO, progresso.valores, str(e))
+        return
+    finally:
+        parar_sinal.set()
+        sinal.join()
+    _finalizar_job(job_id, ESTADO_CONCLUIDO, progresso.valores, None)
+
+
+def _manter_sinal_de_vida(job_id, nome_worker, parar):
+    """
+    Renova 'atualizado' do job a cada INTERVALO_SINAL enquanto o worker o gera,
+    para que um job longo nao seja tomado como abandonado e reservado de novo.
+    """
+    while not parar.wait(INTERVALO_SINAL):
+        try:
+            with _conectar() as conexao:
+                conexao.execute(
+                    'UPDATE jobs SET atualizado = ? WHERE id = ? AND estado = ? AND worker = ?',
+                    (time.time(), job_id, ESTADO_EXECUTANDO, nome_worker)
+                )
+        except sqlite3.Error:
+            # Fila ocupada: tenta de novo no proximo intervalo
+            continue
+
+
+def _novo_job(tipo, parametros, agora):
+    """(id, linha para _SQL_INSERIR_JOB) de um job pendente; as imagens vao para a pasta do job."""
+    if tipo not in GERADORES:
+        raise ValueError(f'Tipo de job desconhecido: {tipo}')
+    job_id = uuid.uuid4().hex
+    try:
+        parametros = _serializar(parametros, diretorio_imagens_job(job_id))
+    except BaseException:
+        _remover_imagens_job(job_id)
+        raise
+    return job_id, (job_id, tipo, ESTADO_PENDENTE, json.dumps(parametros), '{}', agora, agora)
+
+
+def _finalizar_job(job_id, estado, progresso, erro):
+    with _conectar() as conexao:
+        conexao.execute(
+            'UPDATE jobs SET estado = ?, progresso = ?, erro = ?, atualizado = ? WHERE id = ?',
+            (estado, json.dumps(progresso), erro, time.time(), job_id)
+        )
+    _remover_imagens_job(job_id)
+
+
+class _ProgressoJob:
+    """Callback de progresso de executar_plano que grava na fila (com intervalo minimo entre gravacoes)."""
+
+    _NOMES = {
+        'imagens': ('imagens_processadas', 'imagens_total'),
+        'paginas': ('paginas_concluidas', 'paginas_total'),
+    }
+
+    def __init__(self, job_id):
+        self.job_id = job_id
+        self.valores = {}
+        self._ultima_gravacao = 0.0
+
+    def __call__(self, etapa, feitos, total):
+        nome_feitos, nome_total = self._NOMES[etapa]
+        self.valores[nome_feitos] = feitos
+        self.valores[nome_total] = total
+
+        agora = time.time()
+        if agora - self._ultima_gravacao < INTERVALO_PROGRESSO and feitos < total:
+            return
+        self._ultima_gravacao = agora
+        # Tambem serve de sinal de vida do worker (atualizado)
+        with _conectar() as conexao:
+            conexao.execute(
+                'UPDATE jobs SET progresso = ?, atualizado = ? WHERE id = ?',
+                (json.dumps(self.valores), agora, self.job_id)
+            )
+
+
+def _serializar(valor, diretorio):
+    """
+    Parametros do job em JSON. As imagens sao gravadas em diretorio (a pasta do
+    job) pelo hash, e nao no armazenamento por hash: la elas podem vencer (TTL
+    ou limite de espaco) antes de um worker reservar o job.
+    """
+    if isinstance(valor, RegistroImagem):
+        if valor.caminho is not None:
+            return {'__imagem__': _guardar_imagem_job(diretorio, valor.hash.hex(), caminho=valor.caminho)}
+        return {'__imagem__': _guardar_imagem_job(diretorio, valor.hash.hex(), dados=valor.dados)}
+    if isinstance(valor, (bytes, bytearray)):
+        return {'__imagem__': _guardar_imagem_job(diretorio, hashlib.sha256(valor).hexdigest(), dados=bytes(valor))}
+    if isinstance(valor, Mapping):
+        return {chave: _serializar(item, diretorio) for chave, item in valor.items()}
+    if isinstance(valor, (list, tuple)):
+        return [_serializar(item, diretorio) for item in valor]
+    return valor
+
+
+def _desserializar(valor, diretorio):
+    if isinstance(valor, dict):
+        if set(valor) == {'__imagem__'}:
+            hash_imagem = valor['__imagem__']
+            return criar_registro_imagem_arquivo(os.path.join(diretorio, hash_imagem), bytes.fromhex(hash_imagem))
+        return {chave: _desserializar(item, diretorio) for chave, item in valor.items()}
+    if isinstance(valor, list):
+        return [_desserializar(item, diretorio) for item in valor]
+    return valor
+
+
+def _guardar_imagem_job(diretorio, hash_imagem, caminho=None, dados=None):
+    """
+    Grava a imagem (arquivo em caminho ou bytes em dados) em diretorio/<hash>.
+    Arquivos entram por hard link (sem copia; continua valido mesmo se a
+    origem for removida) e, em outro sistema de arquivos, por copia.
+    Retorna o hash.
+    """
+    destino = os.path.join(diretorio, hash_imagem)
+    if os.path.exists(destino):
+        return hash_imagem
+    os.makedirs(diretorio, exist_ok=True)
+
+    if caminho is not None:
+        try:
+            os.link(caminho, destino)
+            return hash_imagem
+        except OSError:
+            pass
+
+    parcial = f'{destino}.parcial'
+    if caminho is not None:
+        shutil.copyfile(caminho, parcial)
+    else:
+        with open(parcial, 'wb') as arquivo:
+            arquivo.write(dados)
+    os.replace(parcial, destino)
+    return hash_imagem
+
+
+def _remover_imagens_job(job_id):
+    shutil.rmtree(diretorio_imagens_job(job_id), ignore_errors=True)
+
+
+def _conectar():
+    """Conexao com a fila; cria o banco (modo WAL, varios processos) na primeira vez."""
+    os.makedirs(DIRETORIO_JOBS, exist_ok=True)
+    conexao = sqlite3.connect(os.path.join(DIRETORIO_JOBS, 'jobs.sqlite3'), timeout=30, isolation_level=None)
+    conexao.execute('PRAGMA journal_mode=WAL')
+    conexao.execute(
+        'CREATE TABLE IF NOT EXISTS jobs ('
+        'id TEXT PRIMARY KEY, tipo TEXT NOT NULL, estado TEXT NOT NULL, parametros TEXT NOT NULL, '
+        'progresso TEXT, erro TEXT, worker TEXT, criado REAL NOT NULL, atualizado REAL NOT NULL, '
+        'tentativas INTEGER NOT NULL DEFAULT 0)'
+    )
+    conexao.execute('CREATE INDEX IF NOT EXISTS jobs_estado ON jobs (estado, criado)')
+    conexao.execute(
+        'CREATE TABLE IF NOT EXISTS lotes (id TEXT PRIMARY KEY, documentos TEXT NOT NULL, criado REAL NOT NULL)'
+    )
+    return _ConexaoFila(conexao)
+
+
+class _ConexaoFila:
+    """sqlite3.Connection em autocommit que fecha ao sair do bloco with."""
+
+    def __init__(self, conexao):
+        self._conexao = conexao
+
+    def __getattr__(self, nome):
+        return getattr(self._conexao, nome)
+
+    def __enter__(self):
+        return self._conexao
+
+    def __exit__(self, *excecao):
+        self._conexao.close()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Workers da fila de geracao de documentos')
+    parser.add_argument('--workers', type=int, default=max(1, WORKERS_JOBS), help='quantidade de processos worker')
+    args = parser.parse_args()
+
+    if args.workers == 1:
+        executar_worker()
+    else:
+        iniciar_workers(args.workers)
+        for processo in list(_workers):
+            processo.join()
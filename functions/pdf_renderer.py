@@ -0,0 +1,1484 @@
+import io
+import posixpath
+import re
+import unicodedata
+import zlib
+from docx.oxml.ns import qn
+from docx.shared import Emu
+from lxml import etree
+from functions.image_processing import como_registro, dados_jpeg, dados_transparentes
+from functions.placeholder_engine import CampoImagem, CampoRegra, preparar_formularios
+from functions.template_store import obter_template
+
+
+class _Fonte:
+    """
+    Metricas de uma fonte dos modelos. O PDF referencia a fonte pelo nome, sem
+    embuti-la (o leitor usa a instalada ou uma substituta com estas larguras).
+
+    larguras: caracteres 32-126 em 1/1000 do tamanho, sem e com negrito;
+    extras: demais caracteres (letras acentuadas usam a largura da letra base);
+    altura_linha e linha_base: linha simples do Word e linha de base em
+    relacao ao tamanho; descritor: entradas do FontDescriptor.
+    """
+
+    __slots__ = ('nome_pdf', 'larguras', 'extras', 'altura_linha', 'linha_base', 'descritor')
+
+    def __init__(self, nome_pdf, larguras, extras, altura_linha, linha_base, descritor):
+        self.nome_pdf = nome_pdf
+        self.larguras = larguras
+        self.extras = extras
+        self.altura_linha = altura_linha
+        self.linha_base = linha_base
+        self.descritor = descritor
+
+
+_FONTES = {
+    'Calibri': _Fonte(
+        b'Calibri',
+        {
+            False: (
+                226, 326, 401, 498, 507, 715, 682, 221, 303, 303, 498, 498, 250, 306, 252, 386,
+                507, 507, 507, 507, 507, 507, 507, 507, 507, 507, 268, 268, 498, 498, 498, 463,
+                894, 579, 544, 533, 615, 488, 459, 631, 623, 252, 319, 520, 420, 855, 646, 662,
+                517, 673, 543, 459, 487, 642, 567, 890, 519, 487, 468, 307, 386, 307, 498, 498,
+                291, 479, 525, 423, 525, 498, 305, 471, 525, 230, 239, 455, 230, 799, 525, 527,
+                525, 525, 349, 391, 335, 525, 452, 715, 433, 453, 395, 314, 460, 314, 498,
+            ),
+            True: (
+                226, 326, 438, 498, 507, 729, 705, 233, 312, 312, 498, 498, 258, 306, 267, 430,
+                507, 507, 507, 507, 507, 507, 507, 507, 507, 507, 276, 276, 498, 498, 498, 463,
+                898, 606, 561, 529, 630, 488, 459, 637, 631, 267, 331, 547, 423, 874, 659, 676,
+                532, 686, 563, 473, 495, 653, 591, 906, 551, 520, 478, 325, 430, 325, 498, 498,
+                300, 494, 537, 418, 537, 503, 316, 474, 537, 246, 255, 480, 246, 813, 537, 538,
+                537, 537, 355, 399, 347, 537, 473, 745, 459, 474, 397, 344, 475, 344, 498,
+            ),
+        },
+        {
+            '\xa0': (226, 226), '–': (498, 498), '—': (905, 905), '‘': (250, 258), '’': (250, 258),
+            '“': (418, 438), '”': (418, 438), '•': (498, 498), '…': (690, 705), 'º': (422, 436),
+            'ª': (402, 414), '°': (339, 339), '§': (498, 498), '€': (507, 507),
+        },
+        1.22, 0.952,
+        b'/Flags 32 /FontBBox [-503 -250 1240 750] /ItalicAngle 0 /Ascent 750 /Descent -250 /CapHeight 632',
+    ),
+    'Arial': _Fonte(
+        b'Arial',
+        {
+            False: (
+                278, 278, 355, 556, 556, 889, 667, 191, 333, 333, 389, 584, 278, 333, 278, 278,
+                556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 278, 278, 584, 584, 584, 556,
+                1015, 667, 667, 722, 722, 667, 611, 778, 722, 278, 500, 667, 556, 833, 722, 778,
+                667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 278, 278, 278, 469, 556,
+                333, 556, 556, 500, 556, 556, 278, 556, 556, 222, 222, 500, 222, 833, 556, 556,
+                556, 556, 333, 500, 278, 556, 500, 722, 500, 500, 500, 334, 260, 334, 584,
+            ),
+            True: (
+                278, 333, 474, 556, 556, 889, 722, 238, 333, 333, 389, 584, 278, 333, 278, 278,
+                556, 556, 556, 556, 556, 556, 556, 556, 556, 556, 333, 333, 584, 584, 584, 611,
+                975, 722, 722, 722, 722, 667, 611, 778, 722, 278, 556, 722, 611, 833, 722, 778,
+                667, 778, 722, 667, 611, 722, 667, 944, 667, 667, 611, 333, 278, 333, 584, 556,
+                333, 556, 611, 556, 611, 556, 333, 611, 611, 278, 278, 556, 278, 889, 611, 611,
+                611, 611, 389, 556, 333, 611, 556, 778, 556, 556, 500, 389, 280, 389, 584,
+            ),
+        },
+        {
+            '\xa0': (278, 278), '–': (556, 556), '—': (1000, 1000), '‘': (222, 278), '’': (222, 278),
+            '“': (333, 500), '”': (333, 500), '•': (350, 350), '…': (1000, 1000), 'º': (365, 365),
+            'ª': (370, 370), '°': (400, 400), '§': (556, 556), '€': (556, 556),
+        },
+        1.15, 0.905,
+        b'/Flags 32 /FontBBox [-665 -210 2000 728] /ItalicAngle 0 /Ascent 905 /Descent -212 /CapHeight 716',
+    ),
+    'Times New Roman': _Fonte(
+        b'TimesNewRoman',
+        {
+            False: (
+                250, 333, 408, 500, 500, 833, 778, 180, 333, 333, 500, 564, 250, 333, 250, 278,
+                500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 278, 278, 564, 564, 564, 444,
+                921, 722, 667, 667, 722, 611, 556, 722, 722, 333, 389, 722, 611, 889, 722, 722,
+                556, 722, 667, 556, 611, 722, 722, 944, 722, 722, 611, 333, 278, 333, 469, 500,
+                333, 444, 500, 444, 500, 444, 333, 500, 500, 278, 278, 500, 278, 778, 500, 500,
+                500, 500, 333, 389, 278, 500, 500, 722, 500, 500, 444, 480, 200, 480, 541,
+            ),
+            True: (
+                250, 333, 555, 500, 500, 1000, 833, 278, 333, 333, 500, 570, 250, 333, 250, 278,
+                500, 500, 500, 500, 500, 500, 500, 500, 500, 500, 333, 333, 570, 570, 570, 500,
+                930, 722, 667, 722, 722, 667, 611, 778, 778, 389, 500, 778, 667, 944, 722, 778,
+                611, 778, 722, 556, 667, 722, 722, 1000, 722, 722, 667, 333, 278, 333, 581, 500,
+                333, 500, 556, 444, 556, 444, 333, 500, 556, 278, 333, 556, 278, 833, 556, 500,
+                556, 556, 444, 389, 333, 556, 500, 722, 500, 500, 444, 394, 220, 394, 520,
+            ),
+        },
+        {
+            '\xa0': (250, 250), '–': (500, 500), '—': (1000, 1000), '‘': (333, 333), '’': (333, 333),
+            '“': (444, 500), '”': (444, 500), '•': (350, 350), '…': (1000, 1000), 'º': (310, 330),
+            'ª': (276, 300), '°': (400, 400), '§': (500, 500), '€': (500, 500),
+        },
+        1.15, 0.891,
+        b'/Flags 34 /FontBBox [-568 -216 2000 693] /ItalicAngle 0 /Ascent 891 /Descent -216 /CapHeight 662',
+    ),
+}
+# Fonte do Word quando nem o estilo nem o run definem uma (w:rFonts ausente)
+_FONTE_PADRAO = 'Times New Roman'
+
+# Margem interna esquerda/direita das celulas sem tblCellMar (padrao do Word, 108 twips)
+_MARGEM_CELULA = 5.4
+# Espacamento automatico (beforeAutospacing/afterAutospacing) usado pelo Word
+_ESPACO_AUTOMATICO = 14
+
+_RE_PALAVRA = re.compile(r'\s*\S+\s*')
+_RE_COR = re.compile(r'[0-9A-Fa-f]{6}')
+
+_TAG_P = qn('w:p')
+_TAG_TBL = qn('w:tbl')
+_TAG_R = qn('w:r')
+_TAG_T = qn('w:t')
+_TAG_TAB = qn('w:tab')
+_TAG_BR = qn('w:br')
+_TAG_PPR = qn('w:pPr')
+_TAG_RPR = qn('w:rPr')
+_TAG_TCPR = qn('w:tcPr')
+_TAG_DRAWING = qn('w:drawing')
+_ATTR_VAL = qn('w:val')
+_ATTR_TYPE = qn('w:type')
+_ATTR_W = qn('w:w')
+_ATTR_ID = qn('r:id')
+_NS_REL = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+# Elementos que o renderizador reproduz (ou que nao aparecem na pagina); qualquer outro
+# no modelo levanta LayoutNaoSuportado em vez de sumir do PDF
+_IGNORADOS = {qn('w:bookmarkStart'), qn('w:bookmarkEnd'), qn('w:proofErr'), qn('w:permStart'), qn('w:permEnd')}
+_FILHOS_PARAGRAFO = _IGNORADOS | {_TAG_PPR, _TAG_R}
+_FILHOS_RUN = {_TAG_RPR, _TAG_T, _TAG_TAB, _TAG_BR, qn('w:lastRenderedPageBreak')}
+_PROPRIEDADES_TABELA = {
+    'tblPr': {'tblStyle', 'tblW', 'tblInd', 'tblBorders', 'tblLayout', 'tblLook', 'tblCellMar', 'jc', 'tblCaption', 'tblDescription'},
+    'trPr': {'trHeight', 'cantSplit', 'cnfStyle'},
+    'tcPr': {'tcW', 'gridSpan', 'vAlign', 'tcBorders', 'shd', 'cnfStyle'},
+}
+_PROPRIEDADES_SECAO = {
+    'headerReference', 'footerReference', 'pgSz', 'pgMar', 'cols', 'docGrid', 'paperSrc',
+    'printerSettings', 'formProt', 'pgNumType', 'footnotePr', 'endnotePr', 'type', 'titlePg',
+}
+# Formatacao de caractere e de paragrafo que o PDF nao desenha (ver _efeito_ativo)
+_EFEITOS_TEXTO = (
+    'i', 'u', 'strike', 'dstrike', 'caps', 'smallCaps', 'highlight', 'vanish', 'vertAlign', 'shd',
+    'spacing', 'w', 'position', 'bdr', 'em', 'outline', 'shadow', 'emboss', 'imprint',
+)
+_EFEITOS_PARAGRAFO = ('numPr', 'pBdr', 'shd', 'framePr', 'bidi', 'contextualSpacing', 'textDirection', 'sectPr')
+# Estilos de borda desenhados como linha continua
+_BORDAS_CONTINUAS = {'single', 'thick'}
+
+
+class LayoutNaoSuportado(Exception):
+    """
+    Construcao do modelo que o PDF nao reproduz fielmente (tabela aninhada,
+    lista numerada, fonte sem metricas, imagem girada...). Levantada antes do
+    primeiro byte do PDF; as rotas respondem 501 e o DOCX segue disponivel.
+    """
+
+
+class BlocoImagens:
+    """
+    Paragrafo de imagens no PDF: linhas de (imagem, largura, altura), cada
+    linha centralizada no paragrafo. Retornado pelas regras de layout dos
+    modelos (veja renderizar_pdf) e usado para os CampoImagem.
+
+    Medidas em Length (Emu); espacamentos e alinhamento None mantem os do modelo.
+    """
+
+    __slots__ = ('linhas', 'espaco_linhas', 'espaco_imagens', 'espaco_antes', 'espaco_depois', 'alinhamento', 'centralizar_celula')
+
+    def __init__(self, linhas, espaco_linhas=0, espaco_imagens=0, espaco_antes=None, espaco_depois=None, alinhamento=None, centralizar_celula=False):
+        self.linhas = linhas
+        self.espaco_linhas = espaco_linhas
+        self.espaco_imagens = espaco_imagens
+        self.espaco_antes = espaco_antes
+        self.espaco_depois = espaco_depois
+        self.alinhamento = alinhamento
+        self.centralizar_celula = centralizar_celula
+
+
+def renderizar_pdf(espec, formularios, globais=None, substituicoes=None, regras=None, destino=None, perfil='final'):
+    """
+    Renderiza o documento do modelo direto em PDF, sem montar o DOCX.
+
+    O layout vem do proprio .docx do modelo (pagina, margens, estilos, fontes,
+    tabelas com suas bordas, cabecalho e rodape com as imagens ancoradas) e os
+    placeholders sao preenchidos pelos campos da especificacao, como em
+    executar_plano: CampoImagem usa o layout do campo e CampoRegra a regra de
+    regras[placeholder](valor), que retorna um BlocoImagens (ou None, sem
+    imagens). substituicoes tem, por secao, os textos trocados ao montar a
+    estrutura (ex.: {'[DATA]': ...}). Cada secao comeca em uma nova pagina,
+    como as paginas de formulario do modelo.
+
+    Modelos com construcoes que o renderizador nao diagrama levantam
+    LayoutNaoSuportado antes de qualquer byte ser gravado. Limites que
+    continuam valendo: as fontes nao sao embutidas e o texto contorna as
+    imagens pela caixa delas (nao pelo poligono de wrapTight).
+
+    Com destino (stream, pode ser nao-seekable) o PDF e gravado nele e o
+    proprio destino e retornado; senao, retorna os bytes.
+    """
+    template = obter_template(espec.arquivo)
+    modelo = template.derivado(('pdf',), ModeloPdf)
+    capa, secao = espec.trechos(template)
+    formularios = preparar_formularios(espec, formularios, perfil)
+    total = len(substituicoes) if substituicoes is not None else len(formularios)
+
+    def blocos_secao(i):
+        dados = (formularios[i] or {}) if i < len(formularios) else {}
+        return conversor.blocos(secao, dados, substituicoes[i] if substituicoes is not None else {}, modelo.largura_texto)
+
+    # Capa e primeira secao convertidas antes de gravar: um layout sem suporte falha sem PDF pela metade
+    conversor = _Conversor(modelo, espec.campos, globais, regras or {})
+    blocos_capa = conversor.blocos(capa, {}, {}, modelo.largura_texto)
+    primeira = blocos_secao(0) if total else []
+
+    saida = destino if destino is not None else io.BytesIO()
+    documento = _DocumentoPdf(modelo, saida)
+    documento.adicionar(blocos_capa)
+    for i in range(total):
+        if i > 0:
+            documento.nova_pagina()
+        documento.adicionar(primeira if i == 0 else blocos_secao(i))
+    documento.finalizar()
+
+    if destino is not None:
+        return destino
+    return saida.getvalue()
+
+
+class ModeloPdf:
+    """
+    Pagina, estilos, cabecalho e rodape de um modelo .docx, lidos uma vez por
+    carga do modelo. Levanta LayoutNaoSuportado para secoes que o PDF nao
+    reproduz (colunas, cabecalho de primeira pagina ou pares/impares...).
+    """
+
+    def __init__(self, template):
+        self.estilos = _Estilos(template.partes)
+
+        _, body = template.nova_raiz()
+        sect_pr = body.find(qn('w:sectPr'))
+        _verificar_secao(sect_pr, template.partes)
+        tamanho = sect_pr.find(qn('w:pgSz'))
+        margens = sect_pr.find(qn('w:pgMar'))
+        self.largura = _twips(tamanho.get(_ATTR_W))
+        self.altura = _twips(tamanho.get(qn('w:h')))
+        self.margem_esquerda = _twips(margens.get(qn('w:left')))
+        self.margem_direita = _twips(margens.get(qn('w:right')))
+        self.margem_topo = _twips(margens.get(qn('w:top')))
+        self.margem_base = _twips(margens.get(qn('w:bottom')))
+        self.distancia_cabecalho = _twips(margens.get(qn('w:header')))
+        self.distancia_rodape = _twips(margens.get(qn('w:footer')))
+        self.largura_texto = self.largura - self.margem_esquerda - self.margem_direita
+
+        # Cabecalho e rodape padrao, com o texto e as imagens ancoradas (logotipos, barras)
+        relacoes = _relacoes(template.partes, 'word/document.xml')
+        conversor = _Conversor(self, (), None, {})
+        self.cabecalho = self.rodape = _Historia([], [], 0)
+        for referencia in sect_pr.iter(qn('w:headerReference'), qn('w:footerReference')):
+            parte = relacoes.get(referencia.get(_ATTR_ID))
+            if referencia.get(_ATTR_TYPE) != 'default' or parte not in template.partes:
+                continue
+            if referencia.tag == qn('w:headerReference'):
+                self.cabecalho = _Historia.diagramar(self, conversor, template.partes, parte, self.distancia_cabecalho)
+            else:
+                # O rodape termina a distancia_rodape da base da pagina: diagrama ate a altura se estabilizar
+                base = self.altura - self.distancia_rodape
+                self.rodape = _Historia.diagramar(self, conversor, template.partes, parte, base)
+                for _ in range(3):
+                    rodape = _Historia.diagramar(self, conversor, template.partes, parte, base - self.rodape.altura)
+                    estavel = abs(rodape.altura - self.rodape.altura) < 0.01
+                    self.rodape = rodape
+                    if estavel:
+                        break
+
+        # Como no Word, cabecalho/rodape mais altos que a margem empurram o corpo do texto
+        # (as imagens flutuantes nao contam)
+        self.inicio_corpo = max(self.margem_topo, self.distancia_cabecalho + self.cabecalho.altura)
+        self.fim_corpo = self.altura - max(self.margem_base, self.distancia_rodape + self.rodape.altura)
+
+
+def _verificar_secao(sect_pr, partes):
+    for filho in sect_pr:
+        if not isinstance(filho.tag, str):
+            continue
+        nome = etree.QName(filho).localname
+        if nome not in _PROPRIEDADES_SECAO:
+            raise LayoutNaoSuportado(f'propriedade de seção "{nome}"')
+    colunas = sect_pr.find(qn('w:cols'))
+    if colunas is not None and int(colunas.get(qn('w:num')) or 1) > 1:
+        raise LayoutNaoSuportado('texto em colunas')
+    grade = sect_pr.find(qn('w:docGrid'))
+    if grade is not None and grade.get(_ATTR_TYPE) in ('lines', 'linesAndChars', 'snapToChars'):
+        raise LayoutNaoSuportado('grade de linhas do documento')
+    primeira = sect_pr.find(qn('w:titlePg'))
+    if primeira is not None and _ligado(primeira):
+        raise LayoutNaoSuportado('cabeçalho diferente na primeira página')
+    configuracoes = partes.get('word/settings.xml')
+    if configuracoes is not None:
+        pares = etree.fromstring(configuracoes).find(qn('w:evenAndOddHeaders'))
+        if pares is not None and _ligado(pares):
+            raise LayoutNaoSuportado('cabeçalhos diferentes em páginas pares e ímpares')
+
+
+class _Historia:
+    """
+    Cabecalho ou rodape diagramado: paragrafos [(paragrafo, y)], imagens
+    ancoradas [(ancora, x, y)] e altura do texto, em coordenadas da pagina.
+    """
+
+    __slots__ = ('paragrafos', 'imagens', 'altura')
+
+    def __init__(self, paragrafos, imagens, altura):
+        self.paragrafos = paragrafos
+        self.imagens = imagens
+        self.altura = altura
+
+    @classmethod
+    def diagramar(cls, modelo, conversor, partes, nome_parte, topo):
+        """
+        Diagrama a parte (ex.: word/header2.xml) a partir de topo. Cada imagem
+        ancorada e posicionada pelo wp:positionH/wp:positionV e o texto dos
+        paragrafos seguintes contorna a caixa dela (ver _faixa_contorno).
+        """
+        relacoes = _relacoes(partes, nome_parte)
+        paragrafos = []
+        imagens = []
+        zonas = []
+        y = topo
+        for elem in etree.fromstring(partes[nome_parte]):
+            if not isinstance(elem.tag, str) or elem.tag in _IGNORADOS:
+                continue
+            if elem.tag != _TAG_P:
+                raise LayoutNaoSuportado(f'elemento "{etree.QName(elem).localname}" no cabeçalho ou rodapé')
+            formato = modelo.estilos.formato(elem)
+            for desenho in elem.iter(_TAG_DRAWING):
+                for filho in desenho:
+                    if filho.tag != qn('wp:anchor'):
+                        raise LayoutNaoSuportado('imagem em linha no cabeçalho ou rodapé')
+                    ancora = _Ancora(filho, relacoes, partes)
+                    x_imagem, y_imagem = ancora.posicao(modelo, y)
+                    imagens.append((ancora, x_imagem, y_imagem))
+                    zona = ancora.zona(x_imagem, y_imagem)
+                    if zona is not None:
+                        zonas.append(zona)
+            faixa = _faixa_contorno(formato, modelo, zonas, y + formato.antes)
+            paragrafo = conversor.paragrafo(elem, {}, {}, modelo.largura_texto, faixa=faixa, desenhos=True)
+            paragrafos.append((paragrafo, y))
+            y += paragrafo.altura()
+        return cls(paragrafos, imagens, y - topo)
+
+    def desenhar(self, pagina, modelo):
+        for ancora, x, y in self.imagens:
+            pagina.imagem(ancora.imagem, x, y, ancora.largura, ancora.altura, atras=ancora.atras)
+        for paragrafo, y in self.paragrafos:
+            paragrafo.desenhar(pagina, modelo.margem_esquerda, y, modelo.largura_texto)
+
+
+class _Ancora:
+    """Imagem flutuante (wp:anchor) do cabecalho ou rodape: tamanho, posicao e contorno do texto (em pontos)."""
+
+    __slots__ = ('imagem', 'largura', 'altura', 'horizontal', 'vertical', 'contorno', 'lado', 'distancias', 'atras')
+
+    def __init__(self, anchor, relacoes, partes):
+        blip = anchor.find(f'.//{qn("pic:pic")}//{qn("a:blip")}')
+        if blip is None:
+            raise LayoutNaoSuportado('forma ou caixa de texto flutuante no cabeçalho ou rodapé')
+        if blip.get(qn('r:link')) is not None or relacoes.get(blip.get(qn('r:embed'))) not in partes:
+            raise LayoutNaoSuportado('imagem vinculada fora do modelo')
+        transformacao = anchor.find(f'.//{qn("pic:spPr")}/{qn("a:xfrm")}')
+        if transformacao is not None and (
+            transformacao.get('rot') not in (None, '0') or _ligado(transformacao, 'flipH') or _ligado(transformacao, 'flipV')
+        ):
+            raise LayoutNaoSuportado('imagem girada ou espelhada no cabeçalho ou rodapé')
+        recorte = anchor.find(f'.//{qn("a:srcRect")}')
+        if recorte is not None and any(recorte.get(lado) not in (None, '0') for lado in ('l', 't', 'r', 'b')):
+            raise LayoutNaoSuportado('imagem recortada no cabeçalho ou rodapé')
+
+        self.imagem = como_registro(partes[relacoes[blip.get(qn('r:embed'))]])
+        extensao = anchor.find(qn('wp:extent'))
+        self.largura = Emu(int(extensao.get('cx'))).pt
+        self.altura = Emu(int(extensao.get('cy'))).pt
+        self.atras = _ligado(anchor, 'behindDoc')
+        if _ligado(anchor, 'simplePos'):
+            simples = anchor.find(qn('wp:simplePos'))
+            self.horizontal = ('page', 'deslocamento', Emu(int(simples.get('x'))).pt)
+            self.vertical = ('page', 'deslocamento', Emu(int(simples.get('y'))).pt)
+        else:
+            self.horizontal = _posicao_ancora(anchor.find(qn('wp:positionH')))
+            self.vertical = _posicao_ancora(anchor.find(qn('wp:positionV')))
+
+        self.contorno = 'wrapNone'
+        self.lado = 'bothSides'
+        for contorno in ('wrapNone', 'wrapSquare', 'wrapTight', 'wrapThrough', 'wrapTopAndBottom'):
+            elem = anchor.find(qn(f'wp:{contorno}'))
+            if elem is not None:
+                self.contorno = contorno
+                self.lado = elem.get('wrapText') or 'bothSides'
+        self.distancias = tuple(Emu(int(anchor.get(nome) or 0)).pt for nome in ('distT', 'distB', 'distL', 'distR'))
+
+    def posicao(self, modelo, topo_paragrafo):
+        """(x, y) do canto superior esquerdo na pagina; topo_paragrafo e o topo do paragrafo da ancora."""
+        horizontal = {
+            'page': (0, modelo.largura),
+            'margin': (modelo.margem_esquerda, modelo.largura_texto),
+            'column': (modelo.margem_esquerda, modelo.largura_texto),
+            'leftMargin': (0, modelo.margem_esquerda),
+            'rightMargin': (modelo.largura - modelo.margem_direita, modelo.margem_direita),
+        }
+        vertical = {
+            'page': (0, modelo.altura),
+            'margin': (modelo.margem_topo, modelo.altura - modelo.margem_topo - modelo.margem_base),
+            'topMargin': (0, modelo.margem_topo),
+            'bottomMargin': (modelo.altura - modelo.margem_base, modelo.margem_base),
+            'paragraph': (topo_paragrafo, None),
+        }
+        return (
+            _posicionar(self.horizontal, horizontal, self.largura, {'left': 0, 'center': 0.5, 'right': 1}),
+            _posicionar(self.vertical, vertical, self.altura, {'top': 0, 'center': 0.5, 'bottom': 1}),
+        )
+
+    def zona(self, x, y):
+        """Area que o texto contorna (x0, y0, x1, y1, contorno, lado), ou None quando o texto passa por cima (wrapNone)."""
+        if self.contorno == 'wrapNone':
+            return None
+        topo, base, esquerda, direita = self.distancias
+        return (x - esquerda, y - topo, x + self.largura + direita, y + self.altura + base, self.contorno, self.lado)
+
+
+def _posicao_ancora(elem):
+    """(relativeFrom, 'deslocamento' ou 'alinhamento', valor) de wp:positionH/wp:positionV."""
+    deslocamento = elem.find(qn('wp:posOffset'))
+    if deslocamento is not None:
+        return elem.get('relativeFrom'), 'deslocamento', Emu(int(deslocamento.text)).pt
+    alinhamento = elem.find(qn('wp:align'))
+    if alinhamento is not None:
+        return elem.get('relativeFrom'), 'alinhamento', alinhamento.text
+    raise LayoutNaoSuportado('posição relativa (percentual) de imagem no cabeçalho ou rodapé')
+
+
+def _posicionar(posicao, referencias, tamanho, alinhamentos):
+    relativo, tipo, valor = posicao
+    if relativo not in referencias:
+        raise LayoutNaoSuportado(f'imagem posicionada em relação a "{relativo}"')
+    inicio, extensao = referencias[relativo]
+    if tipo == 'deslocamento':
+        return inicio + valor
+    if valor not in alinhamentos or extensao is None:
+        raise LayoutNaoSuportado(f'imagem alinhada "{valor}" em relação a "{relativo}"')
+    return inicio + (extensao - tamanho) * alinhamentos[valor]
+
+
+def _relacoes(partes, nome_parte):
+    """{Id: nome da parte} das relacoes internas de uma parte do pacote (ex.: word/header2.xml)."""
+    pasta, nome = posixpath.split(nome_parte)
+    xml = partes.get(f'{pasta}/_rels/{nome}.rels')
+    if xml is None:
+        return {}
+    relacoes = {}
+    for rel in etree.fromstring(xml).iter(f'{_NS_REL}Relationship'):
+        if rel.get('TargetMode') == 'External':
+            continue
+        alvo = rel.get('Target')
+        relacoes[rel.get('Id')] = alvo.lstrip('/') if alvo.startswith('/') else posixpath.normpath(posixpath.join(pasta, alvo))
+    return relacoes
+
+
+class _Formato:
+    """
+    Formatacao efetiva de um paragrafo (em pontos). efeitos e efeitos_paragrafo
+    sao a formatacao que o PDF nao desenha; misto indica runs com texto em
+    formatacoes diferentes (o PDF usa a do primeiro run).
+    """
+
+    __slots__ = (
+        'tamanho', 'negrito', 'fonte', 'cor', 'alinhamento', 'antes', 'depois', 'linha', 'regra_linha',
+        'recuo_esquerdo', 'recuo_direito', 'primeira_linha', 'quebra_antes', 'efeitos', 'efeitos_paragrafo', 'misto',
+    )
+
+    def altura_linha(self):
+        simples = self.tamanho * self.fonte.altura_linha
+        if self.regra_linha == 'exact':
+            return self.linha / 20
+        if self.regra_linha == 'atLeast':
+            return max(self.linha / 20, simples)
+        return simples * self.linha / 240
+
+    def linha_base(self):
+        return self.tamanho * self.fonte.linha_base
+
+    def largura(self, texto):
+        return sum(_largura_caractere(self.fonte, caractere, self.negrito) for caractere in texto) * self.tamanho / 1000
+
+
+class _Estilos:
+    """Estilos do modelo (styles.xml): padroes do documento, cadeias basedOn, fontes do tema e substitutas da tabela de fontes."""
+
+    def __init__(self, partes):
+        raiz = etree.fromstring(partes['word/styles.xml'])
+        padroes = raiz.find(qn('w:docDefaults'))
+        self._padrao = [
+            padroes.find(f'{qn("w:pPrDefault")}/{_TAG_PPR}') if padroes is not None else None,
+            padroes.find(f'{qn("w:rPrDefault")}/{_TAG_RPR}') if padroes is not None else None,
+        ]
+        self._estilos = {}
+        self._tabelas = {}
+        self._condicionais = set()
+        self._paragrafo_padrao = None
+        for estilo in raiz.iter(qn('w:style')):
+            id_estilo = estilo.get(qn('w:styleId'))
+            base = estilo.find(qn('w:basedOn'))
+            self._estilos[id_estilo] = (
+                base.get(_ATTR_VAL) if base is not None else None,
+                estilo.find(_TAG_PPR),
+                estilo.find(_TAG_RPR),
+            )
+            self._tabelas[id_estilo] = estilo.find(qn('w:tblPr'))
+            if estilo.find(qn('w:tblStylePr')) is not None:
+                self._condicionais.add(id_estilo)
+            if estilo.get(_ATTR_TYPE) == 'paragraph' and estilo.get(qn('w:default')) == '1':
+                self._paragrafo_padrao = id_estilo
+
+        self._fontes_tema = _fontes_tema(partes.get('word/theme/theme1.xml'))
+        self._substitutas = _fontes_substitutas(partes.get('word/fontTable.xml'))
+
+    def formato(self, p, estilo_tabela=None):
+        """Formatacao do paragrafo: padroes, estilo da tabela, estilo do paragrafo e formatacao direta, nessa ordem."""
+        valores = {
+            'tamanho': 11.0, 'negrito': False, 'fonte': None, 'cor': None, 'alinhamento': 'left',
+            'antes': 0.0, 'depois': 0.0, 'linha': 240, 'regra_linha': 'auto',
+            'recuo_esquerdo': 0.0, 'recuo_direito': 0.0, 'primeira_linha': 0.0, 'quebra_antes': False,
+            'efeitos': {}, 'efeitos_paragrafo': {},
+        }
+        ppr = p.find(_TAG_PPR)
+        id_estilo = self._paragrafo_padrao
+        if ppr is not None and ppr.find(qn('w:pStyle')) is not None:
+            id_estilo = ppr.find(qn('w:pStyle')).get(_ATTR_VAL)
+
+        cadeia = [self._padrao] + self._cadeia(estilo_tabela) + self._cadeia(id_estilo)
+        for ppr_estilo, rpr_estilo in cadeia:
+            _aplicar_ppr(valores, ppr_estilo)
+            _aplicar_rpr(valores, rpr_estilo)
+        _aplicar_ppr(valores, ppr)
+
+        # O texto substituido fica no primeiro run; sem runs vale a marca do paragrafo
+        runs = list(p.iterchildren(_TAG_R))
+        formatos_runs = {self._formato_run(valores, run) for run in runs if _texto_run(run).strip()}
+        if runs:
+            valores = self._valores_run(valores, runs[0])
+        elif ppr is not None:
+            valores = dict(valores, efeitos={})
+            _aplicar_rpr(valores, ppr.find(_TAG_RPR))
+
+        formato = _Formato()
+        for chave, valor in valores.items():
+            setattr(formato, chave, valor)
+        formato.fonte = self._fonte(valores['fonte'])
+        formato.efeitos = frozenset(efeito for efeito, ativo in valores['efeitos'].items() if ativo)
+        formato.efeitos_paragrafo = frozenset(efeito for efeito, ativo in valores['efeitos_paragrafo'].items() if ativo)
+        formato.misto = len(formatos_runs) > 1
+        return formato
+
+    def propriedades_tabela(self, id_estilo):
+        """w:tblPr da cadeia do estilo de tabela, do mais basico ao proprio estilo."""
+        propriedades = []
+        while id_estilo in self._estilos and len(propriedades) < 16:
+            if id_estilo in self._condicionais:
+                raise LayoutNaoSuportado(f'estilo de tabela "{id_estilo}" com formatação condicional')
+            propriedades.append(self._tabelas[id_estilo])
+            id_estilo = self._estilos[id_estilo][0]
+        return propriedades[::-1]
+
+    def _valores_run(self, valores, run):
+        valores = dict(valores, efeitos=dict(valores['efeitos']))
+        rpr = run.find(_TAG_RPR)
+        estilo = rpr.find(qn('w:rStyle')) if rpr is not None else None
+        if estilo is not None:
+            for _, rpr_estilo in self._cadeia(estilo.get(_ATTR_VAL)):
+                _aplicar_rpr(valores, rpr_estilo)
+        _aplicar_rpr(valores, rpr)
+        return valores
+
+    def _formato_run(self, valores, run):
+        valores = self._valores_run(valores, run)
+        efeitos = frozenset(efeito for efeito, ativo in valores['efeitos'].items() if ativo)
+        return valores['tamanho'], valores['negrito'], self._fonte(valores['fonte']), valores['cor'], efeitos
+
+    def _fonte(self, nome):
+        """Metricas da fonte (nome ou ('tema', chave)), como o Word sem a fonte instalada usa a substituta da fontTable."""
+        if isinstance(nome, tuple):
+            nome = self._fontes_tema.get(nome[1])
+        nome = nome or _FONTE_PADRAO
+        if nome in _FONTES:
+            return _FONTES[nome]
+        if self._substitutas.get(nome) in _FONTES:
+            return _FONTES[self._substitutas[nome]]
+        raise LayoutNaoSuportado(f'fonte "{nome}" sem métricas para o PDF')
+
+    def _cadeia(self, id_estilo):
+        cadeia = []
+        while id_estilo in self._estilos and len(cadeia) < 16:
+            base, ppr, rpr = self._estilos[id_estilo]
+            cadeia.append([ppr, rpr])
+            id_estilo = base
+        return cadeia[::-1]
+
+
+def _fontes_tema(xml):
+    """{'minorHAnsi': 'Calibri', 'majorHAnsi': ...} das fontes latinas do tema."""
+    if xml is None:
+        return {}
+    esquema = etree.fromstring(xml).find(f'.//{qn("a:fontScheme")}')
+    fontes = {}
+    for grupo, prefixo in (('a:minorFont', 'minor'), ('a:majorFont', 'major')):
+        latina = esquema.find(f'{qn(grupo)}/{qn("a:latin")}') if esquema is not None else None
+        if latina is not None:
+            for sufixo in ('HAnsi', 'Ascii', 'Bidi', 'EastAsia'):
+                fontes[prefixo + sufixo] = latina.get('typeface')
+    return fontes
+
+
+def _fontes_substitutas(xml):
+    """{fonte: w:altName} da tabela de fontes do modelo."""
+    if xml is None:
+        return {}
+    substitutas = {}
+    for fonte in etree.fromstring(xml).iter(qn('w:font')):
+        alternativa = fonte.find(qn('w:altName'))
+        if alternativa is not None:
+            substitutas[fonte.get(qn('w:name'))] = alternativa.get(_ATTR_VAL)
+    return substitutas
+
+
+def _aplicar_ppr(valores, ppr):
+    if ppr is None:
+        return
+    espacamento = ppr.find(qn('w:spacing'))
+    if espacamento is not None:
+        for atributo, chave in (('before', 'antes'), ('after', 'depois')):
+            if espacamento.get(qn(f'w:{atributo}Autospacing')) in ('1', 'true', 'on'):
+                valores[chave] = _ESPACO_AUTOMATICO
+            elif espacamento.get(qn(f'w:{atributo}')) is not None:
+                valores[chave] = _twips(espacamento.get(qn(f'w:{atributo}')))
+        if espacamento.get(qn('w:line')) is not None:
+            valores['linha'] = int(espacamento.get(qn('w:line')))
+            valores['regra_linha'] = espacamento.get(qn('w:lineRule')) or 'auto'
+    alinhamento = ppr.find(qn('w:jc'))
+    if alinhamento is not None:
+        valores['alinhamento'] = {'end': 'right', 'distribute': 'both', 'start': 'left'}.get(
+            alinhamento.get(_ATTR_VAL), alinhamento.get(_ATTR_VAL)
+        )
+    recuo = ppr.find(qn('w:ind'))
+    if recuo is not None:
+        for atributos, chave in ((('left', 'start'), 'recuo_esquerdo'), (('right', 'end'), 'recuo_direito')):
+            for atributo in atributos:
+                if recuo.get(qn(f'w:{atributo}')) is not None:
+                    valores[chave] = _twips(recuo.get(qn(f'w:{atributo}')))
+                    break
+        if recuo.get(qn('w:firstLine')) is not None:
+            valores['primeira_linha'] = _twips(recuo.get(qn('w:firstLine')))
+        if recuo.get(qn('w:hanging')) is not None:
+            valores['primeira_linha'] = -_twips(recuo.get(qn('w:hanging')))
+    quebra = ppr.find(qn('w:pageBreakBefore'))
+    if quebra is not None:
+        valores['quebra_antes'] = _ligado(quebra)
+    for efeito in _EFEITOS_PARAGRAFO:
+        elem = ppr.find(qn(f'w:{efeito}'))
+        if elem is not None:
+            valores['efeitos_paragrafo'][efeito] = _efeito_ativo(efeito, elem)
+
+
+def _aplicar_rpr(valores, rpr):
+    if rpr is None:
+        return
+    tamanho = rpr.find(qn('w:sz'))
+    if tamanho is not None:
+        valores['tamanho'] = int(tamanho.get(_ATTR_VAL)) / 2
+    negrito = rpr.find(qn('w:b'))
+    if negrito is not None:
+        valores['negrito'] = _ligado(negrito)
+    fontes = rpr.find(qn('w:rFonts'))
+    if fontes is not None:
+        if fontes.get(qn('w:ascii')) is not None:
+            valores['fonte'] = fontes.get(qn('w:ascii'))
+        elif fontes.get(qn('w:hAnsi')) is not None:
+            valores['fonte'] = fontes.get(qn('w:hAnsi'))
+        elif fontes.get(qn('w:asciiTheme')) is not None:
+            valores['fonte'] = ('tema', fontes.get(qn('w:asciiTheme')))
+    cor = rpr.find(qn('w:color'))
+    if cor is not None:
+        valores['cor'] = _cor(cor.get(_ATTR_VAL))
+    for efeito in _EFEITOS_TEXTO:
+        elem = rpr.find(qn(f'w:{efeito}'))
+        if elem is not None:
+            valores['efeitos'][efeito] = _efeito_ativo(efeito, elem)
+
+
+def _efeito_ativo(efeito, elem):
+    """Se a propriedade muda o desenho (ex.: w:u com val="none" ou w:numPr com numId 0 nao mudam)."""
+    valor = elem.get(_ATTR_VAL)
+    if efeito in ('u', 'highlight', 'em', 'bdr'):
+        return valor not in ('none', 'nil')
+    if efeito == 'vertAlign':
+        return valor != 'baseline'
+    if efeito == 'shd':
+        return (elem.get(qn('w:fill')) or 'auto') not in ('auto', 'FFFFFF', 'ffffff') or valor not in (None, 'clear', 'nil')
+    if efeito == 'numPr':
+        numero = elem.find(qn('w:numId'))
+        return numero is None or numero.get(_ATTR_VAL) != '0'
+    if efeito == 'pBdr':
+        return any(borda.get(_ATTR_VAL) not in ('none', 'nil') for borda in elem)
+    if efeito in ('spacing', 'position'):
+        return valor not in (None, '0')
+    if efeito == 'w':
+        return valor not in (None, '100')
+    if efeito == 'sectPr':
+        return True
+    return valor not in ('0', 'false', 'off')
+
+
+class _ContextoPdf:
+    """Estado dos CampoGlobal (primeira ocorrencia em maiusculas) ao longo do documento, como em ContextoDocumento."""
+
+    __slots__ = ('globais', 'ja_substituidos')
+
+    def __init__(self, globais):
+        self.globais = globais or {}
+        self.ja_substituidos = set()
+
+
+class _Conversor:
+    """
+    Converte os elementos do modelo (w:p e w:tbl) em blocos de layout, preenchendo os placeholders.
+    Levanta LayoutNaoSuportado para o que o PDF nao diagrama, em vez de omitir.
+    """
+
+    def __init__(self, modelo, campos, globais, regras):
+        self.estilos = modelo.estilos
+        self.campos = campos
+        self.contexto = _ContextoPdf(globais)
+        self.regras = regras
+
+    def blocos(self, elementos, dados, substituicoes, largura, estilo_tabela=None, celula=False):
+        blocos = []
+        for elem in elementos:
+            if not isinstance(elem.tag, str) or elem.tag in _IGNORADOS:
+                continue
+            if elem.tag == _TAG_P:
+                paragrafo = self.paragrafo(elem, dados, substituicoes, largura, estilo_tabela)
+                if _quebra_pagina(elem) or paragrafo.formato.quebra_antes:
+                    if celula:
+                        raise LayoutNaoSuportado('quebra de página dentro de célula de tabela')
+                    blocos.append(_QUEBRA_PAGINA)
+                blocos.append(paragrafo)
+            elif elem.tag == _TAG_TBL:
+                if celula:
+                    raise LayoutNaoSuportado('tabela aninhada em célula de tabela')
+                blocos.append(self._tabela(elem, dados, substituicoes))
+            else:
+                raise LayoutNaoSuportado(f'elemento "{etree.QName(elem).localname}" do modelo')
+        return blocos
+
+    def paragrafo(self, p, dados, substituicoes, largura, estilo_tabela=None, faixa=None, desenhos=False):
+        """Paragrafo diagramado; faixa (ver _quebrar_linhas) padrao: a largura com os recuos do paragrafo."""
+        _verificar_paragrafo(p, desenhos)
+        formato = self.estilos.formato(p, estilo_tabela)
+        texto = _texto(p)
+        if formato.efeitos_paragrafo:
+            raise LayoutNaoSuportado(f'parágrafo com {", ".join(sorted(formato.efeitos_paragrafo))}')
+        # Verificado pelo texto do modelo (com os placeholders), para falhar igual em toda secao
+        substituido = any(campo.placeholder in texto for campo in self.campos) or any(antigo in texto for antigo in substituicoes)
+        if texto.strip():
+            if formato.efeitos:
+                raise LayoutNaoSuportado(f'texto com formatação {", ".join(sorted(formato.efeitos))}')
+            if formato.misto and not substituido:
+                raise LayoutNaoSuportado('parágrafo com trechos em formatações diferentes')
+            if '\t' in texto and texto.split('\t', 1)[1].strip():
+                raise LayoutNaoSuportado('tabulação seguida de texto')
+
+        conteudo = self._conteudo(texto, dados, substituicoes)
+        if isinstance(conteudo, BlocoImagens):
+            return _Paragrafo(formato, imagens=conteudo)
+        return _Paragrafo(formato, linhas=_quebrar_linhas(_texto_pdf(conteudo), formato, faixa or _faixa_recuos(formato, largura)))
+
+    def _conteudo(self, texto, dados, substituicoes):
+        """Texto do paragrafo com os placeholders preenchidos (mesma ordem de _substituir_paragrafo) ou um BlocoImagens."""
+        campos = [campo for campo in self.campos if campo.placeholder in texto]
+        for antigo, novo in substituicoes.items():
+            texto = texto.replace(antigo, novo)
+
+        for campo in campos:
+            if campo.placeholder not in texto:
+                continue
+            if isinstance(campo, CampoImagem):
+                imagem = dados.get(campo.chave)
+                if imagem:
+                    largura, altura, antes, depois = campo.layout(imagem)
+                    return BlocoImagens([[(imagem, largura, altura)]], espaco_antes=antes, espaco_depois=depois)
+                texto = texto.replace(campo.placeholder, '')
+            elif isinstance(campo, CampoRegra):
+                regra = self.regras.get(campo.placeholder)
+                bloco = regra(dados.get(campo.chave)) if regra is not None else None
+                if bloco is not None:
+                    return bloco
+                texto = texto.replace(campo.placeholder, '')
+            else:
+                texto = campo.aplicar(self.contexto, None, texto, dados)
+        return texto
+
+    def _tabela(self, tbl, dados, substituicoes):
+        for filho in tbl:
+            if isinstance(filho.tag, str) and filho.tag not in _IGNORADOS and filho.tag not in (qn('w:tblPr'), qn('w:tblGrid'), qn('w:tr')):
+                raise LayoutNaoSuportado(f'elemento "{etree.QName(filho).localname}" em tabela')
+        propriedades = tbl.find(qn('w:tblPr'))
+        _verificar_propriedades(propriedades)
+        estilo = propriedades.find(qn('w:tblStyle')) if propriedades is not None else None
+        estilo = estilo.get(_ATTR_VAL) if estilo is not None else None
+        cadeia = [pr for pr in self.estilos.propriedades_tabela(estilo) + [propriedades] if pr is not None]
+        bordas = _bordas(cadeia, 'tblBorders')
+        margens = _margens_celula(cadeia)
+        recuo = _ultimo(cadeia, 'tblInd')
+        alinhamento = _ultimo(cadeia, 'jc')
+        colunas = [_twips(coluna.get(_ATTR_W)) for coluna in tbl.iter(qn('w:gridCol'))]
+
+        linhas = []
+        trs = list(tbl.iterchildren(qn('w:tr')))
+        for indice, tr in enumerate(trs):
+            for filho in tr:
+                if isinstance(filho.tag, str) and filho.tag not in _IGNORADOS and filho.tag not in (qn('w:trPr'), qn('w:tc')):
+                    raise LayoutNaoSuportado(f'elemento "{etree.QName(filho).localname}" em linha de tabela')
+            _verificar_propriedades(tr.find(qn('w:trPr')))
+            altura = tr.find(f'{qn("w:trPr")}/{qn("w:trHeight")}')
+            celulas = []
+            coluna = 0
+            for tc in tr.iterchildren(qn('w:tc')):
+                tc_pr = tc.find(_TAG_TCPR)
+                _verificar_propriedades(tc_pr)
+                span = tc_pr.find(qn('w:gridSpan')) if tc_pr is not None else None
+                span = int(span.get(_ATTR_VAL)) if span is not None else 1
+                alinhamento_celula = tc_pr.find(qn('w:vAlign')) if tc_pr is not None else None
+                sombreamento = tc_pr.find(qn('w:shd')) if tc_pr is not None else None
+                x = sum(colunas[:coluna])
+                largura = sum(colunas[coluna:coluna + span])
+                blocos = self.blocos(
+                    [filho for filho in tc if filho.tag != _TAG_TCPR], dados, substituicoes,
+                    largura - margens[1] - margens[3], estilo, celula=True
+                )
+                # Bordas externas nas celulas da beirada, internas (insideH/insideV) nas demais
+                lados = dict(bordas)
+                lados['top'] = bordas.get('top' if indice == 0 else 'insideH')
+                lados['bottom'] = bordas.get('bottom' if indice == len(trs) - 1 else 'insideH')
+                lados['left'] = bordas.get('left' if coluna == 0 else 'insideV')
+                lados['right'] = bordas.get('right' if coluna + span >= len(colunas) else 'insideV')
+                if tc_pr is not None:
+                    lados.update(_bordas([tc_pr], 'tcBorders'))
+                celulas.append(_Celula(
+                    x, largura, blocos,
+                    alinhamento_celula.get(_ATTR_VAL) if alinhamento_celula is not None else 'top',
+                    tuple(lados.get(lado) for lado in ('top', 'left', 'bottom', 'right')),
+                    _cor(sombreamento.get(qn('w:fill'))) if sombreamento is not None else None,
+                    margens,
+                ))
+                coluna += span
+            linhas.append(_LinhaTabela(
+                celulas,
+                _twips(altura.get(_ATTR_VAL)) if altura is not None else 0,
+                altura is not None and altura.get(qn('w:hRule')) == 'exact'
+            ))
+        return _Tabela(
+            _twips(recuo.get(_ATTR_W)) if recuo is not None else 0,
+            linhas,
+            {'end': 'right'}.get(alinhamento.get(_ATTR_VAL), alinhamento.get(_ATTR_VAL)) if alinhamento is not None else 'left',
+            sum(colunas),
+        )
+
+
+def _verificar_paragrafo(p, desenhos):
+    """Levanta LayoutNaoSuportado para conteudo do paragrafo que o PDF omitiria (campos, hyperlinks, quebras de coluna...)."""
+    for filho in p:
+        if isinstance(filho.tag, str) and filho.tag not in _FILHOS_PARAGRAFO:
+            raise LayoutNaoSuportado(f'elemento "{etree.QName(filho).localname}" em parágrafo')
+    texto_antes = ''
+    for run in p.iterchildren(_TAG_R):
+        for filho in run:
+            if not isinstance(filho.tag, str) or filho.tag in _FILHOS_RUN or (desenhos and filho.tag == _TAG_DRAWING):
+                if filho.tag == _TAG_BR and filho.get(_ATTR_TYPE) == 'column':
+                    raise LayoutNaoSuportado('quebra de coluna')
+                if filho.tag == _TAG_BR and filho.get(_ATTR_TYPE) == 'page' and texto_antes.strip():
+                    raise LayoutNaoSuportado('quebra de página depois de texto no mesmo parágrafo')
+                if filho.tag == _TAG_T:
+                    texto_antes += filho.text or ''
+                continue
+            raise LayoutNaoSuportado(f'elemento "{etree.QName(filho).localname}" em parágrafo')
+
+
+def _verificar_propriedades(propriedades):
+    if propriedades is None:
+        return
+    permitidas = _PROPRIEDADES_TABELA[etree.QName(propriedades).localname]
+    for filho in propriedades:
+        if isinstance(filho.tag, str) and etree.QName(filho).localname not in permitidas:
+            raise LayoutNaoSuportado(f'propriedade de tabela "{etree.QName(filho).localname}"')
+
+
+def _bordas(propriedades, tag):
+    """{lado: (espessura, cor) ou None} das bordas (tblBorders/tcBorders), o ultimo da lista prevalecendo."""
+    bordas = {}
+    for pr in propriedades:
+        elem = pr.find(qn(f'w:{tag}'))
+        if elem is None:
+            continue
+        for borda in elem:
+            if not isinstance(borda.tag, str):
+                continue
+            lado = {'start': 'left', 'end': 'right'}.get(etree.QName(borda).localname, etree.QName(borda).localname)
+            estilo = borda.get(_ATTR_VAL)
+            if estilo in ('nil', 'none'):
+                bordas[lado] = None
+            elif estilo in _BORDAS_CONTINUAS:
+                if lado in ('tl2br', 'tr2bl'):
+                    raise LayoutNaoSuportado('borda diagonal em célula de tabela')
+                bordas[lado] = (max(int(borda.get(qn('w:sz')) or 4), 2) / 8, _cor(borda.get(qn('w:color'))))
+            else:
+                raise LayoutNaoSuportado(f'borda de tabela "{estilo}"')
+    return bordas
+
+
+def _margens_celula(propriedades):
+    """(topo, esquerda, base, direita) das margens internas das celulas (tblCellMar)."""
+    margens = {'top': 0.0, 'left': _MARGEM_CELULA, 'bottom': 0.0, 'right': _MARGEM_CELULA}
+    for pr in propriedades:
+        elem = pr.find(qn('w:tblCellMar'))
+        if elem is None:
+            continue
+        for margem in elem:
+            if not isinstance(margem.tag, str):
+                continue
+            if margem.get(_ATTR_TYPE) not in (None, 'dxa'):
+                raise LayoutNaoSuportado('margem de célula fora de twips')
+            lado = {'start': 'left', 'end': 'right'}.get(etree.QName(margem).localname, etree.QName(margem).localname)
+            margens[lado] = _twips(margem.get(_ATTR_W))
+    return margens['top'], margens['left'], margens['bottom'], margens['right']
+
+
+def _ultimo(propriedades, tag):
+    elementos = [pr.find(qn(f'w:{tag}')) for pr in propriedades]
+    elementos = [elem for elem in elementos if elem is not None]
+    return elementos[-1] if elementos else None
+
+
+class _Paragrafo:
+    __slots__ = ('formato', 'linhas', 'imagens')
+
+    def __init__(self, formato, linhas=None, imagens=None):
+        self.formato = formato
+        self.linhas = linhas
+        self.imagens = imagens
+
+    @property
+    def antes(self):
+        if self.imagens is not None and self.imagens.espaco_antes is not None:
+            return Emu(self.imagens.espaco_antes).pt
+        return self.formato.antes
+
+    @property
+    def depois(self):
+        if self.imagens is not None and self.imagens.espaco_depois is not None:
+            return Emu(self.imagens.espaco_depois).pt
+        return self.formato.depois
+
+    @property
+    def vazio(self):
+        return self.imagens is None and not any(linha[0] for linha in self.linhas)
+
+    @property
+    def centralizar_celula(self):
+        return self.imagens is not None and self.imagens.centralizar_celula
+
+    def altura(self):
+        if self.imagens is None:
+            conteudo = self.linhas[-1][3] + self.formato.altura_linha()
+        else:
+            conteudo = sum(max(Emu(altura).pt for _, _, altura in linha) for linha in self.imagens.linhas)
+            conteudo += Emu(self.imagens.espaco_linhas).pt * (len(self.imagens.linhas) - 1)
+        return self.antes + conteudo + self.depois
+
+    def desenhar(self, pagina, x, y, largura):
+        y += self.antes
+        formato = self.formato
+        if self.imagens is None:
+            for texto, deslocamento, largura_linha, topo, final in self.linhas:
+                if texto:
+                    ocupado = formato.largura(texto)
+                    # Justificado: o espaco que sobra vai para os espacos entre palavras (exceto na ultima linha)
+                    espacos = 0
+                    if formato.alinhamento == 'both' and not final and ' ' in texto:
+                        espacos = max(0, largura_linha - ocupado) / texto.count(' ')
+                    x_linha = x + deslocamento + _deslocamento(formato.alinhamento, largura_linha, ocupado)
+                    pagina.texto(x_linha, y + topo + formato.linha_base(), texto, formato, espacos)
+            return
+
+        x += formato.recuo_esquerdo
+        largura -= formato.recuo_esquerdo + formato.recuo_direito
+        alinhamento = self.imagens.alinhamento or formato.alinhamento
+        espaco_imagens = Emu(self.imagens.espaco_imagens).pt
+        for linha in self.imagens.linhas:
+            altura_linha = max(Emu(altura).pt for _, _, altura in linha)
+            total = sum(Emu(largura_imagem).pt for _, largura_imagem, _ in linha) + espaco_imagens * (len(linha) - 1)
+            atual = x + _deslocamento(alinhamento, largura, total)
+            for imagem, largura_imagem, altura in linha:
+                # Imagens alinhadas pela base da linha, como imagens inline
+                pagina.imagem(imagem, atual, y + altura_linha - Emu(altura).pt, Emu(largura_imagem).pt, Emu(altura).pt)
+                atual += Emu(largura_imagem).pt + espaco_imagens
+            y += altura_linha + Emu(self.imagens.espaco_linhas).pt
+
+
+class _Celula:
+    """Celula diagramada: bordas (topo, esquerda, base, direita) de (espessura, cor) ou None, fundo e margens internas."""
+
+    __slots__ = ('x', 'largura', 'blocos', 'alinhamento', 'bordas', 'fundo', 'margens')
+
+    def __init__(self, x, largura, blocos, alinhamento, bordas, fundo, margens):
+        self.x = x
+        self.largura = largura
+        self.blocos = blocos
+        # O Word centraliza a celula da grade de imagens (centralizar_celula_verticalmente)
+        if any(bloco.centralizar_celula for bloco in self.blocos):
+            alinhamento = 'center'
+        self.alinhamento = alinhamento
+        self.bordas = bordas
+        self.fundo = fundo
+        self.margens = margens
+
+    def altura(self):
+        return self.margens[0] + sum(bloco.altura() for bloco in self.blocos) + self.margens[2]
+
+
+class _LinhaTabela:
+    __slots__ = ('celulas', 'altura_minima', 'exata')
+
+    def __init__(self, celulas, altura_minima, exata):
+        self.celulas = celulas
+        self.altura_minima = altura_minima
+        self.exata = exata
+
+    def altura(self):
+        if self.exata:
+            return self.altura_minima
+        return max([self.altura_minima] + [celula.altura() for celula in self.celulas])
+
+
+class _Tabela:
+    __slots__ = ('recuo', 'linhas', 'alinhamento', 'largura')
+
+    def __init__(self, recuo, linhas, alinhamento, largura):
+        self.recuo = recuo
+        self.linhas = linhas
+        self.alinhamento = alinhamento
+        self.largura = largura
+
+
+class _QuebraPagina:
+    __slots__ = ()
+
+
+_QUEBRA_PAGINA = _QuebraPagina()
+
+
+class _Pagina:
+    """Operacoes de desenho de uma pagina (coordenadas a partir do topo, em pontos); fundo fica atras do texto."""
+
+    def __init__(self, documento):
+        self._documento = documento
+        self._altura = documento.modelo.altura
+        self.fundo = []
+        self.operacoes = []
+        self.imagens = {}
+        self.fontes = {}
+
+    def texto(self, x, y_base, texto, formato, espacos=0):
+        nome, numero = self._documento.fonte(formato.fonte, formato.negrito)
+        self.fontes[nome] = numero
+        operacao = b'BT /%s %.2f Tf %.2f %.2f Td (%s) Tj ET' % (
+            nome, formato.tamanho, x, self._altura - y_base, _escapar(texto)
+        )
+        # Cor e espacamento entre palavras ficam no estado grafico: restaurados depois da linha
+        if formato.cor is not None or espacos:
+            estado = b'%.3f %.3f %.3f rg ' % formato.cor if formato.cor is not None else b''
+            estado += b'%.3f Tw ' % espacos if espacos else b''
+            operacao = b'q %s%s Q' % (estado, operacao)
+        self.operacoes.append(operacao)
+
+    def imagem(self, imagem, x, y, largura, altura, atras=False):
+        nome, numero = self._documento.imagem(imagem)
+        self.imagens[nome] = numero
+        (self.fundo if atras else self.operacoes).append(b'q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q' % (
+            largura, altura, x, self._altura - y - altura, nome
+        ))
+
+    def linha(self, x0, y0, x1, y1, borda):
+        espessura, cor = borda
+        self.operacoes.append(b'q %.2f w %.3f %.3f %.3f RG %.2f %.2f m %.2f %.2f l S Q' % (
+            (espessura,) + (cor or (0, 0, 0)) + (x0, self._altura - y0, x1, self._altura - y1)
+        ))
+
+    def preencher(self, x, y, largura, altura, cor):
+        self.operacoes.append(b'q %.3f %.3f %.3f rg %.2f %.2f %.2f %.2f re f Q' % (
+            cor + (x, self._altura - y - altura, largura, altura)
+        ))
+
+
+class _DocumentoPdf:
+    """Diagrama os blocos em paginas e grava cada pagina no PDF assim que fica pronta."""
+
+    def __init__(self, modelo, destino):
+        self.modelo = modelo
+        self._escritor = _EscritorPdf(destino)
+        self._numero_paginas = self._escritor.reservar()
+        self._fontes = {}
+        self._paginas = []
+        self._imagens = {}
+        self._pagina = None
+        self._y = 0
+
+    def nova_pagina(self):
+        if self._pagina is not None:
+            self._gravar_pagina()
+        self._pagina = _Pagina(self)
+        self._y = self.modelo.inicio_corpo
+
+    def adicionar(self, blocos):
+        if self._pagina is None:
+            self.nova_pagina()
+        for bloco in blocos:
+            if bloco is _QUEBRA_PAGINA:
+                self.nova_pagina()
+            elif isinstance(bloco, _Tabela):
+                self._tabela(bloco)
+            else:
+                altura = bloco.altura()
+                if bloco.vazio and self._y + altura > self.modelo.fim_corpo:
+                    # Paragrafos vazios que passam do fim da pagina so completam a pagina
+                    self._y = self.modelo.fim_corpo
+                    continue
+                self._reservar(altura)
+                bloco.desenhar(self._pagina, self.modelo.margem_esquerda, self._y, self.modelo.largura_texto)
+                self._y += altura
+
+    def _reservar(self, altura):
+        """Passa para a proxima pagina se o bloco nao cabe no que resta desta (e ela nao esta vazia)."""
+        if self._y + altura > self.modelo.fim_corpo and self._y > self.modelo.inicio_corpo:
+            self.nova_pagina()
+
+    def _tabela(self, tabela):
+        # Tabela que cabe em uma pagina nao e dividida; nas maiores, cada linha que
+        # nao cabe vai inteira para a proxima pagina
+        x = self.modelo.margem_esquerda + tabela.recuo
+        if tabela.alinhamento in ('center', 'right'):
+            x = self.modelo.margem_esquerda + _deslocamento(tabela.alinhamento, self.modelo.largura_texto, tabela.largura)
+        total = sum(linha.altura() for linha in tabela.linhas)
+        if total <= self.modelo.fim_corpo - self.modelo.inicio_corpo:
+            self._reservar(total)
+        for linha in tabela.linhas:
+            altura = linha.altura()
+            self._reservar(altura)
+            for celula in linha.celulas:
+                if celula.fundo is not None:
+                    self._pagina.preencher(x + celula.x, self._y, celula.largura, altura, celula.fundo)
+            for celula in linha.celulas:
+                topo, esquerda, _, direita = celula.margens
+                y = self._y + topo
+                if celula.alinhamento in ('center', 'bottom'):
+                    folga = max(0, altura - celula.altura())
+                    y += folga / 2 if celula.alinhamento == 'center' else folga
+                for bloco in celula.blocos:
+                    bloco.desenhar(self._pagina, x + celula.x + esquerda, y, celula.largura - esquerda - direita)
+                    y += bloco.altura()
+            for celula in linha.celulas:
+                x0, x1 = x + celula.x, x + celula.x + celula.largura
+                y0, y1 = self._y, self._y + altura
+                for borda, inicio, fim in zip(celula.bordas, ((x0, y0), (x0, y0), (x0, y1), (x1, y0)), ((x1, y0), (x0, y1), (x1, y1), (x1, y1))):
+                    if borda is not None:
+                        self._pagina.linha(*inicio, *fim, borda)
+            self._y += altura
+
+    def fonte(self, fonte, negrito):
+        """(nome, numero) do objeto da fonte no PDF, gravado no primeiro uso (fonte TrueType nao embutida, WinAnsi)."""
+        objeto = self._fontes.get((fonte.nome_pdf, negrito))
+        if objeto is None:
+            nome_base = fonte.nome_pdf + (b',Bold' if negrito else b'')
+            descritor = self._escritor.reservar()
+            self._escritor.objeto(descritor, b'<< /Type /FontDescriptor /FontName /%s %s /StemV %d%s >>' % (
+                nome_base, fonte.descritor, 140 if negrito else 80, b' /FontWeight 700' if negrito else b''
+            ))
+            numero = self._escritor.reservar()
+            self._escritor.objeto(numero, b'<< /Type /Font /Subtype /TrueType /BaseFont /%s /FirstChar 32 /LastChar 255 /Widths [%s] /Encoding /WinAnsiEncoding /FontDescriptor %d 0 R >>' % (
+                nome_base, b' '.join(b'%d' % largura for largura in _larguras_winansi(fonte, negrito)), descritor
+            ))
+            objeto = self._fontes[(fonte.nome_pdf, negrito)] = (b'F%d' % numero, numero)
+        return objeto
+
+    def imagem(self, imagem):
+        """(nome, numero) do XObject da imagem no PDF; cada imagem (pelo hash) e gravada uma unica vez."""
+        registro = como_registro(imagem)
+        objeto = self._imagens.get(registro.hash)
+        if objeto is None:
+            numero = self._escritor.reservar()
+            transparente = dados_transparentes(registro)
+            if transparente is None:
+                dados, largura, altura, modo = dados_jpeg(registro)
+                self._escritor.objeto(numero, b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /%s /BitsPerComponent 8 /Filter /DCTDecode /Length %d >>' % (
+                    largura, altura, b'DeviceGray' if modo == 'L' else b'DeviceRGB', len(dados)
+                ), dados)
+            else:
+                # Transparencia (logotipos PNG) preservada com uma mascara suave em tons de cinza
+                cores, alfa, largura, altura = transparente
+                mascara = self._escritor.reservar()
+                alfa = zlib.compress(alfa, 6)
+                self._escritor.objeto(mascara, b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceGray /BitsPerComponent 8 /Filter /FlateDecode /Length %d >>' % (
+                    largura, altura, len(alfa)
+                ), alfa)
+                cores = zlib.compress(cores, 6)
+                self._escritor.objeto(numero, b'<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace /DeviceRGB /BitsPerComponent 8 /SMask %d 0 R /Filter /FlateDecode /Length %d >>' % (
+                    largura, altura, mascara, len(cores)
+                ), cores)
+            objeto = self._imagens[registro.hash] = (b'Im%d' % numero, numero)
+        return objeto
+
+    def _gravar_pagina(self):
+        pagina = self._pagina
+        self.modelo.cabecalho.desenhar(pagina, self.modelo)
+        self.modelo.rodape.desenhar(pagina, self.modelo)
+
+        conteudo = zlib.compress(b'\n'.join(pagina.fundo + pagina.operacoes), 6)
+        numero_conteudo = self._escritor.reservar()
+        self._escritor.objeto(numero_conteudo, b'<< /Length %d /Filter /FlateDecode >>' % len(conteudo), conteudo)
+
+        fontes = b' '.join(b'/%s %d 0 R' % (nome, numero) for nome, numero in pagina.fontes.items())
+        imagens = b' '.join(b'/%s %d 0 R' % (nome, numero) for nome, numero in pagina.imagens.items())
+        numero = self._escritor.reservar()
+        self._escritor.objeto(numero, b'<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Contents %d 0 R /Resources << /Font << %s >> /XObject << %s >> >> >>' % (
+            self._numero_paginas, self.modelo.largura, self.modelo.altura, numero_conteudo, fontes, imagens
+        ))
+        self._paginas.append(numero)
+
+    def finalizar(self):
+        if self._pagina is None:
+            self.nova_pagina()
+        self._gravar_pagina()
+        self._pagina = None
+
+        self._escritor.objeto(self._numero_paginas, b'<< /Type /Pages /Kids [%s] /Count %d >>' % (
+            b' '.join(b'%d 0 R' % numero for numero in self._paginas), len(self._paginas)
+        ))
+        raiz = self._escritor.reservar()
+        self._escritor.objeto(raiz, b'<< /Type /Catalog /Pages %d 0 R >>' % self._numero_paginas)
+        self._escritor.finalizar(raiz)
+
+
+class _EscritorPdf:
+    """Grava os objetos do PDF em sequencia (o destino pode ser nao-seekable), guardando as posicoes para a tabela xref."""
+
+    def __init__(self, destino):
+        self._destino = destino
+        self._posicao = 0
+        self._posicoes = {}
+        self._total = 0
+        self._gravar(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def reservar(self):
+        """Numero do proximo objeto (gravado depois, em qualquer ordem)."""
+        self._total += 1
+        return self._total
+
+    def objeto(self, numero, dicionario, fluxo=None):
+        self._posicoes[numero] = self._posicao
+        self._gravar(b'%d 0 obj\n' % numero)
+        self._gravar(dicionario)
+        if fluxo is not None:
+            self._gravar(b'\nstream\n')
+            self._gravar(fluxo)
+            self._gravar(b'\nendstream')
+        self._gravar(b'\nendobj\n')
+
+    def finalizar(self, raiz):
+        inicio_xref = self._posicao
+        entradas = [b'xref\n0 %d\n0000000000 65535 f \n' % (self._total + 1)]
+        entradas.extend(b'%010d 00000 n \n' % self._posicoes[numero] for numero in range(1, self._total + 1))
+        entradas.append(b'trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (self._total + 1, raiz, inicio_xref))
+        self._gravar(b''.join(entradas))
+
+    def _gravar(self, dados):
+        self._destino.write(dados)
+        self._posicao += len(dados)
+
+
+def _twips(valor):
+    return int(valor or 0) / 20
+
+
+def _ligado(elem, atributo=None):
+    """Valor booleano de uma propriedade OOXML (w:val ausente = ligado) ou de um atributo de DrawingML."""
+    if atributo is not None:
+        return elem.get(atributo) in ('1', 'true', 'on')
+    return elem.get(_ATTR_VAL) not in ('0', 'false', 'off')
+
+
+def _cor(valor):
+    """(r, g, b) de 0 a 1 de uma cor RRGGBB; None para auto (preto no texto e nas bordas)."""
+    if valor is None or not _RE_COR.fullmatch(valor):
+        return None
+    return tuple(int(valor[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+def _texto(p):
+    """Texto do paragrafo como em Paragraph.text (runs diretos, tabulacoes e quebras de linha)."""
+    return ''.join(_texto_run(run) for run in p.iterchildren(_TAG_R))
+
+
+def _texto_run(run):
+    partes = []
+    for filho in run:
+        if filho.tag == _TAG_T:
+            partes.append(filho.text or '')
+        elif filho.tag == _TAG_TAB:
+            partes.append('\t')
+        elif filho.tag == _TAG_BR and filho.get(_ATTR_TYPE) in (None, 'textWrapping'):
+            partes.append('\n')
+    return ''.join(partes)
+
+
+def _quebra_pagina(p):
+    return any(br.get(_ATTR_TYPE) == 'page' for br in p.iter(_TAG_BR))
+
+
+def _texto_pdf(texto):
+    """Texto limitado ao que a codificacao WinAnsi das fontes representa ('?' no resto); tabulacoes digitadas viram espaco."""
+    texto = unicodedata.normalize('NFC', texto).replace('\t', ' ')
+    return texto.encode('cp1252', 'replace').decode('cp1252')
+
+
+def _escapar(texto):
+    dados = texto.encode('cp1252', 'replace')
+    return dados.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)').replace(b'\r', b'')
+
+
+def _largura_caractere(fonte, caractere, negrito):
+    codigo = ord(caractere)
+    if 32 <= codigo <= 126:
+        return fonte.larguras[negrito][codigo - 32]
+    if caractere in fonte.extras:
+        return fonte.extras[caractere][negrito]
+    base = unicodedata.normalize('NFD', caractere)[0]
+    if 32 <= ord(base) <= 126:
+        return fonte.larguras[negrito][ord(base) - 32]
+    return fonte.larguras[negrito][ord('n') - 32]
+
+
+def _larguras_winansi(fonte, negrito):
+    """Larguras dos codigos 32-255 da WinAnsiEncoding (0 nos codigos sem caractere)."""
+    larguras = []
+    for codigo in range(32, 256):
+        try:
+            larguras.append(_largura_caractere(fonte, bytes([codigo]).decode('cp1252'), negrito))
+        except UnicodeDecodeError:
+            larguras.append(0)
+    return larguras
+
+
+def _faixa_recuos(formato, largura):
+    """Faixa das linhas no corpo: largura menos os recuos (a primeira linha com firstLine/hanging), linhas em sequencia."""
+    altura = formato.altura_linha()
+
+    def faixa(indice):
+        deslocamento = formato.recuo_esquerdo + (formato.primeira_linha if indice == 0 else 0)
+        return deslocamento, largura - deslocamento - formato.recuo_direito, indice * altura
+    return faixa
+
+
+def _faixa_contorno(formato, modelo, zonas, topo):
+    """
+    Faixa das linhas de um paragrafo do cabecalho/rodape que comeca em topo
+    (y na pagina), contornando as zonas das imagens ancoradas: a linha usa o
+    maior trecho livre ao lado das imagens (so a esquerda/direita com wrapText
+    left/right) e passa para baixo delas quando sobra menos de 1 em
+    (wrapTopAndBottom sempre passa para baixo).
+    """
+    altura = formato.altura_linha()
+    proxima = [topo]
+
+    def faixa(indice):
+        inicio = modelo.margem_esquerda + formato.recuo_esquerdo + (formato.primeira_linha if indice == 0 else 0)
+        fim = modelo.margem_esquerda + modelo.largura_texto - formato.recuo_direito
+        y = proxima[0]
+        while True:
+            sobrepostas = [zona for zona in zonas if zona[1] < y + altura and zona[3] > y]
+            livres = [(inicio, fim)]
+            for x0, _, x1, _, contorno, lado in sobrepostas:
+                if contorno == 'wrapTopAndBottom':
+                    livres = []
+                    break
+                livres = _subtrair(
+                    livres,
+                    x0 if lado != 'right' else float('-inf'),
+                    x1 if lado != 'left' else float('inf'),
+                )
+            livre = max(livres, key=lambda trecho: trecho[1] - trecho[0], default=None)
+            if not sobrepostas or (livre is not None and livre[1] - livre[0] >= formato.tamanho):
+                break
+            y = min(zona[3] for zona in sobrepostas)
+        proxima[0] = y + altura
+        return livre[0] - modelo.margem_esquerda, livre[1] - livre[0], y - topo
+    return faixa
+
+
+def _subtrair(trechos, inicio, fim):
+    """Trechos [(a, b)] sem o intervalo [inicio, fim]."""
+    resultado = []
+    for a, b in trechos:
+        if a < inicio:
+            resultado.append((a, min(b, inicio)))
+        if b > fim:
+            resultado.append((max(a, fim), b))
+    return resultado
+
+
+def _quebrar_linhas(texto, formato, faixa):
+    """
+    Quebra o texto em linhas (por palavras; palavras maiores que a linha sao
+    divididas). faixa(indice) da (deslocamento, largura, topo) da linha
+    indice, chamada uma vez por linha, em ordem. Retorna
+    [(texto, deslocamento, largura, topo, final)]; final marca as linhas que
+    terminam um trecho (fim do paragrafo ou quebra de linha), nao justificadas.
+    """
+    linhas = []
+    for trecho in texto.split('\n'):
+        deslocamento, largura, topo = faixa(len(linhas))
+        linha = ''
+        for palavra in _RE_PALAVRA.findall(trecho):
+            if linha and formato.largura((linha + palavra).rstrip()) > largura:
+                linhas.append((linha.rstrip(), deslocamento, largura, topo, False))
+                deslocamento, largura, topo = faixa(len(linhas))
+                linha = palavra.lstrip()
+            else:
+                linha += palavra
+            while formato.largura(linha.rstrip()) > largura and len(linha.rstrip()) > 1:
+                corte = len(linha.rstrip()) - 1
+                while corte > 1 and formato.largura(linha[:corte]) > largura:
+                    corte -= 1
+                linhas.append((linha[:corte], deslocamento, largura, topo, False))
+                deslocamento, largura, topo = faixa(len(linhas))
+                linha = linha[corte:]
+        linhas.append((linha.rstrip(), deslocamento, largura, topo, True))
+    return linhas
+
+
+def _deslocamento(alinhamento, largura, ocupado):
+    if alinhamento == 'center':
+        return max(0, (largura - ocupado) / 2)
+    if alinhamento == 'right':
+        return max(0, largura - ocupado)
+    return 0
@@ -0,0 +1,523 @@
+import io
+import os
+import re
+from concurrent.futures import as_completed
+from docx.image.image import Image
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from docx.oxml.shape import CT_Inline
+from docx.shared import Emu
+from docx.text.paragraph import Paragraph
+from lxml import etree
+from functions.image_processing import RegistroImagem, como_registro, preparar_imagens
+from functions.process_pool import dividir_em_partes, obter_pool, quantidade_partes
+
+
+TOKEN_RE = re.compile(r'\[[^\[\]]+\]')
+
+# Abaixo desta quantidade de secoes o preenchimento e feito em serie
+MINIMO_SECOES_PARALELO = int(os.environ.get('DOCUMENTO_MINIMO_SECOES_PARALELO', '8'))
+# Menor quantidade de secoes por parte enviada a um processo
+SECOES_POR_PARTE = 4
+
+# rId provisorio das imagens inseridas fora do documento: prefixo + hash da imagem
+_RID_PROVISORIO = 'hash:'
+
+_TAG_P = qn('w:p')
+_TAG_T = qn('w:t')
+_TAG_TBL = qn('w:tbl')
+_TAG_TR = qn('w:tr')
+_TAG_TC = qn('w:tc')
+_TAG_INLINE = qn('wp:inline')
+_TAG_BLIP = qn('a:blip')
+_ATTR_EMBED = qn('r:embed')
+
+
+class EntradaIndice:
+    """Paragrafo do modelo que contem placeholders conhecidos."""
+
+    __slots__ = ('caminho', 'placeholders')
+
+    def __init__(self, caminho, placeholders):
+        self.caminho = caminho
+        self.placeholders = placeholders
+
+
+class IndicePlaceholders:
+    """
+    Indice dos placeholders de um trecho do modelo (capa ou secao de formulario).
+
+    Construido uma vez por modelo: cada paragrafo e tokenizado com uma unica
+    passada de regex sobre seus nos w:t, e o indice guarda o caminho do
+    paragrafo (posicoes dos filhos a partir dos elementos do trecho) junto com
+    os placeholders encontrados, ja na ordem de processamento. Como as secoes
+    do documento sao copias (deepcopy) desses elementos, o mesmo caminho
+    localiza o paragrafo em qualquer copia.
+
+    Percorre os mesmos blocos que o processamento original: paragrafos e
+    tabelas do body, e paragrafos/tabelas aninhados dentro das celulas.
+    """
+
+    def __init__(self, elementos, ordem_placeholders):
+        self.entradas = []
+        conhecidos = set(ordem_placeholders)
+        self._ordem = tuple(ordem_placeholders)
+        for i, elem in enumerate(elementos):
+            self._indexar(elem, (i,), conhecidos)
+
+    def _indexar(self, elem, caminho, conhecidos):
+        if elem.tag == _TAG_P:
+            texto = ''.join(t.text or '' for t in elem.iter(_TAG_T))
+            if '[' not in texto:
+                return
+            encontrados = conhecidos.intersection(TOKEN_RE.findall(texto))
+            if encontrados:
+                placeholders = tuple(p for p in self._ordem if p in encontrados)
+                self.entradas.append(EntradaIndice(caminho, placeholders))
+        elif elem.tag == _TAG_TBL:
+            for i, linha in enumerate(elem):
+                if linha.tag != _TAG_TR:
+                    continue
+                for j, celula in enumerate(linha):
+                    if celula.tag != _TAG_TC:
+                        continue
+                    for k, bloco in enumerate(celula):
+                        self._indexar(bloco, caminho + (i, j, k), conhecidos)
+
+    def localizar(self, elementos):
+        """
+        Resolve as entradas do indice em uma copia dos elementos.
+        Retorna [(elemento w:p, placeholders)]; resolva tudo antes de alterar a copia.
+        """
+        localizados = []
+        for entrada in self.entradas:
+            no = elementos[entrada.caminho[0]]
+            for posicao in entrada.caminho[1:]:
+                no = no[posicao]
+            localizados.append((no, entrada.placeholders))
+        return localizados
+
+
+class Campo:
+    """Placeholder de um modelo ligado a um campo do formulario."""
+
+    __slots__ = ('placeholder', 'chave', 'caixa')
+
+    def __init__(self, placeholder, chave, caixa=None):
+        self.placeholder = placeholder
+        self.chave = chave
+        # Caixa de exibicao (cm) das imagens do campo; veja preparar_imagem
+        self.caixa = caixa
+
+    def aplicar(self, contexto, paragrafo, texto, dados):
+        """
+        Aplica o campo ao paragrafo. Retorna o texto atualizado, ou None quando
+        o paragrafo ja foi finalizado pelo campo (ex.: substituido por imagem).
+        """
+        raise NotImplementedError
+
+
+class CampoTexto(Campo):
+    """Substitui o placeholder pelo valor texto do formulario da secao."""
+
+    __slots__ = ()
+
+    def aplicar(self, contexto, paragrafo, texto, dados):
+        return texto.replace(self.placeholder, dados.get(self.chave) or '')
+
+
+class CampoGlobal(Campo):
+    """Substitui o placeholder por um valor do documento (ex.: empresa, periodo)."""
+
+    __slots__ = ('primeira_maiuscula',)
+
+    def __init__(self, placeholder, chave, primeira_maiuscula=False):
+        super().__init__(placeholder, chave)
+        self.primeira_maiuscula = primeira_maiuscula
+
+    def aplicar(self, contexto, paragrafo, texto, dados):
+        valor = contexto.globais.get(self.chave) or ''
+        if self.primeira_maiuscula and self.placeholder not in contexto.ja_substituidos:
+            texto = texto.replace(self.placeholder, valor.upper(), 1)
+            contexto.ja_substituidos.add(self.placeholder)
+        return texto.replace(self.placeholder, valor)
+
+
+class CampoImagem(Campo):
+    """
+    Substitui o paragrafo pela imagem do formulario da secao.
+    Sem imagem, o placeholder apenas e removido do texto.
+
+    layout(imagem) retorna (largura, altura, espaco_antes, espaco_depois);
+    espacamentos None mantem o valor do modelo.
+    """
+
+    __slots__ = ('layout',)
+
+    def __init__(self, placeholder, chave, layout, caixa=None):
+        super().__init__(placeholder, chave, caixa)
+        self.layout = layout
+
+    def aplicar(self, contexto, paragrafo, texto, dados):
+        imagem = dados.get(self.chave)
+        if not imagem:
+            return texto.replace(self.placeholder, '')
+
+        largura, altura, espaco_antes, espaco_depois = self.layout(imagem)
+        for run in paragrafo.runs:
+            run.text = ''
+        if espaco_antes is not None:
+            paragrafo.paragraph_format.space_before = espaco_antes
+        if espaco_depois is not None:
+            paragrafo.paragraph_format.space_after = espaco_depois
+        contexto.inserir_imagem(paragrafo, imagem, largura, altura)
+        return None
+
+
+class CampoRegra(Campo):
+    """
+    Placeholder tratado por uma regra de layout propria do modelo.
+    regra(contexto, paragrafo, texto, valor) segue o mesmo contrato de Campo.aplicar.
+    """
+
+    __slots__ = ('regra',)
+
+    def __init__(self, placeholder, chave, regra, caixa=None):
+        super().__init__(placeholder, chave, caixa)
+        self.regra = regra
+
+    def aplicar(self, contexto, paragrafo, texto, dados):
+        return self.regra(contexto, paragrafo, texto, dados.get(self.chave))
+
+
+class LayoutFixo:
+    """Layout de imagem com caixa fixa e o mesmo espacamento antes e depois."""
+
+    __slots__ = ('largura', 'altura', 'espaco')
+
+    def __init__(self, largura, altura, espaco=None):
+        # Guardados como Emu: Cm/Pt recriados pelo pickle (envio do plano ao pool) seriam convertidos de novo
+        self.largura = Emu(largura)
+        self.altura = Emu(altura)
+        self.espaco = Emu(espaco) if espaco is not None else None
+
+    def __call__(self, imagem):
+        return self.largura, self.altura, self.espaco, self.espaco
+
+
+class EspecificacaoModelo:
+    """
+    Especificacao declarativa de um modelo: arquivo, trechos e campos.
+
+    secao='formulario' repete a secao encontrada a partir do [DATA] (com a capa
+    antes dela se com_capa=True); secao='pagina' repete o body inteiro.
+    A ordem de campos e a ordem em que os placeholders de um paragrafo sao tratados.
+    """
+
+    def __init__(self, arquivo, campos, secao='formulario', com_capa=True):
+        self.arquivo = arquivo
+        self.campos = tuple(campos)
+        self.secao = secao
+        self.com_capa = com_capa
+
+    def trechos(self, template):
+        """Retorna (elementos da capa, elementos da secao repetida) do modelo."""
+        if self.secao == 'pagina':
+            return [], template.elementos
+        capa = template.capa if self.com_capa else []
+        return capa, template.secao
+
+
+class PlanoSubstituicao:
+    """Especificacao compilada contra um modelo: indices e campos de cada paragrafo."""
+
+    def __init__(self, espec, template):
+        self.espec = espec
+        campos = {campo.placeholder: campo for campo in espec.campos}
+        ordem = [campo.placeholder for campo in espec.campos]
+        capa, secao = espec.trechos(template)
+
+        self.indice_capa = IndicePlaceholders(capa, ordem)
+        self.indice_secao = IndicePlaceholders(secao, ordem)
+        self._campos_capa = [tuple(campos[p] for p in e.placeholders) for e in self.indice_capa.entradas]
+        self._campos_secao = [tuple(campos[p] for p in e.placeholders) for e in self.indice_secao.entradas]
+
+    def localizar(self, capa, secoes):
+        """Resolve [(indice da secao ou None, elemento w:p, campos)] em ordem de documento."""
+        return self.localizar_capa(capa) + self.localizar_secoes(secoes)
+
+    def localizar_capa(self, capa):
+        return [
+            (None, p, campos)
+            for (p, _), campos in zip(self.indice_capa.localizar(capa), self._campos_capa)
+        ]
+
+    def localizar_secoes(self, secoes):
+        localizados = []
+        for i, secao in enumerate(secoes):
+            localizados.extend(
+                (i, p, campos)
+                for (p, _), campos in zip(self.indice_secao.localizar(secao), self._campos_secao)
+            )
+        return localizados
+
+    def secoes_independentes(self, ja_substituidos):
+        """
+        True se cada secao pode ser preenchida isoladamente: nenhum campo da
+        secao depende do que as secoes anteriores substituiram (primeira
+        ocorrencia em maiusculas ainda pendente).
+        """
+        return all(
+            not getattr(campo, 'primeira_maiuscula', False) or campo.placeholder in ja_substituidos
+            for campos in self._campos_secao
+            for campo in campos
+        )
+
+
+class ContextoDocumento:
+    """
+    Estado de uma execucao do plano sobre um documento.
+
+    As imagens sao registradas pelo hash do conteudo: a mesma foto usada em
+    varios formularios vira uma unica parte de midia no pacote, e as demais
+    insercoes apenas reaproveitam o relacionamento (sem reabrir a imagem).
+    """
+
+    def __init__(self, part, globais=None):
+        self.part = part
+        self.globais = globais or {}
+        self.ja_substituidos = set()
+        self._imagens = {}
+        self._proximo_id = None
+
+    def registrar_imagem(self, imagem):
+        """Retorna (rId, image) da imagem (RegistroImagem) no documento, adicionando-a uma unica vez."""
+        imagem = como_registro(imagem)
+        relacao = self._imagens.get(imagem.hash)
+        if relacao is None:
+            relacao = self.part.get_or_add_image(io.BytesIO(imagem.dados))
+            self._imagens[imagem.hash] = relacao
+        return relacao
+
+    def inserir_imagem(self, paragrafo, imagem, largura, altura):
+        rId, imagem = self.registrar_imagem(imagem)
+        cx, cy = imagem.scaled_dimensions(largura, altura)
+        inline = CT_Inline.new_pic_inline(self._novo_id(), rId, imagem.filename, cx, cy)
+        paragrafo.add_run()._r.add_drawing(inline)
+
+    def _novo_id(self):
+        # part.next_id percorre o documento inteiro; calcula uma vez e incrementa
+        if self._proximo_id is None:
+            self._proximo_id = self.part.next_id
+        novo_id = self._proximo_id
+        self._proximo_id += 1
+        return novo_id
+
+
+class ContextoSecoes:
+    """
+    Estado do preenchimento de secoes fora do documento (em um processo do pool).
+
+    Sem acesso ao pacote, as imagens sao inseridas com rId provisorio (o hash
+    da imagem) e id 0; o documento resolve os dois ao reinserir as secoes,
+    na ordem do documento (veja _resolver_imagens).
+    """
+
+    def __init__(self, globais, ja_substituidos):
+        self.globais = globais
+        self.ja_substituidos = set(ja_substituidos)
+        self._imagens = {}
+
+    def inserir_imagem(self, paragrafo, imagem, largura, altura):
+        imagem = como_registro(imagem)
+        # Mesmo Image que part.get_or_add_image retornaria (nome e dimensoes)
+        info = self._imagens.get(imagem.hash)
+        if info is None:
+            info = self._imagens[imagem.hash] = Image.from_blob(imagem.dados)
+        cx, cy = info.scaled_dimensions(largura, altura)
+        inline = CT_Inline.new_pic_inline(0, _RID_PROVISORIO + imagem.hash.hex(), info.filename, cx, cy)
+        paragrafo.add_run()._r.add_drawing(inline)
+
+
+def obter_plano(template, espec):
+    """Plano compilado da especificacao, guardado junto ao modelo carregado."""
+    return template.derivado(('plano', id(espec)), lambda t: PlanoSubstituicao(espec, t))
+
+
+def executar_plano(plano, part, capa, secoes, formularios, globais=None, perfil='final', progresso=None):
+    """
+    Preenche os placeholders dos elementos ja inseridos no documento.
+
+    capa e secoes sao as copias dos trechos do modelo (na mesma estrutura);
+    o formulario de cada placeholder e o da secao em que ele esta.
+    perfil escolhe a resolucao das imagens ('final' ou 'preview').
+    progresso(etapa, feitos, total), opcional, e chamado com etapa 'imagens'
+    (imagens preparadas) e 'paginas' (secoes preenchidas).
+    """
+    contexto = ContextoDocumento(part, globais)
+    formularios = preparar_formularios(plano.espec, formularios, perfil, progresso)
+
+    for _, p, campos in plano.localizar_capa(capa):
+        _substituir_paragrafo(contexto, Paragraph(p, part), campos, {})
+
+    partes = 1
+    if plano.secoes_independentes(contexto.ja_substituidos):
+        partes = quantidade_partes(len(secoes), MINIMO_SECOES_PARALELO, SECOES_POR_PARTE)
+    if partes > 1:
+        _preencher_secoes_em_paralelo(plano, contexto, secoes, formularios, partes, progresso)
+        return
+
+    # Resolve todos os paragrafos antes de alterar o documento
+    concluidas = 0
+    for secao_idx, p, campos in plano.localizar_secoes(secoes):
+        if progresso is not None and secao_idx is not None and secao_idx > concluidas:
+            concluidas = secao_idx
+            progresso('paginas', concluidas, len(secoes))
+        if secao_idx is not None and secao_idx < len(formularios):
+            dados = formularios[secao_idx] or {}
+        else:
+            dados = {}
+        _substituir_paragrafo(contexto, Paragraph(p, part), campos, dados)
+
+    if progresso is not None:
+        progresso('paginas', len(secoes), len(secoes))
+
+
+def _preencher_secoes_em_paralelo(plano, contexto, secoes, formularios, partes, progresso):
+    """
+    Preenche as secoes em processos do pool, em partes contiguas, e as
+    reinsere no body na ordem original. As imagens sao registradas e os ids
+    de desenho atribuidos na ordem do documento, como no preenchimento em
+    serie, entao o .docx final e identico.
+    """
+    tarefas = []
+    for i, secao in enumerate(secoes):
+        dados = formularios[i] if i < len(formularios) else None
+        tarefas.append((i, [etree.tostring(elem) for elem in secao], dict(dados or {})))
+
+    pool = obter_pool()
+    futuros = {
+        pool.submit(
+            _preencher_secoes_xml,
+            plano.indice_secao,
+            plano._campos_secao,
+            [xml for _, xml, _ in parte],
+            [dados for _, _, dados in parte],
+            contexto.globais,
+            contexto.ja_substituidos,
+        ): parte
+        for parte in dividir_em_partes(tarefas, partes)
+    }
+
+    preenchidas = {}
+    for futuro in as_completed(futuros):
+        parte = futuros[futuro]
+        for (i, _, dados), xml in zip(parte, futuro.result()):
+            preenchidas[i] = (xml, dados)
+        if progresso is not None:
+            progresso('paginas', len(preenchidas), len(secoes))
+
+    for i, secao in enumerate(secoes):
+        xml, dados = preenchidas[i]
+        for antigo, xml_elem in zip(secao, xml):
+            novo = parse_xml(xml_elem)
+            _resolver_imagens(contexto, novo, dados)
+            antigo.getparent().replace(antigo, novo)
+
+
+def _preencher_secoes_xml(indice, campos_entradas, secoes_xml, formularios, globais, ja_substituidos):
+    """Executado no pool: preenche as secoes (XML serializado) e retorna o XML de cada elemento."""
+    contexto = ContextoSecoes(globais, ja_substituidos)
+    resultado = []
+    for xml, dados in zip(secoes_xml, formularios):
+        elementos = [parse_xml(xml_elem) for xml_elem in xml]
+        for (p, _), campos in zip(indice.localizar(elementos), campos_entradas):
+            _substituir_paragrafo(contexto, Paragraph(p, None), campos, dados)
+        resultado.append([etree.tostring(elem) for elem in elementos])
+    return resultado
+
+
+def _resolver_imagens(contexto, elemento, dados):
+    """Troca o rId provisorio e o id 0 das imagens inseridas no pool pelos definitivos."""
+    imagens = None
+    for inline in elemento.iter(_TAG_INLINE):
+        blip = next(inline.iter(_TAG_BLIP), None)
+        rid = blip.get(_ATTR_EMBED) if blip is not None else None
+        if not rid or not rid.startswith(_RID_PROVISORIO):
+            continue
+        if imagens is None:
+            imagens = _imagens_por_hash(dados)
+        rid, _ = contexto.registrar_imagem(imagens[rid[len(_RID_PROVISORIO):]])
+        blip.set(_ATTR_EMBED, rid)
+        shape_id = contexto._novo_id()
+        inline.docPr.id = shape_id
+        inline.docPr.name = 'Picture %d' % shape_id
+
+
+def _imagens_por_hash(dados):
+    """{hash hex: RegistroImagem} das imagens do formulario (sozinhas ou em lista)."""
+    imagens = {}
+    for valor in dados.values():
+        if isinstance(valor, (bytes, bytearray, RegistroImagem)):
+            valor = [valor]
+        elif not isinstance(valor, (list, tuple)):
+            continue
+        for imagem in valor:
+            if isinstance(imagem, (bytes, bytearray, RegistroImagem)):
+                registro = como_registro(imagem)
+                imagens[registro.hash.hex()] = registro
+    return imagens
+
+
+def preparar_formularios(espec, formularios, perfil='final', progresso=None):
+    """
+    Retorna copias dos formularios com as imagens dos campos que tem caixa
+    definida ja reduzidas para essa caixa. As imagens (bytes ou RegistroImagem,
+    sozinhas ou em lista) saem sempre como RegistroImagem.
+
+    Todas as imagens do documento sao preparadas juntas, em paralelo, antes
+    da passada de substituicao no XML.
+    """
+    campos = [campo for campo in espec.campos if campo.caixa is not None]
+    if not campos:
+        return formularios
+
+    preparados = [dict(dados or {}) for dados in formularios]
+    tarefas = []
+    destinos = []
+    for dados in preparados:
+        for campo in campos:
+            valor = dados.get(campo.chave)
+            if not valor:
+                continue
+            if isinstance(valor, (bytes, bytearray, RegistroImagem)):
+                tarefas.append((como_registro(valor), campo.caixa, 1))
+                destinos.append((dados, campo.chave))
+            else:
+                dados[campo.chave] = lista = list(valor)
+                for posicao, imagem in enumerate(lista):
+                    tarefas.append((como_registro(imagem), campo.caixa, len(lista)))
+                    destinos.append((lista, posicao))
+
+    for (alvo, chave), imagem in zip(destinos, preparar_imagens(tarefas, perfil, progresso)):
+        alvo[chave] = imagem
+    return preparados
+
+
+def _substituir_paragrafo(contexto, paragrafo, campos, dados):
+    texto = paragrafo.text
+
+    for campo in campos:
+        if campo.placeholder not in texto:
+            continue
+        texto = campo.aplicar(contexto, paragrafo, texto, dados)
+        if texto is None:
+            return
+
+    for run in paragrafo.runs:
+        run.text = ''
+
+    if paragrafo.runs:
+        paragrafo.runs[0].text = texto
+    else:
+        paragrafo.add_run(texto)
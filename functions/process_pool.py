@@ -0,0 +1,60 @@
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+
+# Processos que montam partes de um documento em paralelo (1 = sempre em serie)
+PROCESSOS_DOCUMENTO = int(os.environ.get('DOCUMENTO_PROCESSOS', str(min(4, os.cpu_count() or 1))))
+
+_pool = None
+_lock_pool = threading.Lock()
+# True nos processos do pool: as partes ja estao divididas, nada e dividido de novo la dentro
+_em_processo_do_pool = False
+
+
+def quantidade_partes(total, minimo, por_parte):
+    """
+    Em quantas partes paralelas dividir total itens (1 = em serie).
+    Abaixo de minimo itens o custo de dividir e juntar nao compensa; cada
+    parte tem ao menos por_parte itens.
+    """
+    if PROCESSOS_DOCUMENTO <= 1 or total < minimo:
+        return 1
+    # Processos daemon (ex.: workers da fila de jobs) nao podem criar processos filhos, e
+    # dentro do pool (ex.: paginas do modelo 1 que preenchem secoes) um pool aninhado nao encerra
+    if multiprocessing.current_process().daemon or _em_processo_do_pool:
+        return 1
+    return max(1, min(PROCESSOS_DOCUMENTO, total // por_parte))
+
+
+def dividir_em_partes(itens, partes):
+    """Divide itens em partes contiguas (na ordem) de tamanhos quase iguais."""
+    tamanho, resto = divmod(len(itens), partes)
+    fatias = []
+    inicio = 0
+    for i in range(partes):
+        fim = inicio + tamanho + (1 if i < resto else 0)
+        fatias.append(itens[inicio:fim])
+        inicio = fim
+    return fatias
+
+
+def obter_pool():
+    """Pool de processos compartilhado, criado no primeiro uso."""
+    global _pool
+    if _pool is None:
+        with _lock_pool:
+            if _pool is None:
+                # 'spawn': os processos nao herdam as threads (pool de imagens, streaming) do servidor
+                _pool = ProcessPoolExecutor(
+                    max_workers=PROCESSOS_DOCUMENTO,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_marcar_processo_do_pool
+                )
+    return _pool
+
+
+def _marcar_processo_do_pool():
+    global _em_processo_do_pool
+    _em_processo_do_pool = True
@@ -0,0 +1,121 @@
+import io
+import os
+import queue
+import threading
+
+
+# Tamanho (KB) dos blocos enviados ao cliente
+TAMANHO_BLOCO_KB = int(os.environ.get('DOCUMENTO_STREAM_BLOCO_KB', '64'))
+# Blocos prontos aguardando envio; com a fila cheia a gravacao espera o cliente
+BLOCOS_EM_ESPERA = 16
+# Espera (s) entre verificacoes de cancelamento enquanto a fila esta cheia
+_ESPERA_FILA = 0.5
+
+_FIM = object()
+
+
+class GeracaoCancelada(Exception):
+    """O cliente deixou de receber o documento; a geracao e interrompida."""
+
+
+class SaidaEmBlocos(io.RawIOBase):
+    """
+    Destino nao-seekable para doc.save: os bytes gravados pelo zipfile sao
+    agrupados em blocos de tamanho fixo e entregues a uma funcao.
+    Como tell()/seek() nao sao suportados, o zipfile grava cada membro em
+    sequencia (com data descriptor), sem voltar no arquivo.
+    """
+
+    def __init__(self, entregar, tamanho_bloco=None):
+        super().__init__()
+        self._entregar = entregar
+        self._tamanho_bloco = tamanho_bloco or TAMANHO_BLOCO_KB * 1024
+        self._buffer = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, dados):
+        self._buffer += dados
+        while len(self._buffer) >= self._tamanho_bloco:
+            self._entregar(bytes(self._buffer[:self._tamanho_bloco]))
+            del self._buffer[:self._tamanho_bloco]
+        return len(dados)
+
+    def finalizar(self):
+        """Entrega o ultimo bloco (incompleto)."""
+        if self._buffer:
+            self._entregar(bytes(self._buffer))
+            self._buffer.clear()
+
+
+def gerar_em_blocos(gerar, guardar=None, limite_copia=0):
+    """
+    Executa gerar(destino) em uma thread e retorna um iterador com os blocos
+    do .docx a medida que os membros do zip sao gravados.
+
+    So a saida serializada e transmitida: o arquivo gravado nunca fica inteiro
+    em memoria (no maximo BLOCOS_EM_ESPERA blocos), mas o documento que gerar
+    monta antes de gravar (arvore do python-docx e partes das imagens) ainda
+    cresce com o tamanho do documento.
+
+    Erros antes do primeiro bloco sao relancados no primeiro next(), entao a
+    rota ainda pode responder com erro. Se o iterador for fechado antes do fim
+    (cliente desconectou), a geracao e interrompida.
+
+    guardar(bytes), opcional, recebe o documento completo ao final, desde que
+    ele tenha no maximo limite_copia bytes (ex.: para o cache de documentos).
+    """
+    fila = queue.Queue(maxsize=BLOCOS_EM_ESPERA)
+    cancelado = threading.Event()
+
+    def entregar(bloco):
+        while True:
+            try:
+                fila.put(bloco, timeout=_ESPERA_FILA)
+                return
+            except queue.Full:
+                if cancelado.is_set():
+                    raise GeracaoCancelada()
+
+    def produzir():
+        try:
+            saida = SaidaEmBlocos(entregar)
+            gerar(saida)
+            saida.finalizar()
+            entregar(_FIM)
+        except GeracaoCancelada:
+            pass
+        except BaseException as e:
+            try:
+                entregar(e)
+            except GeracaoCancelada:
+                pass
+
+    threading.Thread(target=produzir, name='documento-stream', daemon=True).start()
+
+    def consumir():
+        copia = [] if guardar is not None else None
+        tamanho = 0
+        try:
+            while True:
+                bloco = fila.get()
+                if bloco is _FIM:
+                    break
+                if isinstance(bloco, BaseException):
+                    raise bloco
+
+                tamanho += len(bloco)
+                if copia is not None:
+                    if tamanho > limite_copia:
+                        copia = None
+                    else:
+                        copia.append(bloco)
+                yield bloco
+        finally:
+            cancelado.set()
+
+        if copia is not None:
+            guardar(b''.join(copia))
+
+    return consumir()
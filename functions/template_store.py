@@ -0,0 +1,160 @@
+import io
+import os
+import threading
+import zipfile
+from copy import deepcopy
+from docx import Document
+from docx.parts.document import DocumentPart
+from lxml import etree
+
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+DOCUMENTO_XML = 'word/document.xml'
+DIRETORIO_MODELOS = os.path.join(os.path.dirname(__file__), '..', 'documento')
+
+_templates = {}
+_lock = threading.Lock()
+
+
+class TemplateCompilado:
+    """
+    Modelo .docx carregado uma unica vez por processo.
+
+    Guarda o pacote ja parseado pelo python-docx (com o body vazio), os
+    elementos do document.xml, as demais partes do pacote como bytes crus e a
+    divisao capa/secao de formulario. Cada requisicao recebe copias dos
+    elementos e do document.xml, nunca os originais.
+    """
+
+    def __init__(self, nome, caminho, mtime, conteudo):
+        self.nome = nome
+        self.caminho = caminho
+        self.mtime = mtime
+        self.conteudo = conteudo
+        self.ordem_partes = []
+        self.partes = {}
+        self._derivados = {}
+        self._lock_derivados = threading.RLock()
+
+        with zipfile.ZipFile(io.BytesIO(conteudo), 'r') as zip_ref:
+            for info in zip_ref.infolist():
+                self.ordem_partes.append(info.filename)
+                if info.filename != DOCUMENTO_XML:
+                    self.partes[info.filename] = zip_ref.read(info.filename)
+
+        # Pacote parseado uma unica vez; novo_documento copia so o document.xml
+        self._documento = Document(io.BytesIO(conteudo))
+        self._partes_compartilhadas = {
+            id(parte): parte for parte in self._documento.part.package.iter_parts()
+            if not isinstance(parte, DocumentPart)
+        }
+        raiz = self._documento.element
+
+        body = raiz.find(f'{{{W_NS}}}body')
+        self.elementos = [e for e in body if not e.tag.endswith('}sectPr')]
+
+        # Raiz "vazia": mesmo document.xml, mas com o body contendo so o sectPr final
+        for elem in self.elementos:
+            body.remove(elem)
+        self._raiz_vazia = raiz
+
+        self._erro_secao = None
+        self.idx_inicio_secao = None
+        try:
+            self.idx_inicio_secao = encontrar_inicio_secao_formulario(self.elementos, nome)
+        except ValueError as e:
+            self._erro_secao = e
+
+    @property
+    def capa(self):
+        """Elementos anteriores a secao de formulario (originais, nao alterar)."""
+        if self._erro_secao is not None:
+            raise self._erro_secao
+        return self.elementos[:self.idx_inicio_secao]
+
+    @property
+    def secao(self):
+        """Elementos da secao de formulario repetivel (originais, nao alterar)."""
+        if self._erro_secao is not None:
+            raise self._erro_secao
+        return self.elementos[self.idx_inicio_secao:]
+
+    def nova_raiz(self):
+        """Retorna (raiz, body) de um document.xml novo com o body vazio, exceto pelo sectPr."""
+        raiz = deepcopy(self._raiz_vazia)
+        return raiz, raiz.find(f'{{{W_NS}}}body')
+
+    def empacotar(self, raiz):
+        """Monta o .docx em memoria com as partes do modelo e o document.xml informado."""
+        document_xml = etree.tostring(raiz, xml_declaration=True, encoding='UTF-8', standalone=True)
+        saida = io.BytesIO()
+        with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+            for nome in self.ordem_partes:
+                if nome == DOCUMENTO_XML:
+                    zip_ref.writestr(nome, document_xml)
+                else:
+                    zip_ref.writestr(nome, self.partes[nome])
+        return saida.getvalue()
+
+    def derivado(self, chave, fabrica):
+        """Valor derivado do modelo (ex.: indice de placeholders), calculado uma vez por carga."""
+        valor = self._derivados.get(chave)
+        if valor is None:
+            with self._lock_derivados:
+                valor = self._derivados.get(chave)
+                if valor is None:
+                    valor = fabrica(self)
+                    self._derivados[chave] = valor
+        return valor
+
+    def novo_documento(self):
+        """
+        Document do python-docx com o body vazio (so o sectPr final), sem reler o
+        pacote: o document.xml e suas relacoes sao copiados do pacote ja parseado
+        e as demais partes (estilos, cabecalhos, rodapes, midias) sao
+        compartilhadas entre as requisicoes, por isso nao devem ser alteradas.
+        """
+        return deepcopy(self._documento, dict(self._partes_compartilhadas))
+
+
+def caminho_modelo(modelo_arquivo):
+    return os.path.join(DIRETORIO_MODELOS, modelo_arquivo)
+
+
+def obter_template(modelo_arquivo):
+    """
+    Retorna o TemplateCompilado do modelo, carregando-o na primeira chamada.
+    O modelo e recarregado automaticamente quando o mtime do arquivo muda.
+    """
+    modelo_path = caminho_modelo(modelo_arquivo)
+
+    try:
+        mtime = os.stat(modelo_path).st_mtime_ns
+    except FileNotFoundError:
+        raise FileNotFoundError(f"Arquivo modelo nao encontrado em {modelo_path}")
+
+    template = _templates.get(modelo_arquivo)
+    if template is not None and template.mtime == mtime:
+        return template
+
+    with _lock:
+        template = _templates.get(modelo_arquivo)
+        if template is None or template.mtime != mtime:
+            with open(modelo_path, 'rb') as arquivo_modelo:
+                conteudo = arquivo_modelo.read()
+            template = TemplateCompilado(modelo_arquivo, modelo_path, mtime, conteudo)
+            _templates[modelo_arquivo] = template
+        return template
+
+
+def encontrar_inicio_secao_formulario(elementos_sem_sectpr, nome_modelo='modelo2.docx'):
+    """Encontra onde a secao repetivel (paginas 2 e 3) comeca no modelo."""
+    for i, elem in enumerate(elementos_sem_sectpr):
+        texto = ''.join(elem.itertext())
+        if '[DATA]' in texto:
+            return max(0, i - 1)
+
+    raise ValueError(
+        f'Nao foi possivel encontrar o inicio da secao de formulario no {nome_modelo}. '
+        'Verifique se o placeholder [DATA] existe nas paginas de formulario.'
+    )
@@ -0,0 +1,51 @@
+import os
+import shutil
+import tempfile
+import uuid
+from functions.image_processing import criar_registro_imagem, criar_registro_imagem_arquivo
+
+
+# Uploads acima deste tamanho (KB) vao para a area temporaria em disco em vez da memoria
+LIMITE_SPOOL_KB = int(os.environ.get('DOCUMENTO_UPLOAD_SPOOL_KB', '512'))
+# Onde as areas temporarias das requisicoes sao criadas (padrao: pasta temporaria do sistema)
+DIRETORIO_SPOOL = os.environ.get('DOCUMENTO_UPLOAD_SPOOL_DIR') or None
+
+
+class AreaTemporaria:
+    """
+    Pasta temporaria de uma requisicao para os uploads grandes. Criada apenas
+    quando o primeiro arquivo e gravado; limpar() remove tudo.
+    """
+
+    def __init__(self):
+        self.pasta = None
+
+    def novo_caminho(self):
+        if self.pasta is None:
+            self.pasta = tempfile.mkdtemp(prefix='documentacao_upload_', dir=DIRETORIO_SPOOL)
+        return os.path.join(self.pasta, uuid.uuid4().hex)
+
+    def limpar(self):
+        if self.pasta is not None:
+            shutil.rmtree(self.pasta, ignore_errors=True)
+            self.pasta = None
+
+
+def registrar_upload(arquivo, area):
+    """
+    RegistroImagem do arquivo enviado (FileStorage), ou None se vazio.
+    Ate LIMITE_SPOOL_KB os bytes ficam em memoria; acima disso o arquivo e
+    gravado na area temporaria e so e lido quando a imagem for usada.
+    """
+    arquivo.seek(0, os.SEEK_END)
+    tamanho = arquivo.tell()
+    arquivo.seek(0)
+
+    if not tamanho:
+        return None
+    if tamanho <= LIMITE_SPOOL_KB * 1024:
+        return criar_registro_imagem(arquivo.read())
+
+    caminho = area.novo_caminho()
+    arquivo.save(caminho)
+    return criar_registro_imagem_arquivo(caminho)
@@ -0,0 +1,11 @@
+# Configuracao do gunicorn (Procfile e render.yaml). Opcoes de linha de comando continuam valendo.
+
+
+def post_worker_init(worker):
+    """
+    Inicia os workers da fila de jobs junto com cada processo web, e nao so no
+    primeiro envio: apos um restart ou deploy, jobs pendentes (ou abandonados,
+    veja TEMPO_ABANDONO) voltam a ser processados sem esperar um novo job.
+    """
+    from functions.job_queue import iniciar_workers
+    iniciar_workers()
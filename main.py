@@ -1,8 +1,45 @@
-from flask import Flask, render_template, request, send_file, jsonify
-from functions.document_generator import gerar_documento, gerar_documento_multiplo
-from functions.document_generator2 import gerar_documento_modelo2_empresa
-from functions.document_generator3 import gerar_documento_modelo3_alipen
+from flask import Flask, Response, g, render_template, request, send_file, jsonify
+from functions.document_generator import gerar_documento, gerar_documento_multiplo, gerar_pdf_modelo1
+from functions.document_generator2 import gerar_documento_modelo2_empresa, gerar_pdf_modelo2_empresa
+from functions.document_generator3 import gerar_documento_modelo3_alipen, gerar_pdf_modelo3_alipen
+from functions.pdf_renderer import LayoutNaoSuportado
+from functions.document_cache import LIMITE_COPIA_STREAM_MB, cache_documentos, chave_documento
+from functions.stream_writer import gerar_em_blocos
+from functions.upload_spool import AreaTemporaria, registrar_upload
+from functions.form_readers import convertar_data, ler_imagens, ler_pedido_modelo1, ler_pedido_modelo2, ler_pedido_modelo3
+from functions.job_queue import (
+    ESTADO_CONCLUIDO,
+    ESTADO_ERRO,
+    ESTADO_EXECUTANDO,
+    ESTADO_PENDENTE,
+    caminho_resultado,
+    enviar_job,
+    enviar_lote,
+    iniciar_workers,
+    obter_job,
+    obter_lote,
+)
+from functions.document_batch import (
+    ArquivoImagens,
+    gravar_zip_lote,
+    ler_documento_lote,
+    ler_manifesto,
+    nomes_arquivos,
+    registro_blob,
+)
+from functions.blob_store import (
+    TAMANHO_PARTE_MB,
+    BlobNaoEncontrado,
+    ParteInvalida,
+    UploadNaoEncontrado,
+    concluir_upload,
+    estado_upload,
+    gravar_parte,
+    guardar_blob,
+    iniciar_upload,
+)
 import base64
+import gzip
 import io
 import gc
 import re
@@ -17,6 +54,9 @@ warnings.filterwarnings('ignore', category=UserWarning, module='openpyxl')
 
 app = Flask(__name__, template_folder='templates')
 
+MIMETYPE_DOCX = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+MIMETYPE_PDF = 'application/pdf'
+
 # Rota para pré-visualização em PDF do documento
 @app.route('/preview-documento-pdf', methods=['POST'])
 def preview_documento_pdf():
@@ -48,8 +88,8 @@ def preview_documento_pdf():
                 if match:
                     indices.add(int(match.group(2)))
 
-            for key in request.files.keys():
-                match = re.match(r'^imagens-(\d+)$', key)
+            for key in list(request.files.keys()) + list(request.form.keys()):
+                match = re.match(r'^imagens-(\d+)(?:_hash)?$', key)
                 if match:
                     indices.add(int(match.group(1)))
 
@@ -59,14 +99,7 @@ def preview_documento_pdf():
                 data_str = convertar_data(data_input) if data_input else '[DATA]'
                 legenda = (request.form.get(f'legenda-{idx}', '') or '').strip() or '[LEGENDA]'
 
-                imagens = []
-                arquivos = request.files.getlist(f'imagens-{idx}')
-                for arquivo in arquivos[:4]:
-                    if arquivo and arquivo.filename:
-                        arquivo.seek(0)
-                        conteudo = arquivo.read()
-                        if conteudo:
-                            imagens.append(conteudo)
+                imagens = ler_imagens(f'imagens-{idx}', request.form, request.files, carregar_imagem)[:4]
 
                 formularios_preview.append({
                     'unidade': unidade,
@@ -75,6 +108,10 @@ def preview_documento_pdf():
                     'imagens': imagens
                 })
 
+        # Pré-visualização paginada: apenas os formulários pedidos
+        if formularios_preview:
+            formularios_preview = [formularios_preview[i] for i in intervalo_formularios(len(formularios_preview))]
+
         if not formularios_preview:
             formularios_preview = [{
                 'unidade': '[UNIDADE]',
@@ -84,15 +121,17 @@ def preview_documento_pdf():
             }]
 
         # Gera DOCX de 1 ou varias paginas conforme quantidade de formularios.
-        if len(formularios_preview) == 1:
-            form = formularios_preview[0]
-            docx_bytes = gerar_documento(form['unidade'], form['data'], form['legenda'], form['imagens'])
-        else:
-            docx_bytes = gerar_documento_multiplo(formularios_preview)
-
-        # Retorna o DOCX como base64 para o browser renderizar com docx-preview.js
-        docx_b64 = base64.b64encode(docx_bytes).decode('utf-8')
-        return jsonify({'docx_b64': docx_b64})
+        formato = formato_documento()
+        docx_bytes = gerar_documento_modelo1(formularios_preview, perfil_preview(), formato)
+
+        # Retorna o DOCX como base64 para o browser renderizar com docx-preview.js (ou o PDF, com ?formato=pdf)
+        return resposta_preview(docx_bytes, formato)
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except LayoutNaoSuportado as e:
+        return resposta_layout_nao_suportado(e)
+    except ValueError as e:
+        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 400
     except Exception as e:
         return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 500
 
@@ -128,79 +167,92 @@ def preview_documento():
 def preview_documento_pdf_modelo2():
     """Gera o DOCX modelo2 preenchido e retorna como base64 para renderização no browser"""
     try:
-        from datetime import datetime
+        # Pré-visualização paginada: apenas os formulários pedidos (veja intervalo_formularios)
+        formato = formato_documento()
+        documento_bytes = gerar_documento_modelo2(*ler_pedido_modelo2(request.form, request.files, carregar_imagem, preview=True, selecionar=intervalo_formularios), perfil_preview(), formato)
+
+        return resposta_preview(documento_bytes, formato)
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except LayoutNaoSuportado as e:
+        return resposta_layout_nao_suportado(e)
+    except ValueError as e:
+        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 500
 
-        empresa = request.form.get('empresa', '').strip() or '[EMPRESA]'
 
-        data_inicio_iso = request.form.get('data_inicio', '').strip()
-        data_fim_iso = request.form.get('data_fim', '').strip()
+@app.route('/imagens', methods=['POST'])
+def enviar_imagens():
+    """
+    Recebe imagens uma única vez e guarda no armazenamento por hash.
+    Pré-visualizações e gerações referenciam a imagem por '<campo>_hash'.
+    """
+    arquivos = [arquivo for arquivo in request.files.getlist('imagem') if arquivo and arquivo.filename]
+    if not arquivos:
+        return jsonify({'erro': 'Nenhuma imagem enviada'}), 400
+
+    hashes = []
+    for arquivo in arquivos:
+        conteudo = arquivo.read()
+        if not conteudo:
+            return jsonify({'erro': f'Imagem vazia: {arquivo.filename}'}), 400
+        hashes.append(guardar_blob(conteudo))
+    return jsonify({'hashes': hashes})
+
+
+@app.route('/uploads', methods=['POST'])
+def iniciar_envio_em_partes():
+    """
+    Inicia o envio em partes de uma imagem grande. Corpo JSON: {tamanho, hash (opcional)}.
+    As partes vão para PUT /uploads/<id>?offset=N (cabeçalho X-Checksum-SHA256) e
+    POST /uploads/<id>/concluir retorna o hash para usar em '<campo>_hash'.
+    """
+    dados = request.get_json(silent=True) or {}
+    try:
+        upload_id = iniciar_upload(int(dados.get('tamanho') or 0), dados.get('hash'))
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    return jsonify({'id': upload_id, 'offset': 0, 'tamanho_parte': TAMANHO_PARTE_MB * 1024 * 1024}), 201
 
-        try:
-            data_inicio_obj = datetime.strptime(data_inicio_iso, '%Y-%m-%d')
-            data_fim_obj = datetime.strptime(data_fim_iso, '%Y-%m-%d')
-            data_inicio = data_inicio_obj.strftime('%d/%m/%Y')
-            data_fim = data_fim_obj.strftime('%d/%m/%Y')
-        except Exception:
-            data_inicio = '[DATA_INICIO]'
-            data_fim = '[DATA_FIM]'
-
-        indices_formulario = []
-        for key in request.form.keys():
-            match = re.fullmatch(r'data_formulario-(\d+)', key)
-            if match:
-                indices_formulario.append(int(match.group(1)))
-
-        if not indices_formulario:
-            indices_formulario = [0]
-
-        total_formularios = max(indices_formulario) + 1
-        datas_formulario = []
-
-        for form_index in range(total_formularios):
-            data_formulario_iso = request.form.get(f'data_formulario-{form_index}', '').strip()
-            if data_formulario_iso:
-                try:
-                    data_formulario_obj = datetime.strptime(data_formulario_iso, '%Y-%m-%d')
-                    datas_formulario.append(data_formulario_obj.strftime('%d/%m/%Y'))
-                except Exception:
-                    datas_formulario.append('')
-            else:
-                datas_formulario.append('')
-
-        imagens_formularios = []
-        for index in range(len(datas_formulario)):
-            imagem_lanche = request.files.get(f'imagem_lanche-{index}')
-            imagem_ceia = request.files.get(f'imagem_ceia-{index}')
-
-            dados_form = {
-                'imagem_lanche': imagem_lanche.read() if imagem_lanche and imagem_lanche.filename else None,
-                'imagem_ceia': imagem_ceia.read() if imagem_ceia and imagem_ceia.filename else None,
-                'legenda_lanche': request.form.get(f'legenda_lanche-{index}', '').strip(),
-                'legenda_ceia': request.form.get(f'legenda_ceia-{index}', '').strip()
-            }
-            for n in range(1, 5):
-                f_almoco = request.files.get(f'imagem_almoco_{n}-{index}')
-                dados_form[f'imagem_almoco_{n}'] = f_almoco.read() if f_almoco and f_almoco.filename else None
-                dados_form[f'proteina_almoco_{n}'] = request.form.get(f'proteina_almoco_{n}-{index}', '').strip()
-                dados_form[f'peso_almoco_{n}'] = request.form.get(f'peso_almoco_{n}-{index}', '').strip()
-                if n <= 2:
-                    dados_form[f'acompanhamento_almoco_{n}'] = request.form.get(f'acompanhamento_almoco_{n}-{index}', '').strip()
-                f_jantar = request.files.get(f'imagem_jantar_{n}-{index}')
-                dados_form[f'imagem_jantar_{n}'] = f_jantar.read() if f_jantar and f_jantar.filename else None
-                dados_form[f'proteina_jantar_{n}'] = request.form.get(f'proteina_jantar_{n}-{index}', '').strip()
-                dados_form[f'peso_jantar_{n}'] = request.form.get(f'peso_jantar_{n}-{index}', '').strip()
-                if n <= 2:
-                    dados_form[f'acompanhamento_jantar_{n}'] = request.form.get(f'acompanhamento_jantar_{n}-{index}', '').strip()
-            imagens_formularios.append(dados_form)
-
-        documento_bytes = gerar_documento_modelo2_empresa(
-            empresa, data_inicio, data_fim, datas_formulario, imagens_formularios
+
+@app.route('/uploads/<upload_id>', methods=['GET', 'PUT'])
+def envio_em_partes(upload_id):
+    """GET informa quanto já foi recebido (para retomar); PUT grava a próxima parte."""
+    try:
+        if request.method == 'GET':
+            return jsonify(estado_upload(upload_id))
+
+        offset = int(request.args.get('offset', '-1'))
+        novo_offset = gravar_parte(
+            upload_id, offset, request.get_data(cache=False), request.headers.get('X-Checksum-SHA256')
         )
+        return jsonify({'offset': novo_offset})
+    except UploadNaoEncontrado as e:
+        return jsonify({'erro': str(e)}), 404
+    except ParteInvalida as e:
+        return jsonify({'erro': str(e), 'offset': e.offset}), 409
+    except ValueError:
+        return jsonify({'erro': 'Parâmetro offset inválido'}), 400
+
+
+@app.route('/uploads/<upload_id>/concluir', methods=['POST'])
+def concluir_envio_em_partes(upload_id):
+    """Finaliza o envio: o arquivo montado entra no armazenamento de imagens por hash."""
+    try:
+        return jsonify({'hash': concluir_upload(upload_id)})
+    except UploadNaoEncontrado as e:
+        return jsonify({'erro': str(e)}), 404
+    except ParteInvalida as e:
+        return jsonify({'erro': str(e), 'offset': e.offset}), 409
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
 
-        docx_b64 = base64.b64encode(documento_bytes).decode('utf-8')
-        return jsonify({'docx_b64': docx_b64})
-    except Exception as e:
-        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 500
+
+@app.route('/cache-stats')
+def cache_stats():
+    """Contadores do cache de documentos gerados (monitoramento)"""
+    return jsonify(cache_documentos.estatisticas())
 
 
 @app.route('/')
@@ -313,78 +365,20 @@ def consolidar_arquivos_excel(files):
 def gerar_doc():
     """Rota para gerar e fazer download do documento único com múltiplas páginas"""
     try:
-        # Coleta todos os formulários do request
-        formularios = []
-        form_index = 0
-        
-        # Procura por formulários no formato formulario-0, formulario-1, etc
-        while True:
-            unidade = request.form.get(f'unidade-{form_index}', '').strip()
-            data_input = request.form.get(f'data-{form_index}', '').strip()
-            legenda = request.form.get(f'legenda-{form_index}', '').strip()
-            
-            if not unidade and not data_input and not legenda:
-                break
-            
-            # Valida campos obrigatórios do formulário
-            if not unidade or not data_input or not legenda:
-                return {'erro': f'Todos os campos do formulário {form_index + 1} devem ser preenchidos'}, 400
-            
-            # Formata a data
-            data_formatada = convertar_data(data_input)
-            
-            # Processa as imagens deste formulário
-            imagens = []
-            imagens_key = f'imagens-{form_index}'
-            
-            if imagens_key not in request.files or len(request.files.getlist(imagens_key)) == 0:
-                return {'erro': f'Pelo menos uma imagem deve ser enviada no formulário {form_index + 1}'}, 400
-            
-            arquivos = request.files.getlist(imagens_key)
-            
-            # Limita a 4 imagens
-            if len(arquivos) > 4:
-                return {'erro': f'Máximo de 4 imagens permitidas no formulário {form_index + 1}'}, 400
-            
-            for arquivo in arquivos:
-                if arquivo and arquivo.filename != '':
-                    # Lê os bytes do arquivo e validação
-                    arquivo.seek(0)  # Reseta o ponteiro para o início
-                    arquivo_bytes = arquivo.read()
-                    if len(arquivo_bytes) > 0:
-                        imagens.append(arquivo_bytes)
-            
-            if not imagens:
-                return {'erro': f'Pelo menos uma imagem válida deve ser enviada no formulário {form_index + 1}'}, 400
-            
-            formularios.append({
-                'unidade': unidade,
-                'data': data_formatada,
-                'legenda': legenda,
-                'imagens': imagens
-            })
-            
-            form_index += 1
-        
-        if not formularios:
-            return {'erro': 'Pelo menos um formulário deve ser preenchido'}, 400
+        formularios = ler_pedido_modelo1(request.form, request.files, carregar_imagem)
         
-        # Se houver apenas 1 formulário, usa gerar_documento
-        if len(formularios) == 1:
-            form = formularios[0]
-            documento_bytes = gerar_documento(form['unidade'], form['data'], form['legenda'], form['imagens'])
-        else:
-            # Gera o documento único com múltiplas páginas
-            documento_bytes = gerar_documento_multiplo(formularios)
-        
-        # Retorna o documento como download
-        return send_file(
-            io.BytesIO(documento_bytes),
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name='documentacao.docx'
-        )
+        # Gera o documento (1 ou várias páginas), ou reaproveita um download já gerado com os mesmos
+        # dados, e transmite enquanto o pacote é gravado (PDF com ?formato=pdf). A pré-visualização
+        # tem entrada própria no cache (perfil 'preview' e intervalo fazem parte da chave)
+        formato = formato_documento()
+        return resposta_documento(*documento_modelo1(formularios, formato=formato), f'documentacao.{formato}', formato)
     
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except LayoutNaoSuportado as e:
+        return resposta_layout_nao_suportado(e)
+    except ValueError as e:
+        return {'erro': str(e)}, 400
     except Exception as e:
         return {'erro': str(e)}, 500
 
@@ -393,269 +387,412 @@ def gerar_doc():
 def gerar_doc_modelo2():
     """Rota para gerar modelo2 com capa fixa e secoes de formularios repetidas"""
     try:
-        from datetime import datetime
+        formato = formato_documento()
+        return resposta_documento(*documento_modelo2(*ler_pedido_modelo2(request.form, request.files, carregar_imagem), formato=formato), f'modelo2.{formato}', formato)
+
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except LayoutNaoSuportado as e:
+        return resposta_layout_nao_suportado(e)
+    except ValueError as e:
+        return {'erro': str(e)}, 400
+    except Exception as e:
+        return {'erro': str(e)}, 500
 
-        empresa = request.form.get('empresa', '').strip()
-        if not empresa:
-            empresa = request.form.get('unidade-0', '').strip()
 
-        if not empresa:
-            return {'erro': 'O campo Empresa deve ser preenchido'}, 400
+@app.route('/gerar-documento3', methods=['POST'])
+def gerar_doc_modelo3():
+    """Rota para gerar modelo3 (ALIPEN) com 4 campos: café, lanche, almoço, jantar"""
+    try:
+        formato = formato_documento()
+        return resposta_documento(*documento_modelo3(*ler_pedido_modelo3(request.form, request.files, carregar_imagem), formato=formato), f'modelo3.{formato}', formato)
+
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except LayoutNaoSuportado as e:
+        return resposta_layout_nao_suportado(e)
+    except ValueError as e:
+        return {'erro': str(e)}, 400
+    except Exception as e:
+        return {'erro': str(e)}, 500
+
+
+@app.route('/jobs/gerar-documento2', methods=['POST'])
+def enviar_job_modelo2():
+    """Coloca a geração do modelo2 na fila de jobs; retorna o id para acompanhar e baixar"""
+    try:
+        empresa, data_inicio, data_fim, datas_formulario, imagens_formularios = ler_pedido_modelo2(request.form, request.files, carregar_imagem)
+        return resposta_job(enviar_job('modelo2', {
+            'empresa': empresa,
+            'data_inicio': data_inicio,
+            'data_fim': data_fim,
+            'datas_formulario': datas_formulario,
+            'imagens_formularios': imagens_formularios,
+        }))
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
 
-        data_inicio_iso = request.form.get('data_inicio', '').strip()
-        data_fim_iso = request.form.get('data_fim', '').strip()
 
-        if not data_inicio_iso or not data_fim_iso:
-            return {'erro': 'Os campos de Período (Data Início e Data Fim) devem ser preenchidos'}, 400
+@app.route('/jobs/gerar-documento3', methods=['POST'])
+def enviar_job_modelo3():
+    """Coloca a geração do modelo3 na fila de jobs; retorna o id para acompanhar e baixar"""
+    try:
+        datas_formulario, unidades_formulario, imagens_formularios = ler_pedido_modelo3(request.form, request.files, carregar_imagem)
+        return resposta_job(enviar_job('modelo3', {
+            'datas_formulario': datas_formulario,
+            'unidades_formulario': unidades_formulario,
+            'imagens_formularios': imagens_formularios,
+        }))
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+
+
+@app.route('/jobs/<job_id>')
+def status_job(job_id):
+    """Estado e progresso do job (páginas concluídas, imagens processadas)"""
+    job = obter_job(job_id)
+    if job is None:
+        return jsonify({'erro': 'Job não encontrado'}), 404
+    if job['estado'] in (ESTADO_PENDENTE, ESTADO_EXECUTANDO):
+        # Job ainda na fila: garante workers neste processo (reinicia os que morreram)
+        iniciar_workers()
+    return jsonify(job)
+
+
+@app.route('/jobs/<job_id>/download')
+def download_job(job_id):
+    """Baixa o documento do job concluído (409 enquanto ainda não estiver pronto)"""
+    job = obter_job(job_id)
+    if job is None:
+        return jsonify({'erro': 'Job não encontrado'}), 404
+    if job['estado'] != ESTADO_CONCLUIDO:
+        return jsonify({'erro': job['erro'] or 'Documento ainda não está pronto', 'estado': job['estado']}), 409
+
+    return send_file(
+        caminho_resultado(job_id),
+        mimetype=MIMETYPE_DOCX,
+        as_attachment=True,
+        download_name=f"{job['tipo']}.docx"
+    )
 
-        try:
-            data_inicio_obj = datetime.strptime(data_inicio_iso, '%Y-%m-%d')
-            data_fim_obj = datetime.strptime(data_fim_iso, '%Y-%m-%d')
-        except Exception:
-            return {'erro': 'Formato de data inválido. Use o formato AAAA-MM-DD.'}, 400
 
-        if data_inicio_obj > data_fim_obj:
-            return {'erro': 'A Data Início não pode ser maior que a Data Fim.'}, 400
+@app.route('/lotes', methods=['POST'])
+def enviar_lote_documentos():
+    """
+    Gera vários documentos (modelos 1, 2 e 3) em uma chamada. Recebe o manifesto
+    JSON ('manifesto', campo ou arquivo) e um .zip opcional com as imagens
+    ('imagens'), referenciadas no manifesto pelo nome no .zip ou pelo hash já
+    enviado. Cada documento vira um job da fila (gerados em paralelo pelos
+    workers); retorna 202 com os endereços de acompanhamento e download do .zip.
+    """
+    imagens = None
+    try:
+        manifesto = request.form.get('manifesto')
+        if manifesto is None and 'manifesto' in request.files:
+            manifesto = request.files['manifesto'].read().decode('utf-8-sig')
+        if not manifesto:
+            raise ValueError('Envie o manifesto do lote (campo "manifesto")')
+
+        documentos = ler_manifesto(manifesto)
+        arquivo_imagens = request.files.get('imagens')
+        imagens = ArquivoImagens(arquivo_imagens if arquivo_imagens and arquivo_imagens.filename else None, area_temporaria())
+
+        pedidos = []
+        for numero, (documento, nome) in enumerate(zip(documentos, nomes_arquivos(documentos)), 1):
+            try:
+                tipo, parametros = ler_documento_lote(documento, imagens)
+            except ValueError as e:
+                raise ValueError(f'Documento {numero} do lote ({nome}): {e}')
+            pedidos.append((nome, tipo, parametros))
+
+        lote_id = enviar_lote(pedidos)
+        resposta = jsonify({
+            'id': lote_id,
+            'status_url': f'/lotes/{lote_id}',
+            'download_url': f'/lotes/{lote_id}/download',
+        })
+        resposta.headers['Location'] = f'/lotes/{lote_id}'
+        return resposta, 202
+
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except ValueError as e:
+        return jsonify({'erro': str(e)}), 400
+    except Exception as e:
+        return jsonify({'erro': str(e)}), 500
+    finally:
+        if imagens is not None:
+            imagens.fechar()
+
+
+@app.route('/lotes/<lote_id>')
+def status_lote(lote_id):
+    """Estado do lote e de cada documento (estado, páginas concluídas, imagens processadas)"""
+    lote = obter_lote(lote_id)
+    if lote is None:
+        return jsonify({'erro': 'Lote não encontrado'}), 404
+    if lote['estado'] in (ESTADO_PENDENTE, ESTADO_EXECUTANDO):
+        iniciar_workers()
+    return jsonify(lote)
+
+
+@app.route('/lotes/<lote_id>/download')
+def download_lote(lote_id):
+    """Baixa o .zip com os documentos do lote concluído, transmitido enquanto é montado"""
+    lote = obter_lote(lote_id)
+    if lote is None:
+        return jsonify({'erro': 'Lote não encontrado'}), 404
+    if lote['estado'] != ESTADO_CONCLUIDO:
+        return jsonify({
+            'erro': 'Lote com documentos que falharam' if lote['estado'] == ESTADO_ERRO else 'Lote ainda não está pronto',
+            'estado': lote['estado'],
+        }), 409
+
+    arquivos = [(documento['nome'], caminho_resultado(documento['job_id'])) for documento in lote['documentos']]
+    return Response(
+        gerar_em_blocos(lambda destino: gravar_zip_lote(arquivos, destino)),
+        mimetype='application/zip',
+        headers={'Content-Disposition': f'attachment; filename=lote-{lote_id}.zip'}
+    )
 
-        indices_formulario = []
-        for key in request.form.keys():
-            match = re.fullmatch(r'data_formulario-(\d+)', key)
-            if match:
-                indices_formulario.append(int(match.group(1)))
 
-        if not indices_formulario:
-            return {'erro': 'Pelo menos um formulário deve existir.'}, 400
+@app.route('/preview-documento-pdf-modelo3', methods=['POST'])
+def preview_documento_pdf_modelo3():
+    """Gera o DOCX modelo3 preenchido e retorna como base64 para renderização no browser"""
+    try:
+        # Pré-visualização paginada: apenas os formulários pedidos (veja intervalo_formularios)
+        formato = formato_documento()
+        documento_bytes = gerar_documento_modelo3(*ler_pedido_modelo3(request.form, request.files, carregar_imagem, preview=True, selecionar=intervalo_formularios), perfil_preview(), formato)
+
+        return resposta_preview(documento_bytes, formato)
+    except BlobNaoEncontrado as e:
+        return resposta_imagem_ausente(e)
+    except LayoutNaoSuportado as e:
+        return resposta_layout_nao_suportado(e)
+    except ValueError as e:
+        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 400
+    except Exception as e:
+        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 500
 
-        total_formularios = max(indices_formulario) + 1
-        datas_formulario = []
 
-        for form_index in range(total_formularios):
-            data_formulario_iso = request.form.get(f'data_formulario-{form_index}', '').strip()
+def resposta_preview(documento_bytes, formato='docx'):
+    """
+    Resposta da pré-visualização. Com ?formato=binario (ou Accept com o tipo
+    DOCX) devolve o próprio .docx, comprimido com gzip quando o cliente aceita;
+    caso contrário mantém o JSON com o documento em base64. Documentos em PDF
+    (?formato=pdf) são devolvidos direto, para o visualizador do browser.
+    """
+    if formato == 'pdf':
+        resposta = Response(documento_bytes, mimetype=MIMETYPE_PDF)
+        resposta.headers['Content-Disposition'] = 'inline; filename=preview.pdf'
+        resposta.headers['Cache-Control'] = 'no-store'
+        return resposta
+
+    binario = (
+        request.args.get('formato') == 'binario'
+        or request.accept_mimetypes.best == MIMETYPE_DOCX
+    )
+    if not binario:
+        return jsonify({'docx_b64': base64.b64encode(documento_bytes).decode('utf-8')})
+
+    resposta = Response(documento_bytes, mimetype=MIMETYPE_DOCX)
+    if request.accept_encodings['gzip']:
+        # O .docx já é um zip: só vale enviar em gzip quando reduz de fato (>= 5%)
+        comprimido = gzip.compress(documento_bytes, compresslevel=1)
+        if len(comprimido) <= len(documento_bytes) * 0.95:
+            resposta.set_data(comprimido)
+            resposta.headers['Content-Encoding'] = 'gzip'
+    resposta.headers['Vary'] = 'Accept-Encoding'
+    resposta.headers['Cache-Control'] = 'no-store'
+    return resposta
+
+
+def intervalo_formularios(total):
+    """
+    Formulários pedidos na pré-visualização pelo parâmetro 'intervalo' (query
+    string, campo do formulário ou chave do JSON): um índice ('3') ou uma faixa
+    inclusiva ('2-5'), contando a partir de 0. Sem o parâmetro, todos.
+    """
+    valor = request.args.get('intervalo') or request.form.get('intervalo')
+    if not valor and request.is_json:
+        valor = (request.get_json(silent=True) or {}).get('intervalo')
+    if valor is None or str(valor).strip() == '':
+        return range(total)
+
+    match = re.fullmatch(r'\s*(\d+)\s*(?:-\s*(\d+)\s*)?', str(valor))
+    if not match:
+        raise ValueError(f"Intervalo de formulários inválido: '{valor}'. Use um índice (3) ou uma faixa (2-5).")
+
+    inicio = int(match.group(1))
+    fim = int(match.group(2)) if match.group(2) is not None else inicio
+    if inicio > fim or inicio >= total:
+        raise ValueError(f"Intervalo de formulários fora do limite: '{valor}' (total de {total} formulários).")
+    return range(inicio, min(fim, total - 1) + 1)
+
+
+def perfil_preview():
+    """Pré-visualizações usam miniaturas das imagens; ?qualidade=final pede as imagens do documento final"""
+    return 'final' if request.args.get('qualidade') == 'final' else 'preview'
+
+
+def formato_documento():
+    """'pdf' com ?formato=pdf (ou Accept com o tipo PDF): o documento é renderizado direto em PDF; senão 'docx'"""
+    if request.args.get('formato') == 'pdf' or request.accept_mimetypes.best == MIMETYPE_PDF:
+        return 'pdf'
+    return 'docx'
+
+
+def documento_modelo1(formularios, perfil='final', formato='docx'):
+    """Chave de cache e função gerar(destino=None) do documento do modelo 1 (gerar_documento para 1 formulário, gerar_documento_multiplo para vários)"""
+    def gerar(destino=None):
+        if formato == 'pdf':
+            return gerar_pdf_modelo1(formularios, destino=destino, perfil=perfil)
+        if len(formularios) == 1:
+            form = formularios[0]
+            return gerar_documento(form['unidade'], form['data'], form['legenda'], form['imagens'], destino=destino, perfil=perfil)
+        return gerar_documento_multiplo(formularios, destino=destino, perfil=perfil)
 
-            if not data_formulario_iso:
-                datas_formulario.append('')
-                continue
+    return chave_documento('modelo.docx', formato, perfil, formularios), gerar
 
-            try:
-                data_formulario_obj = datetime.strptime(data_formulario_iso, '%Y-%m-%d')
-            except Exception:
-                return {'erro': f'Formato da Data do Formulário {form_index + 1} inválido. Use AAAA-MM-DD.'}, 400
-
-            if data_formulario_obj < data_inicio_obj or data_formulario_obj > data_fim_obj:
-                return {'erro': f'A data do Formulário {form_index + 1} deve estar entre Data Início e Data Fim.'}, 400
-
-            datas_formulario.append(data_formulario_obj.strftime('%d/%m/%Y'))
-
-        data_inicio = data_inicio_obj.strftime('%d/%m/%Y')
-        data_fim = data_fim_obj.strftime('%d/%m/%Y')
-
-        imagens_formularios = []
-        for index in range(len(datas_formulario)):
-            imagem_lanche = request.files.get(f'imagem_lanche-{index}')
-            imagem_ceia = request.files.get(f'imagem_ceia-{index}')
-
-            imagem_lanche_bytes = None
-            imagem_ceia_bytes = None
-
-            if imagem_lanche and imagem_lanche.filename:
-                imagem_lanche_bytes = imagem_lanche.read()
-
-            if imagem_ceia and imagem_ceia.filename:
-                imagem_ceia_bytes = imagem_ceia.read()
-
-            dados_form = {
-                'imagem_lanche': imagem_lanche_bytes,
-                'imagem_ceia': imagem_ceia_bytes,
-                'legenda_lanche': request.form.get(f'legenda_lanche-{index}', '').strip(),
-                'legenda_ceia': request.form.get(f'legenda_ceia-{index}', '').strip()
-            }
-            for n in range(1, 5):
-                f_almoco = request.files.get(f'imagem_almoco_{n}-{index}')
-                dados_form[f'imagem_almoco_{n}'] = f_almoco.read() if f_almoco and f_almoco.filename else None
-                dados_form[f'proteina_almoco_{n}'] = request.form.get(f'proteina_almoco_{n}-{index}', '').strip()
-                dados_form[f'peso_almoco_{n}'] = request.form.get(f'peso_almoco_{n}-{index}', '').strip()
-                if n <= 2:
-                    dados_form[f'acompanhamento_almoco_{n}'] = request.form.get(f'acompanhamento_almoco_{n}-{index}', '').strip()
-                f_jantar = request.files.get(f'imagem_jantar_{n}-{index}')
-                dados_form[f'imagem_jantar_{n}'] = f_jantar.read() if f_jantar and f_jantar.filename else None
-                dados_form[f'proteina_jantar_{n}'] = request.form.get(f'proteina_jantar_{n}-{index}', '').strip()
-                dados_form[f'peso_jantar_{n}'] = request.form.get(f'peso_jantar_{n}-{index}', '').strip()
-                if n <= 2:
-                    dados_form[f'acompanhamento_jantar_{n}'] = request.form.get(f'acompanhamento_jantar_{n}-{index}', '').strip()
-            imagens_formularios.append(dados_form)
-
-        documento_bytes = gerar_documento_modelo2_empresa(
-            empresa,
-            data_inicio,
-            data_fim,
-            datas_formulario,
-            imagens_formularios
-        )
 
-        return send_file(
-            io.BytesIO(documento_bytes),
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name='modelo2.docx'
-        )
+def documento_modelo2(empresa, data_inicio, data_fim, datas_formulario, imagens_formularios, perfil='final', formato='docx'):
+    """Chave de cache e função gerar(destino=None) do documento do modelo 2"""
+    chave = chave_documento('modelo2.docx', formato, perfil, empresa, data_inicio, data_fim, datas_formulario, imagens_formularios)
+    gerador = gerar_pdf_modelo2_empresa if formato == 'pdf' else gerar_documento_modelo2_empresa
+    return chave, lambda destino=None: gerador(
+        empresa, data_inicio, data_fim, datas_formulario, imagens_formularios, destino=destino, perfil=perfil
+    )
 
-    except Exception as e:
-        return {'erro': str(e)}, 500
 
+def documento_modelo3(datas_formulario, unidades_formulario, imagens_formularios, perfil='final', formato='docx'):
+    """Chave de cache e função gerar(destino=None) do documento do modelo 3"""
+    chave = chave_documento('modelo3.docx', formato, perfil, datas_formulario, unidades_formulario, imagens_formularios)
+    gerador = gerar_pdf_modelo3_alipen if formato == 'pdf' else gerar_documento_modelo3_alipen
+    return chave, lambda destino=None: gerador(
+        datas_formulario, unidades_formulario, imagens_formularios, destino=destino, perfil=perfil
+    )
 
-@app.route('/gerar-documento3', methods=['POST'])
-def gerar_doc_modelo3():
-    """Rota para gerar modelo3 (ALIPEN) com 4 campos: café, lanche, almoço, jantar"""
-    try:
-        from datetime import datetime
 
-        indices_formulario = []
-        for key in request.form.keys():
-            match = re.fullmatch(r'data_formulario-(\d+)', key)
-            if match:
-                indices_formulario.append(int(match.group(1)))
+def gerar_documento_modelo1(formularios, perfil='final', formato='docx'):
+    """Gera (ou busca no cache) o documento do modelo 1"""
+    return cache_documentos.obter_ou_gerar(*documento_modelo1(formularios, perfil, formato))
 
-        if not indices_formulario:
-            return {'erro': 'Pelo menos um formulário deve existir.'}, 400
 
-        total_formularios = max(indices_formulario) + 1
-        datas_formulario = []
-        unidades_formulario = []
+def gerar_documento_modelo2(empresa, data_inicio, data_fim, datas_formulario, imagens_formularios, perfil='final', formato='docx'):
+    """Gera (ou busca no cache) o documento do modelo 2"""
+    return cache_documentos.obter_ou_gerar(*documento_modelo2(
+        empresa, data_inicio, data_fim, datas_formulario, imagens_formularios, perfil, formato
+    ))
 
-        for form_index in range(total_formularios):
-            data_formulario_iso = request.form.get(f'data_formulario-{form_index}', '').strip()
-            unidade_formulario = request.form.get(f'unidade_formulario-{form_index}', '').strip()
 
-            if not data_formulario_iso:
-                datas_formulario.append('')
-                unidades_formulario.append(unidade_formulario)
-                continue
+def gerar_documento_modelo3(datas_formulario, unidades_formulario, imagens_formularios, perfil='final', formato='docx'):
+    """Gera (ou busca no cache) o documento do modelo 3"""
+    return cache_documentos.obter_ou_gerar(*documento_modelo3(
+        datas_formulario, unidades_formulario, imagens_formularios, perfil, formato
+    ))
 
-            try:
-                data_formulario_obj = datetime.strptime(data_formulario_iso, '%Y-%m-%d')
-            except Exception:
-                return {'erro': f'Formato da Data do Formulário {form_index + 1} inválido. Use AAAA-MM-DD.'}, 400
-
-            datas_formulario.append(data_formulario_obj.strftime('%d/%m/%Y'))
-            unidades_formulario.append(unidade_formulario)
-
-        imagens_formularios = []
-        for index in range(len(datas_formulario)):
-            imagem_cafe = request.files.get(f'imagem_cafe-{index}')
-            imagem_lanche = request.files.get(f'imagem_lanche-{index}')
-            imagem_almoco = request.files.get(f'imagem_almoco-{index}')
-            imagem_jantar = request.files.get(f'imagem_jantar-{index}')
-
-            dados_form = {
-                'imagem_cafe': imagem_cafe.read() if imagem_cafe and imagem_cafe.filename else None,
-                'legenda_cafe': request.form.get(f'legenda_cafe-{index}', '').strip(),
-                'imagem_lanche': imagem_lanche.read() if imagem_lanche and imagem_lanche.filename else None,
-                'legenda_lanche': request.form.get(f'legenda_lanche-{index}', '').strip(),
-                'imagem_almoco': imagem_almoco.read() if imagem_almoco and imagem_almoco.filename else None,
-                'proteina_almoco': request.form.get(f'proteina_almoco-{index}', '').strip(),
-                'peso_almoco': request.form.get(f'peso_almoco-{index}', '').strip(),
-                'acompanhamento_almoco': request.form.get(f'acompanhamento_almoco-{index}', '').strip(),
-                'imagem_jantar': imagem_jantar.read() if imagem_jantar and imagem_jantar.filename else None,
-                'proteina_jantar': request.form.get(f'proteina_jantar-{index}', '').strip(),
-                'peso_jantar': request.form.get(f'peso_jantar-{index}', '').strip(),
-                'acompanhamento_jantar': request.form.get(f'acompanhamento_jantar-{index}', '').strip()
-            }
-            imagens_formularios.append(dados_form)
-
-        documento_bytes = gerar_documento_modelo3_alipen(
-            datas_formulario,
-            unidades_formulario,
-            imagens_formularios
-        )
 
-        return send_file(
-            io.BytesIO(documento_bytes),
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document',
-            as_attachment=True,
-            download_name='modelo3.docx'
-        )
+def resposta_documento(chave, gerar, nome_arquivo, formato='docx'):
+    """
+    Download do documento: do cache, se já gerado; senão transmitido em blocos enquanto
+    o arquivo é gravado (primeiro byte mais cedo, sem cópia do arquivo inteiro em
+    memória). O documento em si (árvore XML e imagens) ainda é montado em memória
+    antes da gravação. Documentos até LIMITE_COPIA_STREAM_MB também vão para o
+    cache ao final.
+    """
+    cabecalhos = {'Content-Disposition': f'attachment; filename={nome_arquivo}'}
+    mimetype = MIMETYPE_PDF if formato == 'pdf' else MIMETYPE_DOCX
 
-    except Exception as e:
-        return {'erro': str(e)}, 500
+    documento = cache_documentos.obter(chave)
+    if documento is not None:
+        return Response(documento, mimetype=mimetype, headers=cabecalhos)
 
+    blocos = gerar_em_blocos(
+        gerar,
+        guardar=lambda documento: cache_documentos.guardar(chave, documento),
+        limite_copia=LIMITE_COPIA_STREAM_MB * 1024 * 1024
+    )
+    # Erros antes do primeiro bloco ainda viram resposta de erro na rota
+    primeiro = next(blocos)
+    return Response(_blocos_a_partir_do_primeiro(primeiro, blocos), mimetype=mimetype, headers=cabecalhos)
 
-@app.route('/preview-documento-pdf-modelo3', methods=['POST'])
-def preview_documento_pdf_modelo3():
-    """Gera o DOCX modelo3 preenchido e retorna como base64 para renderização no browser"""
+
+def _blocos_a_partir_do_primeiro(primeiro, blocos):
+    """
+    Reenvia o primeiro bloco (ja lido) e os demais. Quando o servidor fecha a
+    resposta (cliente desconectou), o close() chega a gerar_em_blocos e a
+    geracao e interrompida.
+    """
     try:
-        from datetime import datetime
-
-        indices_formulario = []
-        for key in request.form.keys():
-            match = re.fullmatch(r'data_formulario-(\d+)', key)
-            if match:
-                indices_formulario.append(int(match.group(1)))
-
-        if not indices_formulario:
-            indices_formulario = [0]
-
-        total_formularios = max(indices_formulario) + 1
-        datas_formulario = []
-        unidades_formulario = []
-
-        for form_index in range(total_formularios):
-            data_formulario_iso = request.form.get(f'data_formulario-{form_index}', '').strip()
-            unidade_formulario = request.form.get(f'unidade_formulario-{form_index}', '').strip()
-
-            if data_formulario_iso:
-                try:
-                    data_formulario_obj = datetime.strptime(data_formulario_iso, '%Y-%m-%d')
-                    datas_formulario.append(data_formulario_obj.strftime('%d/%m/%Y'))
-                except Exception:
-                    datas_formulario.append('')
-            else:
-                datas_formulario.append('')
-            unidades_formulario.append(unidade_formulario)
-
-        imagens_formularios = []
-        for index in range(len(datas_formulario)):
-            imagem_cafe = request.files.get(f'imagem_cafe-{index}')
-            imagem_lanche = request.files.get(f'imagem_lanche-{index}')
-            imagem_almoco = request.files.get(f'imagem_almoco-{index}')
-            imagem_jantar = request.files.get(f'imagem_jantar-{index}')
-
-            dados_form = {
-                'imagem_cafe': imagem_cafe.read() if imagem_cafe and imagem_cafe.filename else None,
-                'legenda_cafe': request.form.get(f'legenda_cafe-{index}', '').strip(),
-                'imagem_lanche': imagem_lanche.read() if imagem_lanche and imagem_lanche.filename else None,
-                'legenda_lanche': request.form.get(f'legenda_lanche-{index}', '').strip(),
-                'imagem_almoco': imagem_almoco.read() if imagem_almoco and imagem_almoco.filename else None,
-                'proteina_almoco': request.form.get(f'proteina_almoco-{index}', '').strip(),
-                'peso_almoco': request.form.get(f'peso_almoco-{index}', '').strip(),
-                'acompanhamento_almoco': request.form.get(f'acompanhamento_almoco-{index}', '').strip(),
-                'imagem_jantar': imagem_jantar.read() if imagem_jantar and imagem_jantar.filename else None,
-                'proteina_jantar': request.form.get(f'proteina_jantar-{index}', '').strip(),
-                'peso_jantar': request.form.get(f'peso_jantar-{index}', '').strip(),
-                'acompanhamento_jantar': request.form.get(f'acompanhamento_jantar-{index}', '').strip()
-            }
-            imagens_formularios.append(dados_form)
-
-        documento_bytes = gerar_documento_modelo3_alipen(
-            datas_formulario,
-            unidades_formulario,
-            imagens_formularios
-        )
+        yield primeiro
+        yield from blocos
+    finally:
+        blocos.close()
 
-        docx_b64 = base64.b64encode(documento_bytes).decode('utf-8')
-        return jsonify({'docx_b64': docx_b64})
-    except Exception as e:
-        return jsonify({'erro': f'Erro ao gerar pré-visualização: {str(e)}'}), 500
 
+def resposta_job(job_id):
+    """202 com o id do job e os endereços de acompanhamento e download"""
+    resposta = jsonify({
+        'id': job_id,
+        'status_url': f'/jobs/{job_id}',
+        'download_url': f'/jobs/{job_id}/download',
+    })
+    resposta.headers['Location'] = f'/jobs/{job_id}'
+    return resposta, 202
 
-def convertar_data(data_iso):
-    """Converte data de formato ISO (YYYY-MM-DD) para DD.MM.YYYY"""
-    try:
-        from datetime import datetime
-        data_obj = datetime.strptime(data_iso, '%Y-%m-%d')
-        return data_obj.strftime('%d.%m.%Y')
-    except Exception as e:
-        raise Exception(f"Erro ao formatar data: {str(e)}")
+
+def carregar_imagem(arquivo, hash_imagem):
+    """Cria o RegistroImagem de um arquivo enviado ou de uma referência '<campo>_hash' (ingestão dos formulários)"""
+    if arquivo is not None:
+        if not arquivo.filename:
+            return None
+        return registrar_upload(arquivo, area_temporaria())
+    return registro_blob(hash_imagem)
+
+
+def area_temporaria():
+    """Área em disco da requisição para os uploads grandes (removida ao fim da resposta)"""
+    if 'area_temporaria' not in g:
+        g.area_temporaria = AreaTemporaria()
+    return g.area_temporaria
+
+
+@app.after_request
+def transferir_area_temporaria(response):
+    """Respostas transmitidas em blocos ainda leem as imagens: a área só é removida quando a resposta termina"""
+    area = g.pop('area_temporaria', None)
+    if area is not None:
+        response.call_on_close(area.limpar)
+    return response
+
+
+@app.teardown_request
+def limpar_area_temporaria(erro=None):
+    area = g.pop('area_temporaria', None)
+    if area is not None:
+        area.limpar()
+
+
+def resposta_imagem_ausente(erro):
+    """409 com os hashes que o cliente precisa reenviar (imagem expirada ou desconhecida)"""
+    return jsonify({'erro': str(erro), 'imagens_ausentes': [erro.hash]}), 409
+
+
+def resposta_layout_nao_suportado(erro):
+    """501 quando o PDF não reproduz o layout do modelo (o mesmo pedido em DOCX continua funcionando)"""
+    return jsonify({'erro': f'O PDF não reproduz o layout do modelo ({erro}); gere o documento em DOCX.'}), 501
 
 
 if __name__ == '__main__':
+    # Workers da fila desde o inicio (com o reloader do debug, so no processo que atende as requisicoes)
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        iniciar_workers()
     app.run(host='0.0.0.0', port=10000, debug=True)
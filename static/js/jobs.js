@@ -0,0 +1,46 @@
+// Geração em segundo plano: envia o pedido para /jobs/..., acompanha o progresso e baixa o documento pronto.
+// Depende de staging.js (StagingImagens) para enviar as imagens por hash.
+const JobsDocumento = (function() {
+    const intervaloConsulta = 1500;
+
+    function lerJson(response) {
+        return response.json().catch(() => ({})).then(data => {
+            if (!response.ok) {
+                throw new Error(data.erro || 'Erro ao gerar documento');
+            }
+            return data;
+        });
+    }
+
+    function aguardar(job, aoProgresso) {
+        return new Promise(resolve => setTimeout(resolve, intervaloConsulta))
+            .then(() => fetch(job.status_url))
+            .then(lerJson)
+            .then(estado => {
+                if (aoProgresso) {
+                    aoProgresso(estado.progresso || {});
+                }
+                if (estado.estado === 'concluido') {
+                    return fetch(job.download_url).then(response => {
+                        if (!response.ok) {
+                            return lerJson(response);
+                        }
+                        return response.blob();
+                    });
+                }
+                if (estado.estado === 'erro') {
+                    throw new Error(estado.erro || 'Erro ao gerar documento');
+                }
+                return aguardar(job, aoProgresso);
+            });
+    }
+
+    // Retorna uma Promise com o Blob do .docx; aoProgresso recebe {paginas_concluidas, paginas_total, ...}
+    function gerar(url, formData, aoProgresso) {
+        return StagingImagens.postar(url, formData)
+            .then(lerJson)
+            .then(job => aguardar(job, aoProgresso));
+    }
+
+    return { gerar: gerar };
+})();
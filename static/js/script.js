@@ -41,27 +41,25 @@ document.addEventListener('DOMContentLoaded', function() {
                 const formDataPreview = buildFormsFormData();
                 previewBtn.disabled = true;
                 previewBtn.textContent = 'Pré-visualizando...';
-                fetch(previewPdfUrl, {
-                    method: 'POST',
-                    body: formDataPreview
-                })
-                .then(response => response.json())
-                .then(data => {
-                    if (data.docx_b64) {
-                        const bytes = Uint8Array.from(atob(data.docx_b64), c => c.charCodeAt(0));
-                        const blob = new Blob([bytes], { type: 'application/vnd.openxmlformats-officedocument.wordprocessingml.document' });
-                        previewArea.innerHTML = '';
-                        docx.renderAsync(blob, previewArea).catch(() => {
-                            previewArea.innerHTML = '<div class="preview-placeholder">Erro ao renderizar pré-visualização.</div>';
-                        });
-                    } else {
-                        previewArea.innerHTML = `<div class="preview-placeholder">${data.erro || 'Erro ao gerar pré-visualização.'}</div>`;
+                StagingImagens.postar(previewPdfUrl + '?formato=binario', formDataPreview)
+                .then(response => {
+                    // Erros chegam pelo status HTTP com um JSON pequeno ({ erro })
+                    if (!response.ok) {
+                        return response.json().catch(() => ({})).then(data => { throw data; });
                     }
+                    return response.blob();
+                })
+                .then(blob => {
+                    previewArea.innerHTML = '';
+                    docx.renderAsync(blob, previewArea).catch(() => {
+                        previewArea.innerHTML = '<div class="preview-placeholder">Erro ao renderizar pré-visualização.</div>';
+                    });
                     previewBtn.disabled = false;
                     previewBtn.textContent = 'Pré-visualizar';
                 })
                 .catch(error => {
-                    previewArea.innerHTML = '<div class="preview-placeholder">Erro ao gerar pré-visualização PDF.</div>';
+                    const mensagem = (error && error.erro) || 'Erro ao gerar pré-visualização PDF.';
+                    previewArea.innerHTML = `<div class="preview-placeholder">${mensagem}</div>`;
                     previewBtn.disabled = false;
                     previewBtn.textContent = 'Pré-visualizar';
                 });
@@ -408,10 +406,7 @@ document.addEventListener('DOMContentLoaded', function() {
             submitBtn.textContent = 'Gerando...';
             
             // Envia um único request com todos os formulários
-            fetch(submitUrl, {
-                method: 'POST',
-                body: formDataGeral
-            })
+            StagingImagens.postar(submitUrl, formDataGeral)
             .then(response => {
                 if (response.ok) {
                     return response.blob().then(blob => {
@@ -0,0 +1,124 @@
+// Envio antecipado de imagens: cada arquivo sobe uma única vez para /imagens
+// e as pré-visualizações/gerações seguintes enviam apenas o hash ('<campo>_hash').
+// Arquivos grandes sobem em partes (/uploads), com checksum por parte e retomada do ponto em que pararam.
+const StagingImagens = (function() {
+    const stagingUrl = '/imagens';
+    const uploadsUrl = '/uploads';
+    // Acima deste tamanho o arquivo é enviado em partes
+    const limiteEnvioUnico = 4 * 1024 * 1024;
+    const tentativasPorParte = 5;
+    let hashes = new WeakMap();
+
+    function lerJson(response) {
+        return response.json().catch(() => ({})).then(data => {
+            if (!response.ok) {
+                throw Object.assign(new Error(data.erro || 'Falha ao enviar imagem'), { status: response.status, dados: data });
+            }
+            return data;
+        });
+    }
+
+    function checksum(parte) {
+        // crypto.subtle só existe em contexto seguro (https/localhost); sem ele a parte segue sem checksum
+        if (!window.crypto || !window.crypto.subtle) {
+            return Promise.resolve(null);
+        }
+        return parte.arrayBuffer()
+            .then(buffer => window.crypto.subtle.digest('SHA-256', buffer))
+            .then(digest => Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join(''));
+    }
+
+    function enviarParte(uploadId, arquivo, offset, tamanhoParte) {
+        const parte = arquivo.slice(offset, Math.min(offset + tamanhoParte, arquivo.size));
+        return checksum(parte).then(soma => {
+            const headers = { 'Content-Type': 'application/octet-stream' };
+            if (soma) {
+                headers['X-Checksum-SHA256'] = soma;
+            }
+            return fetch(`${uploadsUrl}/${uploadId}?offset=${offset}`, { method: 'PUT', headers: headers, body: parte });
+        }).then(lerJson).then(data => data.offset);
+    }
+
+    // Em caso de falha, pergunta ao servidor quanto já recebeu e continua dali
+    function enviarPartes(uploadId, arquivo, offset, tamanhoParte, tentativas) {
+        if (offset >= arquivo.size) {
+            return fetch(`${uploadsUrl}/${uploadId}/concluir`, { method: 'POST' })
+                .then(lerJson)
+                .then(data => data.hash);
+        }
+        return enviarParte(uploadId, arquivo, offset, tamanhoParte)
+            .then(novoOffset => enviarPartes(uploadId, arquivo, novoOffset, tamanhoParte, tentativasPorParte))
+            .catch(error => {
+                if (tentativas <= 1 || error.status === 404) {
+                    throw error;
+                }
+                return fetch(`${uploadsUrl}/${uploadId}`)
+                    .then(lerJson)
+                    .then(estado => enviarPartes(uploadId, arquivo, estado.offset, tamanhoParte, tentativas - 1));
+            });
+    }
+
+    function enviarEmPartes(arquivo) {
+        return fetch(uploadsUrl, {
+            method: 'POST',
+            headers: { 'Content-Type': 'application/json' },
+            body: JSON.stringify({ tamanho: arquivo.size })
+        })
+        .then(lerJson)
+        .then(data => enviarPartes(data.id, arquivo, 0, data.tamanho_parte, tentativasPorParte));
+    }
+
+    function enviarUnico(arquivo) {
+        const dados = new FormData();
+        dados.append('imagem', arquivo);
+        return fetch(stagingUrl, { method: 'POST', body: dados })
+            .then(lerJson)
+            .then(data => data.hashes[0]);
+    }
+
+    function enviarArquivo(arquivo) {
+        if (!hashes.has(arquivo)) {
+            const envio = arquivo.size > limiteEnvioUnico ? enviarEmPartes(arquivo) : enviarUnico(arquivo);
+            const promessa = envio
+                .catch(error => {
+                    hashes.delete(arquivo);
+                    throw error;
+                });
+            hashes.set(arquivo, promessa);
+        }
+        return hashes.get(arquivo);
+    }
+
+    // Troca os arquivos do FormData pelos hashes; se o envio falhar, o arquivo segue no request
+    function prepararFormData(formData) {
+        const entradas = Array.from(formData.entries());
+        return Promise.all(entradas.map(([campo, valor]) => {
+            if (valor instanceof File && valor.size > 0) {
+                return enviarArquivo(valor)
+                    .then(hash => [campo + '_hash', hash])
+                    .catch(() => [campo, valor]);
+            }
+            return [campo, valor];
+        })).then(pares => {
+            const preparado = new FormData();
+            pares.forEach(([campo, valor]) => preparado.append(campo, valor));
+            return preparado;
+        });
+    }
+
+    // POST com as imagens por hash; se o servidor não tiver mais alguma (409), reenvia tudo uma vez
+    function postar(url, formData) {
+        return prepararFormData(formData)
+            .then(preparado => fetch(url, { method: 'POST', body: preparado }))
+            .then(response => {
+                if (response.status !== 409) {
+                    return response;
+                }
+                hashes = new WeakMap();
+                return prepararFormData(formData)
+                    .then(preparado => fetch(url, { method: 'POST', body: preparado }));
+            });
+    }
+
+    return { postar: postar };
+})();
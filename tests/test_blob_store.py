@@ -0,0 +1,168 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from functions import blob_store
+from functions.blob_store import (
+    BlobNaoEncontrado,
+    ParteInvalida,
+    concluir_upload,
+    estado_upload,
+    gravar_parte,
+    guardar_blob,
+    iniciar_upload,
+    limpar_blobs,
+    localizar_blob,
+    obter_blob,
+)
+
+
+def _envelhecer(caminho, segundos):
+    antes = time.time() - segundos
+    os.utime(caminho, (antes, antes))
+
+
+class BlobStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        for nome, valor in (
+            ('DIRETORIO_BLOBS', self.pasta),
+            ('DIRETORIO_UPLOADS', os.path.join(self.pasta, 'uploads')),
+        ):
+            patcher = mock.patch.object(blob_store, nome, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.pasta)
+
+    def test_guardar_e_obter(self):
+        hash_blob = guardar_blob(b'imagem')
+        self.assertEqual(hash_blob, hashlib.sha256(b'imagem').hexdigest())
+        self.assertEqual(obter_blob(hash_blob), b'imagem')
+        # Hash em maiusculas ou com espacos tambem e aceito
+        self.assertEqual(obter_blob(f' {hash_blob.upper()} '), b'imagem')
+
+        with self.assertRaises(BlobNaoEncontrado):
+            obter_blob(hashlib.sha256(b'outra').hexdigest())
+        with self.assertRaises(BlobNaoEncontrado):
+            obter_blob('../../etc/passwd')
+
+    def test_conteudo_repetido_guardado_uma_vez(self):
+        hash_blob = guardar_blob(b'imagem')
+        caminho = localizar_blob(hash_blob)
+        _envelhecer(caminho, 3600)
+
+        self.assertEqual(guardar_blob(b'imagem'), hash_blob)
+        # Mesmo arquivo, com o prazo renovado
+        self.assertLess(time.time() - os.stat(caminho).st_mtime, 60)
+        self.assertEqual(os.listdir(os.path.dirname(caminho)), [hash_blob])
+
+    def test_envio_em_partes(self):
+        dados = os.urandom(3000)
+        upload_id = iniciar_upload(len(dados), hashlib.sha256(dados).hexdigest())
+        offset = 0
+        for inicio in range(0, len(dados), 1000):
+            offset = gravar_parte(upload_id, offset, dados[inicio:inicio + 1000])
+        self.assertEqual(offset, len(dados))
+
+        hash_blob = concluir_upload(upload_id)
+        self.assertEqual(obter_blob(hash_blob), dados)
+        self.assertEqual(os.listdir(blob_store.DIRETORIO_UPLOADS), [])
+
+        # Envio de um conteudo ja guardado reaproveita o blob existente
+        repetido = iniciar_upload(len(dados))
+        gravar_parte(repetido, 0, dados)
+        self.assertEqual(concluir_upload(repetido), hash_blob)
+
+    def test_retoma_apos_parte_interrompida(self):
+        dados = os.urandom(3000)
+        upload_id = iniciar_upload(len(dados), hashlib.sha256(dados).hexdigest())
+        gravar_parte(upload_id, 0, dados[:1000])
+
+        # Conexao caiu no meio da segunda parte: so parte dela chegou ao disco
+        with open(os.path.join(blob_store.DIRETORIO_UPLOADS, upload_id + '.parcial'), 'ab') as arquivo:
+            arquivo.write(dados[1000:1400])
+
+        # Reenviar a partir do offset antigo e recusado, informando onde retomar
+        with self.assertRaises(ParteInvalida) as erro:
+            gravar_parte(upload_id, 1000, dados[1000:2000])
+        self.assertEqual(erro.exception.offset, 1400)
+
+        offset = estado_upload(upload_id)['offset']
+        self.assertEqual(offset, 1400)
+        gravar_parte(upload_id, offset, dados[offset:])
+        self.assertEqual(obter_blob(concluir_upload(upload_id)), dados)
+
+    def test_checksum_da_parte_nao_confere(self):
+        upload_id = iniciar_upload(10)
+        with self.assertRaises(ParteInvalida) as erro:
+            gravar_parte(upload_id, 0, b'0123456789', hashlib.sha256(b'outra').hexdigest())
+        self.assertEqual(erro.exception.offset, 0)
+        self.assertEqual(estado_upload(upload_id)['offset'], 0)
+
+        self.assertEqual(gravar_parte(upload_id, 0, b'0123456789', hashlib.sha256(b'0123456789').hexdigest().upper()), 10)
+
+    def test_partes_simultaneas_nao_se_intercalam(self):
+        upload_id = iniciar_upload(8 * 1000)
+        inicio = threading.Barrier(8)
+        aceitas, recusadas = [], []
+
+        def enviar(byte):
+            parte = bytes([byte]) * 1000
+            inicio.wait()
+            try:
+                aceitas.append(gravar_parte(upload_id, 0, parte, hashlib.sha256(parte).hexdigest()))
+            except ParteInvalida as erro:
+                recusadas.append(erro.offset)
+
+        # Conferir o checksum demora: todas as partes chegam a posicao 0 antes da primeira gravacao
+        sha256 = hashlib.sha256
+
+        def sha256_lento(*args):
+            time.sleep(0.02)
+            return sha256(*args)
+
+        threads = [threading.Thread(target=enviar, args=(byte,)) for byte in range(8)]
+        with mock.patch.object(blob_store.hashlib, 'sha256', sha256_lento):
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        # Apenas uma parte na posicao 0; as demais veem o offset ja avancado
+        self.assertEqual(aceitas, [1000])
+        self.assertEqual(recusadas, [1000] * 7)
+        with open(os.path.join(blob_store.DIRETORIO_UPLOADS, upload_id + '.parcial'), 'rb') as arquivo:
+            self.assertEqual(len(set(arquivo.read())), 1)
+
+    def test_expira_pelo_prazo(self):
+        hash_blob = guardar_blob(b'imagem')
+        _envelhecer(localizar_blob(hash_blob), blob_store.TTL_BLOBS + 1)
+
+        limpar_blobs(forcar=True)
+        with self.assertRaises(BlobNaoEncontrado):
+            localizar_blob(hash_blob)
+
+    def test_limite_de_espaco_preserva_imagens_em_uso(self):
+        antiga = guardar_blob(b'a' * 1000)
+        usada = guardar_blob(b'b' * 1000)
+        _envelhecer(localizar_blob(antiga), blob_store.CARENCIA_BLOBS + 20)
+        _envelhecer(os.path.join(self.pasta, usada[:2], usada), blob_store.CARENCIA_BLOBS + 10)
+
+        # Uma requisicao localiza a imagem e vai le-la sob demanda mais tarde
+        caminho = localizar_blob(usada)
+        with mock.patch.object(blob_store, 'LIMITE_BLOBS_MB', 0):
+            limpar_blobs(forcar=True)
+
+        with self.assertRaises(BlobNaoEncontrado):
+            localizar_blob(antiga)
+        with open(caminho, 'rb') as arquivo:
+            self.assertEqual(arquivo.read(), b'b' * 1000)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,79 @@
+import unittest
+from functions.document_cache import CacheDocumentos, chave_documento
+from functions.image_processing import criar_registro_imagem
+
+
+class CacheDocumentosTest(unittest.TestCase):
+
+    def test_acerto_e_falha(self):
+        cache = CacheDocumentos(1024)
+        self.assertIsNone(cache.obter('a'))
+        cache.guardar('a', b'documento')
+        self.assertEqual(cache.obter('a'), b'documento')
+
+        estatisticas = cache.estatisticas()
+        self.assertEqual((estatisticas['acertos'], estatisticas['falhas']), (1, 1))
+        self.assertEqual(estatisticas['bytes'], len(b'documento'))
+
+    def test_obter_ou_gerar_gera_uma_vez(self):
+        cache = CacheDocumentos(1024)
+        chamadas = []
+
+        def gerar():
+            chamadas.append(1)
+            return b'documento'
+
+        self.assertEqual(cache.obter_ou_gerar('a', gerar), b'documento')
+        self.assertEqual(cache.obter_ou_gerar('a', gerar), b'documento')
+        self.assertEqual(len(chamadas), 1)
+
+    def test_descarta_os_menos_usados_pelo_limite_de_bytes(self):
+        cache = CacheDocumentos(100)
+        cache.guardar('a', b'a' * 40)
+        cache.guardar('b', b'b' * 40)
+        cache.obter('a')
+        # 'c' passa do limite: sai 'b', o usado ha mais tempo
+        cache.guardar('c', b'c' * 40)
+
+        self.assertIsNone(cache.obter('b'))
+        self.assertIsNotNone(cache.obter('a'))
+        self.assertIsNotNone(cache.obter('c'))
+        estatisticas = cache.estatisticas()
+        self.assertEqual((estatisticas['itens'], estatisticas['bytes'], estatisticas['descartes']), (2, 80, 1))
+
+    def test_documento_maior_que_o_limite_nao_e_guardado(self):
+        cache = CacheDocumentos(100)
+        cache.guardar('a', b'a' * 40)
+        cache.guardar('grande', b'g' * 101)
+
+        self.assertIsNone(cache.obter('grande'))
+        self.assertIsNotNone(cache.obter('a'))
+
+    def test_substituir_entrada_atualiza_bytes(self):
+        cache = CacheDocumentos(100)
+        cache.guardar('a', b'a' * 40)
+        cache.guardar('a', b'a' * 10)
+        self.assertEqual(cache.estatisticas()['bytes'], 10)
+
+
+class ChaveDocumentoTest(unittest.TestCase):
+
+    def test_imagens_pelo_conteudo(self):
+        formulario = {'unidade': 'Unidade', 'imagens': [criar_registro_imagem(b'imagem')]}
+        mesma = {'imagens': [criar_registro_imagem(b'imagem')], 'unidade': 'Unidade'}
+        outra = {'unidade': 'Unidade', 'imagens': [criar_registro_imagem(b'outra')]}
+
+        self.assertEqual(chave_documento('modelo.docx', [formulario]), chave_documento('modelo.docx', [mesma]))
+        self.assertNotEqual(chave_documento('modelo.docx', [formulario]), chave_documento('modelo.docx', [outra]))
+
+    def test_perfil_faz_parte_da_chave(self):
+        # Pre-visualizacao e download do mesmo formulario tem entradas separadas
+        formulario = {'unidade': 'Unidade'}
+        self.assertNotEqual(
+            chave_documento('modelo.docx', 'docx', 'preview', [formulario]),
+            chave_documento('modelo.docx', 'docx', 'final', [formulario])
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import threading
+import unittest
+import uuid
+import main
+
+
+def _gerador_longo(interrompida):
+    """gerar(destino) que grava bem mais do que a fila de blocos comporta e marca se foi interrompido."""
+    def gerar(destino):
+        try:
+            for _ in range(10000):
+                destino.write(b'0' * 64 * 1024)
+        except BaseException:
+            interrompida.set()
+            raise
+    return gerar
+
+
+class DownloadEmBlocosTest(unittest.TestCase):
+
+    def _resposta(self, interrompida):
+        with main.app.test_request_context():
+            return main.resposta_documento(uuid.uuid4().hex, _gerador_longo(interrompida), 'documento.docx')
+
+    def test_cliente_desconectado_interrompe_a_geracao(self):
+        interrompida = threading.Event()
+        resposta = self._resposta(interrompida)
+        blocos = iter(resposta.response)
+        next(blocos)
+        next(blocos)
+
+        # O servidor fecha a resposta quando o cliente desconecta
+        resposta.close()
+        self.assertTrue(interrompida.wait(5))
+
+    def test_fechar_logo_apos_o_primeiro_bloco(self):
+        interrompida = threading.Event()
+        resposta = self._resposta(interrompida)
+        next(iter(resposta.response))
+
+        resposta.close()
+        self.assertTrue(interrompida.wait(5))
+
+
+if __name__ == '__main__':
+    unittest.main()
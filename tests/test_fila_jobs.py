@@ -0,0 +1,142 @@
+import io
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+import zipfile
+from unittest import mock
+from PIL import Image
+from functions import job_queue
+from functions.job_queue import (
+    ESTADO_CONCLUIDO,
+    ESTADO_ERRO,
+    ESTADO_EXECUTANDO,
+    ESTADO_PENDENTE,
+    caminho_resultado,
+    diretorio_imagens_job,
+    enviar_job,
+    obter_job,
+)
+
+
+def _imagem():
+    saida = io.BytesIO()
+    Image.new('RGB', (320, 240), (30, 60, 90)).save(saida, format='JPEG')
+    return saida.getvalue()
+
+
+def _parametros_modelo3(imagens=None):
+    return {
+        'datas_formulario': ['2025-02-01'],
+        'unidades_formulario': ['Unidade'],
+        'imagens_formularios': [imagens or {}],
+    }
+
+
+def _abandonar(job_id):
+    """Simula o worker que morreu: o ultimo sinal de vida ficou para tras de TEMPO_ABANDONO."""
+    with job_queue._conectar() as conexao:
+        conexao.execute(
+            'UPDATE jobs SET atualizado = ? WHERE id = ?', (time.time() - job_queue.TEMPO_ABANDONO - 1, job_id)
+        )
+
+
+def _tentativas(job_id):
+    with job_queue._conectar() as conexao:
+        return conexao.execute('SELECT tentativas FROM jobs WHERE id = ?', (job_id,)).fetchone()[0]
+
+
+class FilaJobsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        for nome, valor in (('DIRETORIO_JOBS', self.pasta), ('WORKERS_JOBS', 0)):
+            patcher = mock.patch.object(job_queue, nome, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.pasta)
+
+    def test_reserva_o_mais_antigo_uma_vez(self):
+        primeiro = enviar_job('modelo3', _parametros_modelo3())
+        segundo = enviar_job('modelo3', _parametros_modelo3())
+        self.assertEqual(obter_job(primeiro)['estado'], ESTADO_PENDENTE)
+
+        self.assertEqual(job_queue._reservar_job('w1')[0], primeiro)
+        self.assertEqual(job_queue._reservar_job('w2')[0], segundo)
+        self.assertIsNone(job_queue._reservar_job('w3'))
+        self.assertEqual(obter_job(primeiro)['estado'], ESTADO_EXECUTANDO)
+
+    def test_reserva_concorrente(self):
+        jobs = {enviar_job('modelo3', _parametros_modelo3()) for _ in range(3)}
+        reservados = []
+
+        def reservar(numero):
+            job = job_queue._reservar_job(f'w{numero}')
+            if job is not None:
+                reservados.append(job[0])
+
+        threads = [threading.Thread(target=reservar, args=(numero,)) for numero in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(sorted(reservados), sorted(jobs))
+
+    def test_job_abandonado_volta_para_a_fila(self):
+        job_id = enviar_job('modelo3', _parametros_modelo3())
+        job_queue._reservar_job('w1')
+        self.assertIsNone(job_queue._reservar_job('w2'))
+
+        _abandonar(job_id)
+        self.assertEqual(job_queue._reservar_job('w2')[0], job_id)
+        self.assertEqual(_tentativas(job_id), 2)
+
+    def test_sinal_de_vida_impede_abandono(self):
+        job_id = enviar_job('modelo3', _parametros_modelo3())
+        job_queue._reservar_job('w1')
+
+        parar = threading.Event()
+        with mock.patch.object(job_queue, 'INTERVALO_SINAL', 0.02), mock.patch.object(job_queue, 'TEMPO_ABANDONO', 0.3):
+            sinal = threading.Thread(target=job_queue._manter_sinal_de_vida, args=(job_id, 'w1', parar))
+            sinal.start()
+            try:
+                time.sleep(0.5)
+                # Worker vivo: o job continua com ele
+                self.assertIsNone(job_queue._reservar_job('w2'))
+            finally:
+                parar.set()
+                sinal.join()
+
+            # Sem sinal por mais de TEMPO_ABANDONO: outro worker assume
+            time.sleep(0.4)
+            self.assertEqual(job_queue._reservar_job('w2')[0], job_id)
+
+    def test_limite_de_tentativas(self):
+        job_id = enviar_job('modelo3', _parametros_modelo3({'imagem_cafe': _imagem()}))
+        self.assertTrue(os.listdir(diretorio_imagens_job(job_id)))
+
+        for tentativa in range(job_queue.MAX_TENTATIVAS):
+            self.assertEqual(job_queue._reservar_job(f'w{tentativa}')[0], job_id)
+            _abandonar(job_id)
+
+        # Interrompido MAX_TENTATIVAS vezes: vira erro em vez de ser reservado de novo
+        self.assertIsNone(job_queue._reservar_job('w-final'))
+        job = obter_job(job_id)
+        self.assertEqual(job['estado'], ESTADO_ERRO)
+        self.assertIn('interrompido', job['erro'])
+        self.assertFalse(os.path.exists(diretorio_imagens_job(job_id)))
+
+    def test_executa_o_job_reservado(self):
+        job_id = enviar_job('modelo3', _parametros_modelo3({'imagem_cafe': _imagem()}))
+        job_queue._executar_job(*job_queue._reservar_job('w1'), 'w1')
+
+        self.assertEqual(obter_job(job_id)['estado'], ESTADO_CONCLUIDO)
+        self.assertTrue(zipfile.is_zipfile(caminho_resultado(job_id)))
+        self.assertFalse(os.path.exists(diretorio_imagens_job(job_id)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import unittest
+from datetime import datetime
+from werkzeug.datastructures import MultiDict
+from functions.form_ingestion import ESQUEMA_MODELO3, RegistroFormulario
+from functions.form_readers import ler_pedido_modelo2, ler_pedido_modelo3
+import main
+
+
+def _carregar(chamadas):
+    """carregar_imagem que devolve uma descricao da origem e registra cada chamada."""
+    def carregar(arquivo, hash_imagem):
+        chamadas.append((arquivo, hash_imagem))
+        return f'arquivo:{arquivo}' if arquivo is not None else f'hash:{hash_imagem}'
+    return carregar
+
+
+class EsquemaFormularioTest(unittest.TestCase):
+
+    def test_le_os_formularios_do_esquema(self):
+        form = MultiDict([
+            ('data_formulario-0', '2025-02-01'),
+            ('unidade_formulario-0', '  Unidade A '),
+            ('data_formulario-2', '2025-02-03'),
+            ('legenda_cafe-2', 'Cafe'),
+            ('campo_desconhecido-0', 'x'),
+            ('legenda_cafe-9', 'sem data: fora do total'),
+        ])
+        total, formularios = ESQUEMA_MODELO3.ler(form, MultiDict(), _carregar([]))
+
+        self.assertEqual(total, 3)
+        self.assertEqual([formulario.indice for formulario in formularios], [0, 1, 2])
+        self.assertEqual(formularios[0]['unidade_formulario'], 'Unidade A')
+        self.assertEqual(formularios[1]['unidade_formulario'], '')
+        self.assertEqual(formularios[2].data, datetime(2025, 2, 3))
+        self.assertIsNone(formularios[1].data)
+
+        # Mapping somente leitura sobre as chaves do esquema, sem dict por registro
+        registro = formularios[2]
+        self.assertIsInstance(registro, RegistroFormulario)
+        self.assertEqual(set(dict(registro)), set(ESQUEMA_MODELO3.textos + ESQUEMA_MODELO3.imagens))
+        self.assertEqual(registro.get('legenda_cafe'), 'Cafe')
+        self.assertIsNone(registro.get('campo_desconhecido'))
+        with self.assertRaises(KeyError):
+            registro['indice']
+        self.assertFalse(hasattr(registro, '__dict__'))
+
+    def test_imagens_arquivo_antes_do_hash(self):
+        form = MultiDict([
+            ('data_formulario-0', '2025-02-01'),
+            ('imagem_cafe-0_hash', 'h-cafe'),
+            ('imagem_jantar-0_hash', ' h-jantar '),
+            ('data_formulario-1', '2025-02-02'),
+            ('imagem_cafe-1_hash', 'h-outro'),
+        ])
+        files = MultiDict([('imagem_cafe-0', 'cafe.jpg'), ('imagem_cafe-0', 'repetido.jpg'), ('imagem_cafe-1', 'cafe1.jpg')])
+        chamadas = []
+        _, (primeiro, segundo) = ESQUEMA_MODELO3.ler(form, files, _carregar(chamadas))
+
+        self.assertEqual(primeiro.imagem_cafe, 'arquivo:cafe.jpg')
+        self.assertEqual(primeiro.imagem_jantar, 'hash:h-jantar')
+        self.assertIsNone(primeiro.imagem_almoco)
+        self.assertEqual(segundo.imagem_cafe, 'arquivo:cafe1.jpg')
+        # Uma carga por campo: o arquivo repetido e as referencias substituidas nem sao lidos
+        self.assertEqual(len(chamadas), 3)
+
+    def test_selecionar_nao_le_imagens_dos_demais(self):
+        form = MultiDict([(f'data_formulario-{i}', '2025-02-01') for i in range(4)])
+        files = MultiDict([(f'imagem_cafe-{i}', f'{i}.jpg') for i in range(4)])
+        chamadas = []
+        total, formularios = ESQUEMA_MODELO3.ler(form, files, _carregar(chamadas), selecionar=lambda total: range(2, total))
+
+        self.assertEqual(total, 4)
+        self.assertEqual([formulario.indice for formulario in formularios], [2, 3])
+        self.assertEqual(sorted(arquivo for arquivo, _ in chamadas), ['2.jpg', '3.jpg'])
+
+
+class ValidacaoFormulariosTest(unittest.TestCase):
+
+    def _modelo2(self, **campos):
+        form = {'empresa': 'Empresa', 'data_inicio': '2025-02-01', 'data_fim': '2025-02-28', 'data_formulario-0': '2025-02-10'}
+        form.update(campos)
+        form = {chave: valor for chave, valor in form.items() if valor is not None}
+        return ler_pedido_modelo2(MultiDict(form), MultiDict(), _carregar([]))
+
+    def test_erros_do_modelo2(self):
+        casos = [
+            ({'empresa': ''}, 'O campo Empresa deve ser preenchido'),
+            ({'data_fim': ''}, 'Os campos de Período (Data Início e Data Fim) devem ser preenchidos'),
+            ({'data_inicio': '01/02/2025'}, 'Formato de data inválido. Use o formato AAAA-MM-DD.'),
+            ({'data_inicio': '2025-03-01'}, 'A Data Início não pode ser maior que a Data Fim.'),
+            ({'data_formulario-0': None, 'legenda_lanche-0': 'sem data'}, 'Pelo menos um formulário deve existir.'),
+            ({'data_formulario-1': '10/02/2025'}, 'Formato da Data do Formulário 2 inválido. Use AAAA-MM-DD.'),
+            ({'data_formulario-1': '2025-03-10'}, 'A data do Formulário 2 deve estar entre Data Início e Data Fim.'),
+        ]
+        for campos, mensagem in casos:
+            with self.subTest(campos=campos):
+                with self.assertRaises(ValueError) as erro:
+                    self._modelo2(**campos)
+                self.assertEqual(str(erro.exception), mensagem)
+
+        empresa, data_inicio, data_fim, datas, formularios = self._modelo2()
+        self.assertEqual((empresa, data_inicio, data_fim, datas), ('Empresa', '01/02/2025', '28/02/2025', ['10/02/2025']))
+
+    def test_erros_do_modelo3_e_preview(self):
+        form = MultiDict([('data_formulario-0', '2025-02-01'), ('data_formulario-1', 'amanha')])
+        with self.assertRaises(ValueError) as erro:
+            ler_pedido_modelo3(form, MultiDict(), _carregar([]))
+        self.assertEqual(str(erro.exception), 'Formato da Data do Formulário 2 inválido. Use AAAA-MM-DD.')
+
+        # A pre-visualizacao nao valida: a data invalida fica vazia
+        datas, unidades, _ = ler_pedido_modelo3(form, MultiDict(), _carregar([]), preview=True)
+        self.assertEqual(datas, ['01/02/2025', ''])
+
+        with self.assertRaises(ValueError):
+            ler_pedido_modelo3(MultiDict(), MultiDict(), _carregar([]))
+
+    def test_rota_responde_400_com_o_erro(self):
+        resposta = main.app.test_client().post('/gerar-documento3', data={'data_formulario-0': '2025-02-31'})
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(resposta.get_json(), {'erro': 'Formato da Data do Formulário 1 inválido. Use AAAA-MM-DD.'})
+
+
+if __name__ == '__main__':
+    unittest.main()
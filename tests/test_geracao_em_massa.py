@@ -0,0 +1,99 @@
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import zipfile
+from PIL import Image
+
+
+MANIFESTO_CSV = '''documento,modelo,empresa,data_inicio,data_fim,data_formulario,unidade,data,legenda,imagens,imagem_lanche,unidade_formulario,imagem_cafe
+A,1,,,,,Unidade A,2025-02-01,Legenda,a.jpg;b.jpg,,,
+B,2,Empresa,2025-02-01,2025-02-28,2025-02-05,,,,,a.jpg,,
+C,3,,,,2025-02-05,,,,,,Unidade C,b.jpg
+'''
+
+
+def _gravar_imagem(caminho, cor):
+    Image.new('RGB', (640, 480), cor).save(caminho, format='JPEG')
+
+
+class GeracaoEmMassaTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta)
+        self.fotos = os.path.join(self.pasta, 'fotos')
+        self.saida = os.path.join(self.pasta, 'saida')
+        os.makedirs(self.fotos)
+        _gravar_imagem(os.path.join(self.fotos, 'a.jpg'), 'red')
+        _gravar_imagem(os.path.join(self.fotos, 'b.jpg'), 'blue')
+        self.manifesto = os.path.join(self.pasta, 'manifesto.csv')
+        self._gravar_manifesto(MANIFESTO_CSV)
+
+    def _gravar_manifesto(self, texto):
+        with open(self.manifesto, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(texto)
+
+    def _executar(self, *opcoes):
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ambiente = dict(os.environ)
+        ambiente['PYTHONPATH'] = os.pathsep.join(filter(None, [raiz, ambiente.get('PYTHONPATH')]))
+        return subprocess.run(
+            [sys.executable, '-m', 'functions.bulk_generator', self.manifesto,
+             '--fotos', self.fotos, '--saida', self.saida, '--processos', '2', *opcoes],
+            cwd=raiz, env=ambiente, capture_output=True, text=True, timeout=120
+        )
+
+    def _gerados(self, resultado):
+        """Nomes dos documentos gerados nesta execucao (linhas de progresso '[n/total] nome (...)')."""
+        return sorted(linha.split('] ', 1)[1].split(' (', 1)[0] for linha in resultado.stdout.splitlines() if linha.startswith('['))
+
+    def _midias(self, nome):
+        with zipfile.ZipFile(os.path.join(self.saida, nome)) as pacote:
+            return sorted(pacote.read(item) for item in pacote.namelist() if item.startswith('word/media/'))
+
+    def test_gera_e_retoma(self):
+        resultado = self._executar()
+        self.assertEqual(resultado.returncode, 0, resultado.stderr)
+        self.assertEqual(self._gerados(resultado), ['A.docx', 'B.docx', 'C.docx'])
+        for nome in ('A.docx', 'B.docx', 'C.docx'):
+            self.assertTrue(zipfile.is_zipfile(os.path.join(self.saida, nome)), nome)
+        with open(os.path.join(self.saida, '.checkpoint.jsonl'), encoding='utf-8') as checkpoint:
+            self.assertEqual(sorted(json.loads(linha)['nome'] for linha in checkpoint), ['A.docx', 'B.docx', 'C.docx'])
+
+        # Nada mudou: tudo ja esta no checkpoint
+        resultado = self._executar('--retomar')
+        self.assertEqual(resultado.returncode, 0, resultado.stderr)
+        self.assertIn('0 documento(s) para gerar, 3 ja gerado(s) no checkpoint', resultado.stdout)
+
+        # Foto alterada com o mesmo nome: os documentos que a usam sao gerados de novo
+        antes = self._midias('C.docx')
+        _gravar_imagem(os.path.join(self.fotos, 'b.jpg'), 'green')
+        resultado = self._executar('--retomar')
+        self.assertEqual(self._gerados(resultado), ['A.docx', 'C.docx'])
+        self.assertNotEqual(self._midias('C.docx'), antes)
+
+        # Campo alterado no manifesto e documento apagado da saida
+        self._gravar_manifesto(MANIFESTO_CSV.replace('Unidade C', 'Unidade C2'))
+        os.unlink(os.path.join(self.saida, 'B.docx'))
+        resultado = self._executar('--retomar')
+        self.assertEqual(self._gerados(resultado), ['B.docx', 'C.docx'])
+
+        # Sem --retomar tudo e gerado de novo
+        self.assertEqual(self._gerados(self._executar()), ['A.docx', 'B.docx', 'C.docx'])
+
+    def test_documento_com_erro(self):
+        self._gravar_manifesto(MANIFESTO_CSV + 'D,1,,,,,Unidade D,2025-02-01,Legenda,nada.jpg,,,\n')
+        resultado = self._executar()
+
+        self.assertEqual(resultado.returncode, 1)
+        self.assertIn('Documento 4 (D.docx): ERRO', resultado.stdout)
+        self.assertEqual(self._gerados(resultado), ['A.docx', 'B.docx', 'C.docx'])
+        self.assertFalse(os.path.exists(os.path.join(self.saida, 'D.docx')))
+
+
+if __name__ == '__main__':
+    unittest.main()
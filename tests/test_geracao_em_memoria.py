@@ -0,0 +1,71 @@
+import io
+import sys
+import unittest
+from PIL import Image
+from functions.document_generator import gerar_documento, gerar_documento_multiplo
+from functions.document_generator2 import gerar_documento_modelo2_empresa
+from functions.document_generator3 import gerar_documento_modelo3_alipen
+
+
+# Eventos de auditoria que indicam acesso a arquivos (leitura, gravacao ou remocao)
+EVENTOS_ARQUIVO = {
+    'open', 'os.remove', 'os.rename', 'os.replace', 'os.mkdir', 'os.rmdir',
+    'shutil.copyfile', 'shutil.move', 'shutil.rmtree', 'tempfile.mkstemp', 'tempfile.mkdtemp',
+}
+
+# Hooks de auditoria nao podem ser removidos: um unico hook grava em _eventos quando ativo
+_eventos = None
+
+
+def _auditar(evento, argumentos):
+    if _eventos is not None and evento in EVENTOS_ARQUIVO:
+        _eventos.append((evento, argumentos[:1]))
+
+
+sys.addaudithook(_auditar)
+
+
+def _imagem(cor, tamanho=(640, 480)):
+    saida = io.BytesIO()
+    Image.new('RGB', tamanho, cor).save(saida, format='JPEG')
+    return saida.getvalue()
+
+
+def _gerar_todos(cor):
+    """Gera os quatro documentos com imagens novas (cor) e destino em memoria."""
+    imagem = _imagem(cor)
+    retrato = _imagem(cor, (480, 640))
+    formulario = {'unidade': 'Unidade', 'data': '01.02.2025', 'legenda': 'Legenda', 'imagens': [imagem, retrato, imagem]}
+
+    gerar_documento('Unidade', '01.02.2025', 'Legenda', [imagem, retrato])
+    gerar_documento_multiplo([formulario, formulario], destino=io.BytesIO())
+    gerar_documento_modelo2_empresa(
+        'Empresa', '01/01/2025', '31/01/2025', ['01/01/2025', '02/01/2025'],
+        [{'imagem_lanche': imagem, 'imagem_almoco_1': retrato, 'legenda_lanche': 'Lanche'}, {}]
+    )
+    gerar_documento_modelo3_alipen(
+        ['01/01/2025', '02/01/2025'], ['UPR A', 'UPR B'],
+        [{'imagem_cafe': retrato, 'imagem_jantar': imagem, 'proteina_almoco': 'Frango'}, {}],
+        destino=io.BytesIO()
+    )
+
+
+class GeracaoEmMemoriaTest(unittest.TestCase):
+
+    def test_geracao_nao_acessa_arquivos(self):
+        global _eventos
+        # Primeira geracao carrega os modelos (cache por processo) e os imports tardios
+        _gerar_todos((200, 30, 30))
+
+        _eventos = []
+        try:
+            _gerar_todos((30, 30, 200))
+            eventos = _eventos
+        finally:
+            _eventos = None
+
+        self.assertEqual(eventos, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,204 @@
+import io
+import os
+import subprocess
+import sys
+import unittest
+import zipfile
+from collections import Counter
+from unittest import mock
+from lxml import etree
+from PIL import Image
+from functions import placeholder_engine, process_pool
+from functions.document_generator import _gerar_paginas, _gerar_paginas_em_paralelo, mesclar_documentos
+from functions.document_generator2 import gerar_documento_modelo2_empresa
+from functions.document_generator3 import gerar_documento_modelo3_alipen
+
+
+# Modelo 1 com 32 formularios e 4 processos: cada parte (8 paginas) teria secoes suficientes
+# para dividir de novo dentro do processo do pool
+_SCRIPT_PARTES_ANINHADAS = '''
+import io
+from PIL import Image
+from functions.document_generator import gerar_documento_multiplo
+
+saida = io.BytesIO()
+Image.new('RGB', (320, 240), (30, 60, 90)).save(saida, format='JPEG')
+formularios = [
+    {'unidade': f'Unidade {i}', 'data': '01.02.2025', 'legenda': 'Legenda', 'imagens': [saida.getvalue()]}
+    for i in range(32)
+]
+print(len(gerar_documento_multiplo(formularios)))
+'''
+
+NS_RELS = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+NS_R = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+TIPO_IMAGEM = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/image'
+TIPO_LINK = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/hyperlink'
+
+
+def _imagem(cor, tamanho=(640, 480)):
+    saida = io.BytesIO()
+    Image.new('RGB', tamanho, cor).save(saida, format='JPEG')
+    return saida.getvalue()
+
+
+def _formularios(quantidade):
+    """Formularios do modelo 1 com 1 a 3 imagens, algumas repetidas entre paginas."""
+    imagens = [_imagem((i * 20, 100, 200 - i * 10)) for i in range(10)]
+    return [
+        {
+            'unidade': f'Unidade {i}',
+            'data': '01.02.2025',
+            'legenda': f'Legenda {i}',
+            'imagens': [imagens[i % 10], imagens[(i * 3) % 10], imagens[(i * 7) % 10]][:i % 3 + 1],
+        }
+        for i in range(quantidade)
+    ]
+
+
+def _formularios_modelo2(quantidade):
+    imagens = [_imagem((200, i * 20, 100), (640, 480) if i % 2 else (480, 640)) for i in range(6)]
+    return [
+        {
+            'legenda_lanche': f'Lanche {i}',
+            'proteina_almoco_2': f'Proteina {i}',
+            'acompanhamento_jantar_1': 'Arroz',
+            'imagem_lanche': imagens[i % 6],
+            'imagem_jantar_3': imagens[(i * 5) % 6],
+        }
+        for i in range(quantidade)
+    ]
+
+
+def _formularios_modelo3(quantidade):
+    imagens = [_imagem((i * 30, 200, 100), (640, 480) if i % 2 else (480, 640)) for i in range(6)]
+    return [
+        {
+            'legenda_cafe': f'Cafe {i}',
+            'peso_jantar': '1 kg',
+            'imagem_cafe': imagens[i % 6],
+            'imagem_jantar': imagens[(i * 5) % 6],
+        }
+        for i in range(quantidade)
+    ]
+
+
+def _membros(documento):
+    with zipfile.ZipFile(io.BytesIO(documento)) as pacote:
+        return {nome: pacote.read(nome) for nome in pacote.namelist()}
+
+
+class MesclagemTest(unittest.TestCase):
+
+    def test_paralelo_identico_ao_serial(self):
+        formularios = _formularios(12)
+        serial = _membros(_gerar_paginas(formularios, 'modelo.docx'))
+        paralelo = _membros(_gerar_paginas_em_paralelo(formularios, 'modelo.docx', 'final', 3))
+
+        self.assertEqual(list(serial), list(paralelo))
+        for nome in serial:
+            self.assertEqual(serial[nome], paralelo[nome], nome)
+
+    def test_passada_unica_identica_a_mesclagem_de_paginas(self):
+        # Caminho anterior: cada pagina gerada em um pacote proprio e depois mesclada
+        formularios = _formularios(7)
+        passada_unica = _membros(_gerar_paginas(formularios, 'modelo.docx'))
+        mesclado = _membros(mesclar_documentos([_gerar_paginas([formulario], 'modelo.docx') for formulario in formularios]))
+
+        self.assertEqual(list(passada_unica), list(mesclado))
+        for nome in passada_unica:
+            self.assertEqual(passada_unica[nome], mesclado[nome], nome)
+
+    def test_ids_de_relacao_nao_colidem(self):
+        formularios = _formularios(6)
+        # Base com muitas relacoes (rId1..rId1100), como um modelo grande ou um documento ja mesclado
+        base = _com_relacoes_extras(_gerar_paginas(formularios[:3], 'modelo.docx'), 1100)
+        membros = _membros(mesclar_documentos([base, _gerar_paginas(formularios[3:], 'modelo.docx')]))
+
+        relacoes = etree.fromstring(membros['word/_rels/document.xml.rels'])
+        ids = Counter(rel.get('Id') for rel in relacoes.iter(f'{NS_RELS}Relationship'))
+        self.assertEqual([rel_id for rel_id, total in ids.items() if total > 1], [])
+
+        documento = etree.fromstring(membros['word/document.xml'])
+        alvos = {rel.get('Id'): rel.get('Type') for rel in relacoes.iter(f'{NS_RELS}Relationship')}
+        referencias = {elem.get(f'{NS_R}embed') for elem in documento.iter() if elem.get(f'{NS_R}embed')}
+        self.assertTrue(referencias)
+        self.assertTrue(all(alvos.get(rel_id) == TIPO_IMAGEM for rel_id in referencias))
+
+
+    def test_imagem_ausente_do_pacote(self):
+        formularios = _formularios(2)
+        incompleto = _membros(_gerar_paginas(formularios[1:], 'modelo.docx'))
+        for nome in [nome for nome in incompleto if nome.startswith('word/media/')]:
+            del incompleto[nome]
+
+        # A relacao apontaria para uma parte inexistente: falha em vez de gerar um DOCX corrompido
+        with self.assertRaises(ValueError):
+            mesclar_documentos([_gerar_paginas(formularios[:1], 'modelo.docx'), _pacote(incompleto)])
+
+
+    def test_partes_nao_dividem_de_novo_no_pool(self):
+        # Com pools aninhados o documento era gerado, mas o interpretador nao encerrava
+        ambiente = dict(os.environ, DOCUMENTO_PROCESSOS='4')
+        raiz = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+        ambiente['PYTHONPATH'] = os.pathsep.join(filter(None, [raiz, ambiente.get('PYTHONPATH')]))
+        resultado = subprocess.run(
+            [sys.executable, '-c', _SCRIPT_PARTES_ANINHADAS],
+            cwd=raiz, env=ambiente, capture_output=True, text=True, timeout=60
+        )
+        self.assertEqual(resultado.returncode, 0, resultado.stderr)
+        self.assertGreater(int(resultado.stdout), 0)
+        self.assertNotIn('leaked', resultado.stderr)
+
+
+class SecoesParalelasTest(unittest.TestCase):
+    """Modelos 2 e 3: secoes preenchidas no pool (DOCUMENTO_PROCESSOS > 1) geram o mesmo .docx que em serie."""
+
+    def _comparar(self, gerar):
+        with mock.patch.object(process_pool, 'PROCESSOS_DOCUMENTO', 1):
+            serial = _membros(gerar())
+        with mock.patch.object(process_pool, 'PROCESSOS_DOCUMENTO', 3), \
+                mock.patch.object(placeholder_engine, '_preencher_secoes_em_paralelo',
+                                  wraps=placeholder_engine._preencher_secoes_em_paralelo) as em_paralelo:
+            paralelo = _membros(gerar())
+        self.assertTrue(em_paralelo.called)
+
+        self.assertEqual(list(serial), list(paralelo))
+        for nome in serial:
+            self.assertEqual(serial[nome], paralelo[nome], nome)
+
+    def test_modelo2(self):
+        datas = [f'{dia:02d}/02/2025' for dia in range(1, 11)]
+        self._comparar(lambda: gerar_documento_modelo2_empresa(
+            'Empresa', '01/02/2025', '28/02/2025', datas, _formularios_modelo2(len(datas))
+        ))
+
+    def test_modelo3(self):
+        datas = [f'{dia:02d}/02/2025' for dia in range(1, 11)]
+        self._comparar(lambda: gerar_documento_modelo3_alipen(
+            datas, [f'Unidade {i}' for i in range(len(datas))], _formularios_modelo3(len(datas))
+        ))
+
+
+def _com_relacoes_extras(documento, ate):
+    """Documento com relacoes (links externos) ocupando os rIdN livres ate rId{ate}."""
+    membros = _membros(documento)
+    relacoes = etree.fromstring(membros['word/_rels/document.xml.rels'])
+    usados = {rel.get('Id') for rel in relacoes}
+    for numero in range(1, ate + 1):
+        if f'rId{numero}' not in usados:
+            etree.SubElement(relacoes, f'{NS_RELS}Relationship', Id=f'rId{numero}', Type=TIPO_LINK, Target='https://example.com', TargetMode='External')
+    membros['word/_rels/document.xml.rels'] = etree.tostring(relacoes, xml_declaration=True, encoding='UTF-8', standalone=True)
+    return _pacote(membros)
+
+
+def _pacote(membros):
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, 'w', zipfile.ZIP_DEFLATED) as pacote:
+        for nome, conteudo in membros.items():
+            pacote.writestr(nome, conteudo)
+    return saida.getvalue()
+
+
+if __name__ == '__main__':
+    unittest.main()
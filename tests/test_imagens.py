@@ -0,0 +1,106 @@
+import io
+import unittest
+from unittest import mock
+from docx.shared import Inches
+from PIL import Image
+from functions.document_generator import _linhas_grade_imagens
+from functions.image_processing import criar_registro_imagem, preparar_imagem
+
+
+def _cm(valor):
+    """Centimetros em EMU como calculado na grade do modelo 1 (a partir de polegadas)."""
+    return Inches(valor / 2.54)
+
+
+def _jpeg(tamanho, orientacao=1, qualidade=90):
+    """JPEG com ruido (nao comprime a quase nada) e, opcionalmente, a tag EXIF Orientation."""
+    img = Image.effect_noise(tamanho, 64).convert('RGB')
+    exif = Image.Exif()
+    if orientacao != 1:
+        exif[0x0112] = orientacao
+    saida = io.BytesIO()
+    img.save(saida, format='JPEG', quality=qualidade, exif=exif)
+    return saida.getvalue()
+
+
+class PrepararImagemTest(unittest.TestCase):
+
+    def test_reduz_para_a_caixa(self):
+        registro = criar_registro_imagem(_jpeg((2000, 1500)))
+        # Caixa de 5,08 x 2,54 cm a 150 dpi: 300 x 150 px; a escala cobre a caixa (300 x 225)
+        reduzida = preparar_imagem(registro, (5.08, 2.54))
+
+        self.assertEqual(reduzida.formato, 'JPEG')
+        self.assertEqual(reduzida.tamanho, (300, 225))
+        self.assertEqual(reduzida.tamanho_original, (2000, 1500))
+        with Image.open(io.BytesIO(reduzida.dados)) as img:
+            self.assertEqual(img.size, (300, 225))
+
+    def test_aplica_rotacao_exif(self):
+        # Armazenada 400 x 300 com rotacao de 90 graus: exibida 300 x 400
+        registro = criar_registro_imagem(_jpeg((400, 300), orientacao=6))
+        self.assertEqual(registro.tamanho, (300, 400))
+
+        # Mesmo sem reducao (caixa grande), a rotacao e aplicada nos pixels
+        girada = preparar_imagem(registro, (50, 50))
+        self.assertIsNot(girada, registro)
+        self.assertEqual(girada.orientacao, 1)
+        self.assertEqual(girada.tamanho, (300, 400))
+        with Image.open(io.BytesIO(girada.dados)) as img:
+            self.assertEqual(img.size, (300, 400))
+            self.assertEqual(img.getexif().get(0x0112, 1), 1)
+
+    def test_mantem_original_menor(self):
+        # Imagem ja menor que a caixa: segue como veio
+        pequena = criar_registro_imagem(_jpeg((200, 150)))
+        self.assertIs(preparar_imagem(pequena, (10, 10)), pequena)
+
+        # Reducao que resultaria em mais bytes que o original: tambem segue como veio
+        comprimida = criar_registro_imagem(_jpeg((1000, 750), qualidade=5))
+        self.assertIs(preparar_imagem(comprimida, (15, 11)), comprimida)
+
+    def test_imagem_ilegivel_mantem_proporcao_armazenada(self):
+        # Cabecalho legivel, dados truncados: o Pillow nao decodifica e a rotacao nao e aplicada
+        dados = _jpeg((400, 300), orientacao=6)
+        registro = criar_registro_imagem(dados[:len(dados) // 3])
+        self.assertEqual(registro.tamanho, (300, 400))
+
+        preparada = preparar_imagem(registro, (2, 2))
+        self.assertEqual(preparada.dados, registro.dados)
+        self.assertEqual(preparada.tamanho, (400, 300))
+        self.assertEqual(preparada.tamanho_original, (400, 300))
+
+    def test_arquivo_que_nao_e_imagem(self):
+        registro = criar_registro_imagem(b'nao e uma imagem')
+        self.assertIsNone(registro.formato)
+        self.assertEqual(registro.tamanho, (0, 0))
+        self.assertIs(preparar_imagem(registro, (5, 5)), registro)
+
+
+class LayoutModelo1Test(unittest.TestCase):
+
+    def test_tamanho_do_cabecalho_usado_no_layout(self):
+        registro = criar_registro_imagem(_jpeg((800, 400)))
+        self.assertEqual(registro.tamanho, (800, 400))
+
+        # O layout usa o tamanho lido na chegada, sem abrir a imagem de novo
+        with mock.patch.object(Image, 'open', side_effect=AssertionError('imagem reaberta')):
+            (imagem, largura, altura), = _linhas_grade_imagens([registro])[0]
+        self.assertIs(imagem, registro)
+        # Caixa de 9,6 x 7,5 cm: a imagem 2:1 ocupa a largura toda
+        self.assertEqual((largura, altura), (_cm(9.6), _cm(4.8)))
+
+    def test_tamanho_desconhecido_usa_a_caixa(self):
+        desconhecida = criar_registro_imagem(b'nao e uma imagem')
+        self.assertEqual(desconhecida.tamanho, (0, 0))
+
+        (_, largura, altura), = _linhas_grade_imagens([desconhecida])[0]
+        self.assertEqual((largura, altura), (_cm(9.6), _cm(7.5)))
+
+        linhas = _linhas_grade_imagens([desconhecida] * 3)
+        self.assertEqual([len(linha) for linha in linhas], [2, 1])
+        self.assertEqual({(largura, altura) for linha in linhas for _, largura, altura in linha}, {(_cm(6.8), _cm(7.5))})
+
+
+if __name__ == '__main__':
+    unittest.main()
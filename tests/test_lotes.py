@@ -0,0 +1,162 @@
+import io
+import json
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+from docx import Document
+from PIL import Image
+from functions import job_queue
+from functions.document_batch import ArquivoImagens, campos_documento, ler_manifesto, nomes_arquivos
+from functions.upload_spool import AreaTemporaria
+import main
+
+
+def _imagem(cor, tamanho=(640, 480)):
+    saida = io.BytesIO()
+    Image.new('RGB', tamanho, cor).save(saida, format='JPEG')
+    return saida.getvalue()
+
+
+def _zip_imagens():
+    saida = io.BytesIO()
+    with zipfile.ZipFile(saida, 'w') as pacote:
+        pacote.writestr('fotos/a.jpg', _imagem('red'))
+        pacote.writestr('b.jpg', _imagem('blue', (480, 640)))
+    return saida.getvalue()
+
+
+MANIFESTO = {'documentos': [
+    {'modelo': 1, 'nome': 'Unidade A', 'formularios': [
+        {'unidade': 'A', 'data': '2025-02-01', 'legenda': 'x', 'imagens': ['fotos/a.jpg', 'b.jpg']},
+        {'unidade': 'A', 'data': '2025-02-02', 'legenda': 'y', 'imagens': ['b.jpg']},
+    ]},
+    {'modelo': 2, 'nome': 'Empresa/X', 'empresa': 'Empresa X', 'data_inicio': '2025-02-01', 'data_fim': '2025-02-28', 'formularios': [
+        {'data_formulario': '2025-02-03', 'imagem_lanche': 'fotos/a.jpg', 'legenda_lanche': 'Pao', 'peso_almoco_1': 200},
+    ]},
+    {'modelo': '3', 'nome': 'Unidade A', 'formularios': [
+        {'data_formulario': '2025-02-05', 'unidade_formulario': 'U1', 'imagem_cafe': 'b.jpg'},
+        {'data_formulario': '', 'unidade_formulario': 'U2', 'imagem_jantar': './fotos/a.jpg'},
+    ]},
+]}
+
+
+class ManifestoTest(unittest.TestCase):
+
+    def test_estrutura_invalida(self):
+        casos = [
+            ('{', 'Manifesto do lote não é um JSON válido'),
+            ('{"documentos": []}', 'O manifesto deve ter a lista "documentos" com ao menos um documento'),
+            ('{"documentos": [{"modelo": 4, "formularios": []}]}', 'Documento 1 do lote: "modelo" deve ser 1, 2 ou 3'),
+            ('{"documentos": [{"modelo": 1, "formularios": {}}]}', 'Documento 1 do lote: "formularios" deve ser uma lista de objetos'),
+        ]
+        for texto, mensagem in casos:
+            with self.subTest(texto=texto):
+                with self.assertRaises(ValueError) as erro:
+                    ler_manifesto(texto)
+                self.assertEqual(str(erro.exception), mensagem)
+
+        with self.assertRaises(ValueError):
+            ler_manifesto(json.dumps({'documentos': [{'modelo': 1, 'formularios': []}] * 3}), limite=2)
+
+    def test_campos_do_formulario_web(self):
+        campos = campos_documento(MANIFESTO['documentos'][1])
+        self.assertEqual(campos['empresa'], 'Empresa X')
+        self.assertEqual(campos['data_formulario-0'], '2025-02-03')
+        self.assertEqual(campos['imagem_lanche-0_hash'], 'fotos/a.jpg')
+        self.assertEqual(campos['peso_almoco_1-0'], '200')
+
+        campos = campos_documento(MANIFESTO['documentos'][0])
+        self.assertEqual(campos.getlist('imagens-0_hash'), ['fotos/a.jpg', 'b.jpg'])
+        self.assertNotIn('data_formulario-0', campos)
+
+    def test_nomes_dos_arquivos(self):
+        documentos = [{'nome': 'Unidade A'}, {'nome': 'Empresa/X'}, {'nome': 'unidade a'}, {}, {'nome': ' .. '}]
+        self.assertEqual(
+            nomes_arquivos(documentos),
+            ['Unidade A.docx', 'Empresa_X.docx', 'unidade a-2.docx', 'documento-4.docx', 'documento-5.docx']
+        )
+
+    def test_imagem_extraida_uma_vez(self):
+        area = AreaTemporaria()
+        self.addCleanup(area.limpar)
+        imagens = ArquivoImagens(io.BytesIO(_zip_imagens()), area)
+        self.addCleanup(imagens.fechar)
+
+        registro = imagens.registro('fotos/a.jpg')
+        self.assertIs(imagens.registro('fotos/a.jpg'), registro)
+        self.assertIs(imagens.registro('./fotos/a.jpg'), registro)
+        self.assertEqual(registro.dados, _imagem('red'))
+        self.assertIsNone(imagens.registro('nada.jpg'))
+
+        with self.assertRaises(ValueError):
+            ArquivoImagens(io.BytesIO(b'nao e zip'), area)
+
+
+class LoteTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        for nome, valor in (('DIRETORIO_JOBS', self.pasta), ('WORKERS_JOBS', 0)):
+            patcher = mock.patch.object(job_queue, nome, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.pasta)
+        self.cliente = main.app.test_client()
+
+    def _enviar(self, manifesto, imagens=None):
+        dados = {'manifesto': json.dumps(manifesto)}
+        if imagens is not None:
+            dados['imagens'] = (io.BytesIO(imagens), 'imagens.zip')
+        return self.cliente.post('/lotes', data=dados)
+
+    def _executar_jobs(self):
+        while True:
+            job = job_queue._reservar_job('teste')
+            if job is None:
+                return
+            job_queue._executar_job(*job, 'teste')
+
+    def test_gera_todos_os_documentos(self):
+        resposta = self._enviar(MANIFESTO, _zip_imagens())
+        self.assertEqual(resposta.status_code, 202)
+        lote_id = resposta.get_json()['id']
+
+        self.assertEqual(self.cliente.get(f'/lotes/{lote_id}').get_json()['estado'], job_queue.ESTADO_PENDENTE)
+        self.assertEqual(self.cliente.get(f'/lotes/{lote_id}/download').status_code, 409)
+
+        self._executar_jobs()
+        lote = self.cliente.get(f'/lotes/{lote_id}').get_json()
+        self.assertEqual((lote['estado'], lote['concluidos'], lote['total']), (job_queue.ESTADO_CONCLUIDO, 3, 3))
+
+        download = self.cliente.get(f'/lotes/{lote_id}/download')
+        self.assertEqual(download.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(download.get_data())) as pacote:
+            self.assertEqual(pacote.namelist(), ['Unidade A.docx', 'Empresa_X.docx', 'Unidade A-2.docx'])
+            imagens = [len(Document(io.BytesIO(pacote.read(nome))).inline_shapes) for nome in pacote.namelist()]
+        self.assertEqual(imagens, [3, 1, 2])
+
+    def test_erros_por_documento(self):
+        # Imagem que nao esta no .zip nem e um hash
+        manifesto = {'documentos': [MANIFESTO['documentos'][0], {'modelo': 1, 'nome': 'B', 'formularios': [
+            {'unidade': 'B', 'data': '2025-02-01', 'legenda': 'x', 'imagens': ['nada.jpg']},
+        ]}]}
+        resposta = self._enviar(manifesto, _zip_imagens())
+        self.assertEqual(resposta.status_code, 400)
+        self.assertEqual(
+            resposta.get_json()['erro'], 'Documento 2 do lote (B.docx): Imagem "nada.jpg" não encontrada no arquivo do lote'
+        )
+
+        # Hash que nao esta no armazenamento: 409 com a imagem a reenviar
+        manifesto['documentos'][1]['formularios'][0]['imagens'] = ['ab' * 32]
+        resposta = self._enviar(manifesto, _zip_imagens())
+        self.assertEqual(resposta.status_code, 409)
+        self.assertEqual(resposta.get_json()['imagens_ausentes'], ['ab' * 32])
+
+        # Nenhum job fica na fila quando o lote e recusado
+        self.assertIsNone(job_queue._reservar_job('teste'))
+
+
+if __name__ == '__main__':
+    unittest.main()
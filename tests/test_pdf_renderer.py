@@ -0,0 +1,124 @@
+import io
+import re
+import unittest
+from docx.oxml import parse_xml
+from PIL import Image
+from functions.document_generator import gerar_pdf_modelo1
+from functions.document_generator2 import gerar_pdf_modelo2_empresa
+from functions.document_generator3 import gerar_pdf_modelo3_alipen
+from functions.pdf_renderer import LayoutNaoSuportado, ModeloPdf, _Conversor
+from functions.template_store import obter_template
+import main
+
+
+W = 'xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"'
+
+
+def _paragrafo(texto, rpr=''):
+    return f'<w:p {W}><w:r><w:rPr>{rpr}</w:rPr><w:t>{texto}</w:t></w:r></w:p>'
+
+
+def _tabela(celula, propriedades=''):
+    """Tabela de uma linha com duas celulas (a primeira com o conteudo informado) no estilo do modelo."""
+    return (
+        f'<w:tbl {W}><w:tblPr><w:tblStyle w:val="Tabelacomgrade"/>{propriedades}</w:tblPr>'
+        '<w:tblGrid><w:gridCol w:w="2000"/><w:gridCol w:w="2000"/></w:tblGrid>'
+        f'<w:tr><w:tc>{celula}</w:tc><w:tc><w:p/></w:tc></w:tr></w:tbl>'
+    )
+
+
+def _imagem(cor, tamanho=(640, 480)):
+    saida = io.BytesIO()
+    Image.new('RGB', tamanho, cor).save(saida, format='JPEG')
+    return saida.getvalue()
+
+
+def _paginas(pdf):
+    """Quantidade de paginas de um PDF completo (cabecalho, %%EOF e objetos /Page)."""
+    if not pdf.startswith(b'%PDF-') or not pdf.rstrip().endswith(b'%%EOF'):
+        raise AssertionError('Nao e um PDF completo')
+    return len(re.findall(rb'/Type /Page\b(?!s)', pdf))
+
+
+def _blocos(*elementos):
+    modelo = obter_template('modelo.docx').derivado(('pdf',), ModeloPdf)
+    return _Conversor(modelo, (), None, {}).blocos([parse_xml(elem) for elem in elementos], {}, {}, modelo.largura_texto)
+
+
+class LayoutTest(unittest.TestCase):
+
+    def test_tabela_aninhada_nao_suportada(self):
+        with self.assertRaises(LayoutNaoSuportado):
+            _blocos(_tabela(_tabela('<w:p/>')))
+
+    def test_quebra_de_pagina_em_celula_nao_suportada(self):
+        with self.assertRaises(LayoutNaoSuportado):
+            _blocos(_tabela('<w:p><w:r><w:br w:type="page"/></w:r></w:p>'))
+
+    def test_fonte_sem_metricas_nao_suportada(self):
+        with self.assertRaises(LayoutNaoSuportado):
+            _blocos(_paragrafo('Texto', '<w:rFonts w:ascii="Wingdings" w:hAnsi="Wingdings"/>'))
+
+    def test_bordas_da_tabela(self):
+        # Tabelacomgrade tem bordas simples de 0,5 pt; tblBorders direto com "none" as remove
+        com_grade, = _blocos(_tabela('<w:p/>'))
+        self.assertEqual(com_grade.linhas[0].celulas[0].bordas, ((0.5, None),) * 4)
+
+        sem_bordas = ''.join(f'<w:{lado} w:val="none"/>' for lado in ('top', 'left', 'bottom', 'right', 'insideH', 'insideV'))
+        sem_grade, = _blocos(_tabela('<w:p/>', f'<w:tblBorders>{sem_bordas}</w:tblBorders>'))
+        self.assertEqual(sem_grade.linhas[0].celulas[0].bordas, (None,) * 4)
+
+    def test_cabecalho_com_logotipo(self):
+        saida = io.BytesIO()
+        Image.new('RGB', (320, 240), (30, 60, 90)).save(saida, format='JPEG')
+        formulario = {'unidade': 'Unidade', 'data': '01.02.2025', 'legenda': 'Legenda', 'imagens': [saida.getvalue()]}
+        pdf = gerar_pdf_modelo1([formulario, formulario])
+
+        # Logotipo PNG do cabecalho com transparencia (mascara suave) e fontes do modelo
+        self.assertIn(b'/SMask', pdf)
+        self.assertIn(b'/BaseFont /Arial,Bold', pdf)
+        self.assertNotIn(b'Helvetica', pdf)
+
+
+class ModelosPdfTest(unittest.TestCase):
+
+    def test_modelo1(self):
+        formulario = {'unidade': 'Unidade', 'data': '01.02.2025', 'legenda': 'Legenda', 'imagens': [_imagem('red'), _imagem('blue', (480, 640))]}
+        self.assertEqual(_paginas(gerar_pdf_modelo1([formulario, formulario])), 2)
+
+    def test_modelo2(self):
+        # Capa e duas paginas por formulario
+        formularios = [{'legenda_lanche': 'Pao', 'imagem_lanche': _imagem('red')}, {'imagem_jantar_3': _imagem('blue', (480, 640))}]
+        pdf = gerar_pdf_modelo2_empresa('Empresa', '01/02/2025', '28/02/2025', ['03/02/2025', '04/02/2025'], formularios)
+        self.assertEqual(_paginas(pdf), 5)
+
+    def test_modelo3(self):
+        formularios = [{'legenda_cafe': 'Cafe', 'imagem_cafe': _imagem('red')}, {'imagem_jantar': _imagem('blue', (480, 640))}]
+        pdf = gerar_pdf_modelo3_alipen(['03/02/2025', '04/02/2025'], ['Unidade 1', 'Unidade 2'], formularios)
+        self.assertEqual(_paginas(pdf), 2)
+
+    def test_rotas_com_formato_pdf(self):
+        cliente = main.app.test_client()
+        pedidos = [
+            ('/gerar-documento', {'unidade-0': 'Unidade', 'data-0': '2025-02-01', 'legenda-0': 'Legenda', 'imagens-0': 'red'}, 1),
+            ('/gerar-documento2', {
+                'empresa': 'Empresa', 'data_inicio': '2025-02-01', 'data_fim': '2025-02-28',
+                'data_formulario-0': '2025-02-03', 'imagem_lanche-0': 'red',
+            }, 3),
+            ('/gerar-documento3', {'data_formulario-0': '2025-02-03', 'unidade_formulario-0': 'Unidade', 'imagem_cafe-0': 'red'}, 1),
+        ]
+        for rota, campos, paginas in pedidos:
+            with self.subTest(rota=rota):
+                dados = {
+                    campo: (io.BytesIO(_imagem(valor)), 'foto.jpg') if campo.startswith(('imagem', 'imagens')) else valor
+                    for campo, valor in campos.items()
+                }
+                resposta = cliente.post(f'{rota}?formato=pdf', data=dados)
+                self.assertEqual(resposta.status_code, 200)
+                self.assertEqual(resposta.mimetype, main.MIMETYPE_PDF)
+                self.assertEqual(_paginas(resposta.get_data()), paginas)
+                resposta.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import base64
+import gzip
+import io
+import re
+import unittest
+import zipfile
+from PIL import Image
+from functions.document_generator import gerar_documento_multiplo
+from functions.document_generator3 import gerar_documento_modelo3_alipen
+import main
+
+
+def _imagem(tamanho):
+    """JPEG com ruido, grande o bastante para ser reduzido nos dois perfis."""
+    saida = io.BytesIO()
+    Image.effect_noise(tamanho, 64).convert('RGB').save(saida, format='JPEG', quality=90)
+    return saida.getvalue()
+
+
+def _layout(documento):
+    """Tamanho (EMU) de cada imagem no document.xml, na ordem do documento."""
+    with zipfile.ZipFile(io.BytesIO(documento)) as pacote:
+        xml = pacote.read('word/document.xml').decode('utf-8')
+    return re.findall(r'<wp:extent cx="(\d+)" cy="(\d+)"/>', xml)
+
+
+def _bytes_midias(documento):
+    with zipfile.ZipFile(io.BytesIO(documento)) as pacote:
+        return sum(info.file_size for info in pacote.infolist() if info.filename.startswith('word/media/'))
+
+
+class PerfilPreviewTest(unittest.TestCase):
+
+    def test_modelo1_preview_com_layout_do_final(self):
+        formularios = [
+            {'unidade': 'A', 'data': '01.02.2025', 'legenda': 'L', 'imagens': [_imagem((2000, 1500)), _imagem((1200, 1800))]},
+            {'unidade': 'B', 'data': '02.02.2025', 'legenda': 'L', 'imagens': [_imagem((1600, 900))] * 3},
+        ]
+        final = gerar_documento_multiplo(formularios)
+        preview = gerar_documento_multiplo(formularios, perfil='preview')
+
+        self.assertEqual(len(_layout(final)), 5)
+        self.assertEqual(_layout(preview), _layout(final))
+        self.assertLess(_bytes_midias(preview), _bytes_midias(final))
+
+    def test_modelo3_preview_com_layout_do_final(self):
+        datas = ['2025-02-01', '2025-02-02']
+        imagens = [
+            {'imagem_cafe': _imagem((2000, 1500)), 'imagem_jantar': _imagem((1000, 1800))},
+            {'imagem_almoco': _imagem((1800, 1200))},
+        ]
+        final = gerar_documento_modelo3_alipen(datas, ['U1', 'U2'], imagens)
+        preview = gerar_documento_modelo3_alipen(datas, ['U1', 'U2'], imagens, perfil='preview')
+
+        self.assertEqual(len(_layout(final)), 3)
+        self.assertEqual(_layout(preview), _layout(final))
+        self.assertLess(_bytes_midias(preview), _bytes_midias(final))
+
+
+class IntervaloPreviewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cliente = main.app.test_client()
+
+    def _preview(self, intervalo):
+        dados = {}
+        for i in range(4):
+            dados[f'unidade-{i}'] = f'Unidade {i}'
+            dados[f'legenda-{i}'] = f'Legenda {i}'
+        return self.cliente.post(f'/preview-documento-pdf?formato=binario&intervalo={intervalo}', data=dados)
+
+    def _unidades(self, resposta):
+        with zipfile.ZipFile(io.BytesIO(resposta.get_data())) as pacote:
+            xml = pacote.read('word/document.xml').decode('utf-8')
+        return re.findall(r'Unidade \d', xml)
+
+    def test_somente_os_formularios_pedidos(self):
+        resposta = self._preview('1-2')
+        self.assertEqual(resposta.status_code, 200)
+        self.assertEqual(self._unidades(resposta), ['Unidade 1', 'Unidade 2'])
+
+        # Faixa alem do total e cortada no ultimo formulario
+        self.assertEqual(self._unidades(self._preview('3-9')), ['Unidade 3'])
+
+    def test_intervalo_invalido(self):
+        for intervalo in ('x', '3-1', '4'):
+            with self.subTest(intervalo=intervalo):
+                resposta = self._preview(intervalo)
+                self.assertEqual(resposta.status_code, 400)
+                self.assertIn('Intervalo', resposta.get_json()['erro'])
+
+
+class RespostaPreviewTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cliente = main.app.test_client()
+        self.dados = {'unidade-0': 'Unidade 0', 'legenda-0': 'Legenda 0'}
+
+    def test_json_base64_por_padrao(self):
+        resposta = self.cliente.post('/preview-documento-pdf', data=self.dados)
+        self.assertEqual(resposta.mimetype, 'application/json')
+        documento = base64.b64decode(resposta.get_json()['docx_b64'])
+        self.assertTrue(zipfile.is_zipfile(io.BytesIO(documento)))
+
+    def test_binario(self):
+        binario = self.cliente.post('/preview-documento-pdf?formato=binario', data=self.dados)
+        self.assertEqual(binario.mimetype, main.MIMETYPE_DOCX)
+        self.assertIsNone(binario.headers.get('Content-Encoding'))
+        self.assertEqual(binario.headers['Cache-Control'], 'no-store')
+
+        # Mesmo documento do JSON, agora sem base64
+        em_json = self.cliente.post('/preview-documento-pdf', data=self.dados)
+        self.assertEqual(binario.get_data(), base64.b64decode(em_json.get_json()['docx_b64']))
+
+        # Pedido pelo Accept em vez do parametro
+        aceito = self.cliente.post('/preview-documento-pdf', data=self.dados, headers={'Accept': main.MIMETYPE_DOCX})
+        self.assertEqual(aceito.get_data(), binario.get_data())
+
+    def test_gzip_somente_quando_reduz(self):
+        with main.app.test_request_context(headers={'Accept-Encoding': 'gzip'}, query_string={'formato': 'binario'}):
+            compressivel = b'PK' + b'0' * 10000
+            resposta = main.resposta_preview(compressivel)
+            self.assertEqual(resposta.headers['Content-Encoding'], 'gzip')
+            self.assertEqual(gzip.decompress(resposta.get_data()), compressivel)
+
+            # Documento ja comprimido (zip com midias): segue sem gzip
+            documento = gerar_documento_multiplo([{'unidade': 'A', 'data': '01.02.2025', 'legenda': 'L', 'imagens': [_imagem((800, 600))]}])
+            resposta = main.resposta_preview(documento)
+            self.assertIsNone(resposta.headers.get('Content-Encoding'))
+            self.assertEqual(resposta.get_data(), documento)
+            self.assertEqual(resposta.headers['Vary'], 'Accept-Encoding')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import threading
+import time
+import unittest
+from unittest import mock
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from functions import template_store
+from functions.template_store import obter_template
+
+
+class TemplateStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.caminho = os.path.join(self.pasta, 'modelo_teste.docx')
+        shutil.copyfile(os.path.join(template_store.DIRETORIO_MODELOS, 'modelo.docx'), self.caminho)
+        patcher = mock.patch.object(template_store, 'DIRETORIO_MODELOS', self.pasta)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.pasta)
+        self.addCleanup(template_store._templates.pop, 'modelo_teste.docx', None)
+
+    def test_recarrega_quando_mtime_muda(self):
+        template = obter_template('modelo_teste.docx')
+        self.assertIs(obter_template('modelo_teste.docx'), template)
+
+        mtime = os.stat(self.caminho).st_mtime_ns
+        os.utime(self.caminho, ns=(mtime + 10 ** 9, mtime + 10 ** 9))
+        recarregado = obter_template('modelo_teste.docx')
+        self.assertIsNot(recarregado, template)
+        self.assertIs(obter_template('modelo_teste.docx'), recarregado)
+
+    def test_novo_documento_independente(self):
+        template = obter_template('modelo_teste.docx')
+        primeiro = template.novo_documento()
+        segundo = template.novo_documento()
+
+        # Body vazio (so o sectPr) e document.xml proprio de cada documento
+        self.assertEqual([elem.tag.rsplit('}', 1)[1] for elem in primeiro.element.body], ['sectPr'])
+        primeiro.add_paragraph('so no primeiro')
+        self.assertEqual(len(segundo.element.body), 1)
+        self.assertIsNot(primeiro.part, segundo.part)
+
+        # Estilos, cabecalhos e midias vem do pacote parseado na carga, sem reler o .docx
+        self.assertIs(primeiro.part.part_related_by(RT.STYLES), segundo.part.part_related_by(RT.STYLES))
+
+    def test_derivado_calculado_uma_vez_com_concorrencia(self):
+        template = obter_template('modelo_teste.docx')
+        chamadas = []
+
+        def fabrica(_):
+            chamadas.append(1)
+            time.sleep(0.05)
+            return object()
+
+        resultados = []
+        threads = [threading.Thread(target=lambda: resultados.append(template.derivado(('teste',), fabrica))) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(chamadas), 1)
+        self.assertEqual(len({id(resultado) for resultado in resultados}), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
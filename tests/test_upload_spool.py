@@ -0,0 +1,94 @@
+import hashlib
+import io
+import os
+import shutil
+import tempfile
+import unittest
+import zipfile
+from unittest import mock
+from PIL import Image
+from werkzeug.datastructures import FileStorage
+from functions import upload_spool
+from functions.upload_spool import AreaTemporaria, registrar_upload
+import main
+
+
+def _imagem(tamanho=(320, 240)):
+    """JPEG com ruido: alguns KB, acima do limite de spool usado nos testes."""
+    saida = io.BytesIO()
+    Image.effect_noise(tamanho, 64).convert('RGB').save(saida, format='JPEG', quality=90)
+    return saida.getvalue()
+
+
+def _arquivo(dados):
+    return FileStorage(stream=io.BytesIO(dados), filename='foto.jpg')
+
+
+def _midias(documento):
+    with zipfile.ZipFile(io.BytesIO(documento)) as pacote:
+        return sorted(pacote.read(nome) for nome in pacote.namelist() if nome.startswith('word/media/'))
+
+
+class UploadSpoolTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        for nome, valor in (('LIMITE_SPOOL_KB', 1), ('DIRETORIO_SPOOL', self.pasta)):
+            patcher = mock.patch.object(upload_spool, nome, valor)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.addCleanup(shutil.rmtree, self.pasta)
+
+    def test_arquivo_pequeno_fica_em_memoria(self):
+        area = AreaTemporaria()
+        registro = registrar_upload(_arquivo(b'x' * 100), area)
+        self.assertIsNone(registro.caminho)
+        self.assertEqual(registro.dados, b'x' * 100)
+        self.assertIsNone(area.pasta)
+
+        self.assertIsNone(registrar_upload(_arquivo(b''), area))
+        self.assertIsNone(area.pasta)
+
+    def test_arquivo_grande_vai_para_o_disco(self):
+        dados = _imagem()
+        area = AreaTemporaria()
+        registro = registrar_upload(_arquivo(dados), area)
+
+        self.assertEqual(os.path.dirname(registro.caminho), area.pasta)
+        self.assertEqual(os.path.dirname(area.pasta), self.pasta)
+        self.assertEqual(registro.dados, dados)
+        self.assertEqual(registro.hash, hashlib.sha256(dados).digest())
+        self.assertEqual((registro.formato, registro.tamanho), ('JPEG', (320, 240)))
+        self.assertEqual(len(registro), len(dados))
+
+        area.limpar()
+        self.assertEqual(os.listdir(self.pasta), [])
+
+    def test_documento_igual_com_e_sem_spool(self):
+        fotos = [_imagem(), _imagem((240, 320))]
+        formulario = {'unidade-0': 'Unidade', 'data-0': '2025-02-01', 'legenda-0': 'Legenda'}
+        cliente = main.app.test_client()
+
+        def gerar():
+            dados = dict(formulario, **{'imagens-0': [(io.BytesIO(foto), f'{i}.jpg') for i, foto in enumerate(fotos)]})
+            resposta = cliente.post('/gerar-documento', data=dados)
+            self.assertEqual(resposta.status_code, 200)
+            documento = resposta.get_data()
+            resposta.close()
+            return documento
+
+        with mock.patch.object(upload_spool, 'criar_registro_imagem_arquivo', wraps=upload_spool.criar_registro_imagem_arquivo) as do_disco:
+            em_disco = gerar()
+        self.assertEqual(do_disco.call_count, 2)
+        # A area da requisicao e removida quando a resposta termina
+        self.assertEqual(os.listdir(self.pasta), [])
+
+        with mock.patch.object(upload_spool, 'LIMITE_SPOOL_KB', 1024):
+            em_memoria = gerar()
+        # As fotos chegam intactas ao documento (alem das imagens do proprio modelo)
+        self.assertLessEqual(set(fotos), set(_midias(em_disco)))
+        self.assertEqual(_midias(em_disco), _midias(em_memoria))
+
+
+if __name__ == '__main__':
+    unittest.main()